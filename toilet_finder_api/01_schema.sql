@@ -5,6 +5,7 @@ DROP TABLE IF EXISTS stations CASCADE;
 DROP TABLE IF EXISTS lines CASCADE;
 DROP TABLE IF EXISTS congestion_reports CASCADE;
 DROP TABLE IF EXISTS profiles CASCADE;
+DROP TABLE IF EXISTS schema_migrations;
 
 CREATE TABLE public.lines (id uuid NOT NULL DEFAULT gen_random_uuid(), name text NOT NULL UNIQUE, color text, max_cars integer DEFAULT 10, PRIMARY KEY (id));
 CREATE TABLE public.stations (id uuid NOT NULL DEFAULT gen_random_uuid(), name text NOT NULL UNIQUE, lat double precision, lng double precision, PRIMARY KEY (id));
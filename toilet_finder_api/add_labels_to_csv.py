@@ -1,28 +1,10 @@
 import pandas as pd
-import os
+from dataset import load_csv_safe  # 取り込み済みデータセット (python dataset.py) から読む
 
 # 対象ファイル
 INPUT_FILE = 'data/stations.csv'
 OUTPUT_FILE = 'data/stations.csv' # 上書き保存します
 
-def load_csv_safe(filepath):
-    if not os.path.exists(filepath):
-        return pd.DataFrame()
-    try:
-        # BOM対応かつ全列を文字列として読み込む
-        df = pd.read_csv(filepath, dtype=str, encoding='utf-8-sig').fillna('')
-        df.columns = df.columns.str.strip()
-        return df
-    except UnicodeDecodeError:
-        try:
-            df = pd.read_csv(filepath, dtype=str, encoding='cp932').fillna('')
-            df.columns = df.columns.str.strip()
-            return df
-        except:
-            return pd.DataFrame()
-    except:
-        return pd.DataFrame()
-
 def main():
     print(f"読み込み中: {INPUT_FILE} ...")
     df = load_csv_safe(INPUT_FILE)
@@ -0,0 +1,159 @@
+import math
+import os
+import time
+from collections import OrderedDict
+
+from starlette.responses import JSONResponse
+
+import metrics
+
+# ---------------------------------------------------------
+# 書き込み・検索エンドポイントの受け付け制御 (プロセス内)
+# ---------------------------------------------------------
+# 1つのクライアントが /report_congestion を連打したり /commuter/search で範囲検索を繰り返したりして
+# DB の枠を使い切らないように、ルーティングの前で次の2つを見る。
+#   - クライアントごとのトークンバケット (接続元 IP)。超えたら 429 + Retry-After
+#   - エンドポイントごとの同時実行数の上限。超えたら待たせずに 503 + Retry-After (負荷を落とす)
+# 状態はすべてメモリ上で、クライアントのバケットは ADMISSION_MAX_CLIENTS 件まで (古いものから捨てる)。
+# ミドルウェアはイベントループのスレッドだけで動くのでロックは要らない。
+#
+# 上限は ADMISSION_<名前>=毎秒の補充数,バースト,同時実行数 で変えられる (例 ADMISSION_REPORT_CONGESTION=0.5,10,32)。
+#
+# クライアントの見分け方
+#   - 既定は接続元 IP。X-Client-Key ヘッダーは認証されていないので、そのままでは使わない
+#     (値を毎回変えればバケットを作り直せてしまい、作り話のキーで本物のクライアントのバケットも押し出される)
+#   - ADMISSION_CLIENT_KEYS (カンマ区切り) に載っているキーだけは、IP の代わりにキーで見分ける (社内のバッチなど)
+#   - TRUST_PROXY=1 のときは X-Forwarded-For の右から TRUST_PROXY_HOPS 番目 (信頼するプロキシが付けたもの) を接続元にする。
+#     左側はクライアントが自由に書けるので使わない
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+ADMISSION_MAX_CLIENTS = int(os.environ.get("ADMISSION_MAX_CLIENTS", "10000") or 10000)
+# ロードバランサーの後ろで動かすときだけ X-Forwarded-For を見る (右から TRUST_PROXY_HOPS 番目 = 信頼するプロキシの数)
+TRUST_PROXY = os.environ.get("TRUST_PROXY", "0").strip().lower() in ("1", "true", "yes", "on")
+TRUST_PROXY_HOPS = max(1, int(os.environ.get("TRUST_PROXY_HOPS", "1") or 1))
+# X-Client-Key で見分けてよいキー (カンマ区切り。載っていないキーは無視して接続元 IP で見分ける)
+ADMISSION_CLIENT_KEYS = frozenset(k.strip() for k in os.environ.get("ADMISSION_CLIENT_KEYS", "").split(',') if k.strip())
+
+CLIENT_KEY_HEADER = b"x-client-key"
+FORWARDED_FOR_HEADER = b"x-forwarded-for"
+SHED_RETRY_AFTER = 1
+
+admission_requests = metrics.REGISTRY.register(metrics.Counter(
+    "toilet_api_admission_total", "受け付け制御の結果 (admitted / rate_limited / shed)", ("endpoint", "result")))
+admission_in_flight = metrics.REGISTRY.register(metrics.Gauge(
+    "toilet_api_admission_in_flight", "受け付け制御の対象エンドポイントで処理中のリクエスト数", ("endpoint",)))
+admission_clients = metrics.REGISTRY.register(metrics.Gauge(
+    "toilet_api_admission_clients", "トークンバケットを持っているクライアント数", ("endpoint",)))
+
+
+class TokenBucket:
+    """ rate: 1秒あたりの補充数, burst: 最大貯留数。待たずに取れるかだけを返す """
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+
+    def try_acquire(self, rate, burst, now):
+        """ 取れたら 0、取れなければ次の1個までの秒数 """
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / rate if rate > 0 else math.inf
+
+
+class Policy:
+    def __init__(self, name, path, method, rate, burst, concurrency, max_clients=ADMISSION_MAX_CLIENTS):
+        spec = os.environ.get(f"ADMISSION_{name.upper()}", "")
+        if spec:
+            rate, burst, concurrency = (float(v) for v in spec.split(','))
+        self.name = name
+        self.path = path
+        self.method = method
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.concurrency = int(concurrency)
+        self.max_clients = max_clients
+        self.in_flight = 0
+        self._buckets = OrderedDict()
+
+    def check_rate(self, client, now):
+        """ 0 なら通す。それ以外は Retry-After にする秒数 """
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.burst, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            admission_clients.set(self.path, value=len(self._buckets))
+        else:
+            self._buckets.move_to_end(client)
+        return bucket.try_acquire(self.rate, self.burst, now)
+
+
+POLICIES = [
+    # 混雑報告: 1クライアント 12件/分 (続けて5件まで)、同時に16件まで
+    Policy("report_congestion", "/report_congestion", "POST", rate=0.2, burst=5, concurrency=16),
+    # 近くのトイレ検索 (範囲検索): 1クライアント 毎秒2件 (続けて10件まで)、同時に8件まで
+    Policy("commuter_search", "/commuter/search", "GET", rate=2, burst=10, concurrency=8),
+]
+
+
+def forwarded_for(value, hops=TRUST_PROXY_HOPS):
+    """ X-Forwarded-For の右から hops 番目 (信頼するプロキシが付けた接続元)。足りなければ None """
+    addrs = [a.strip() for a in value.split(',') if a.strip()]
+    return addrs[-hops] if len(addrs) >= hops else None
+
+
+def client_key(scope, allowed_keys=ADMISSION_CLIENT_KEYS):
+    headers = dict(scope.get("headers", ()))
+    key = headers.get(CLIENT_KEY_HEADER)
+    if key and allowed_keys:
+        key = key.decode('latin-1')
+        if key in allowed_keys:
+            return "key:" + key
+    if TRUST_PROXY and headers.get(FORWARDED_FOR_HEADER):
+        addr = forwarded_for(headers[FORWARDED_FOR_HEADER].decode('latin-1'))
+        if addr:
+            return "ip:" + addr
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, policies=None):
+        self.app = app
+        self.policies = {(p.method, p.path): p for p in (POLICIES if policies is None else policies)}
+
+    async def __call__(self, scope, receive, send):
+        policy = None
+        if scope["type"] == "http" and ADMISSION_ENABLED:
+            policy = self.policies.get((scope.get("method"), scope.get("path")))
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        # 落とすときはクライアントのトークンを使わせない
+        if policy.in_flight >= policy.concurrency:
+            admission_requests.inc(policy.path, "shed")
+            response = JSONResponse({"detail": "Server busy, please retry"}, status_code=503,
+                                    headers={"Retry-After": str(SHED_RETRY_AFTER)})
+            await response(scope, receive, send)
+            return
+        wait = policy.check_rate(client_key(scope), time.monotonic())
+        if wait:
+            admission_requests.inc(policy.path, "rate_limited")
+            response = JSONResponse({"detail": "Too Many Requests"}, status_code=429,
+                                    headers={"Retry-After": str(max(1, math.ceil(min(wait, 3600))))})
+            await response(scope, receive, send)
+            return
+
+        admission_requests.inc(policy.path, "admitted")
+        policy.in_flight += 1
+        admission_in_flight.set(policy.path, value=policy.in_flight)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            policy.in_flight -= 1
+            admission_in_flight.set(policy.path, value=policy.in_flight)
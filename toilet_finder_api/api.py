@@ -1,25 +1,52 @@
+import startup  # 起動時間の計測はここから (最初に import する。詳細は startup.py)
 import os
+from contextlib import asynccontextmanager
 from typing import List, Optional
 from datetime import datetime, time, timedelta
 import math
-from fastapi import FastAPI, HTTPException, Query, Body, Depends
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Query, Body, Depends, Header, Request, Response
 from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
-import traceback
-
-load_dotenv()
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-
-# クライアント初期化
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("Warning: SUPABASE_URL or SUPABASE_KEY is missing.")
-    
-supabase: Client = create_client(SUPABASE_URL or "", SUPABASE_KEY or "")
-
-app = FastAPI()
+from fastapi.responses import PlainTextResponse, JSONResponse
+from starlette.datastructures import QueryParams
+from door_index import DoorIndex
+from db import LazyClient, backend_name, DATA_DIR
+import metrics
+import profiling
+import http_cache
+import circuit
+import admission
+import fastjson
+from applog import get_logger
+
+# クライアント初期化 (Supabase か CSV から作ったローカルの SQLite か。切り替えは DATA_BACKEND、詳細は db.py)
+# 実際に作るのは起動後の warm-up か最初のリクエスト (import を軽くするため)
+supabase = LazyClient()
+print(f"Data backend: {backend_name()}")
+
+# リクエスト処理中のログはキュー経由で別スレッドが書き出す (同じエラーの連発はまとめる。詳細は applog.py)
+log = get_logger("api")
+
+# 参照データの version (/lines・/stations の ETag に使う。決め方は http_cache.py)
+dataset_version = http_cache.DatasetVersion(supabase)
+# /lines・/stations のエンコード済みの本文 (ETag ごと)
+encoded_bodies = fastjson.EncodedBodies()
+
+# ドア単位の最寄りトイレ索引 (起動時に station_doors.csv から1回だけ構築)
+door_index = DoorIndex.from_csv(os.environ.get("STATION_DOORS_CSV", os.path.join(DATA_DIR, 'station_doors.csv')),
+                                os.path.join(DATA_DIR, 'data', 'stations.csv'),
+                                os.path.join(DATA_DIR, 'toilet_id_list.csv'))
+
+@asynccontextmanager
+async def lifespan(app):
+    # 起動したらバックグラウンドでキャッシュを温める (終わるまで /readyz は 503)
+    startup.STARTUP.start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
+from routers import commuter
+app.include_router(commuter.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,6 +55,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 障害時に古いデータで答えた応答に印を付ける (X-Data-Stale。詳細は circuit.py)
+app.add_middleware(circuit.StaleMarkerMiddleware)
+# 必要なときだけのプロファイル (X-Profile-Token / PROFILE_SAMPLE_RATE。GET /debug/profiles/{request_id})
+app.add_middleware(profiling.ProfilingMiddleware)
+# 書き込み・範囲検索の受け付け制御 (クライアントごとのレート制限と同時実行数の上限。詳細は admission.py)
+app.add_middleware(admission.AdmissionMiddleware)
+# リクエスト・DB問い合わせの計測 (GET /metrics で Prometheus 形式)。リクエストIDもここで決まるので一番外側に置く
+app.add_middleware(metrics.MetricsMiddleware)
 
 # -----------------------------------------------------------------
 # 型定義
@@ -50,6 +85,7 @@ class PredictionResult(BaseModel):
     longitude: Optional[float] = Field(default=None, description="目的地経度")
     location_type: str = Field(default="station", description="位置情報の精度")
     toilet_id: Optional[str] = Field(default=None, description="トイレID")
+    lookup_level: str = Field(default="car", description="door: ドア単位の索引で決定 / car: 号車単位の攻略データ")
 
 class LineInfo(BaseModel):
     id: str
@@ -59,6 +95,10 @@ class LineInfo(BaseModel):
     direction_minus_1_name: str
     max_cars: int = Field(default=10, description="最大号車数")
 
+# 自分で組み立てた行の型の確認用 (FastAPI の行ごとの検証の代わり。詳細は fastjson.py)
+PREDICTION_SHAPE = fastjson.Shape(PredictionResult)
+LINE_SHAPE = fastjson.Shape(LineInfo)
+
 class CongestionReport(BaseModel):
     toilet_id: str
     congestion_level: int = Field(..., ge=1, le=3, description="1:空き, 2:普通, 3:混雑")
@@ -139,9 +179,25 @@ def get_line_terminals(line_id: str):
             
         return term_1, term_m1
     except Exception as e:
-        print(f"[Warn] Terminal lookup failed: {e}")
+        log.warning("Terminal lookup failed: %s", e)
         return "方面1", "方面2"
 
+_line_names = {}
+
+def get_line_name(line_id: str) -> Optional[str]:
+    # 路線名は変わらないのでプロセス内で覚えておく (ドア索引の引き当て用)
+    if line_id in _line_names:
+        metrics.cache_hit("line_name")
+    else:
+        metrics.cache_miss("line_name")
+        try:
+            res = supabase.table("lines").select("name").eq("id", line_id).single().execute()
+            _line_names[line_id] = res.data.get('name') if res.data else None
+        except Exception as e:
+            log.warning("Line name lookup failed: %s", e)
+            return None
+    return _line_names[line_id]
+
 # -----------------------------------------------------------------
 # API実装
 # -----------------------------------------------------------------
@@ -150,8 +206,86 @@ def get_line_terminals(line_id: str):
 def read_root():
     return {"message": "Toilet Finder API is running!"}
 
-@app.get("/lines", response_model=List[LineInfo])
-def get_lines(lat: Optional[float] = None, lng: Optional[float] = None):
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def reference_cache(request: Request, response: Response):
+    # ETag が一致すれば DB を見ずに 304 (ヘッダーは例外の応答にも付ける)
+    try:
+        version = dataset_version.get()
+    except Exception as e:
+        # データバックエンドに届かず version が決まらないときはキャッシュさせずに続ける
+        log.warning("Dataset version unavailable: %s", e)
+        uncacheable(response)
+        return
+    etag = http_cache.etag_for(version, request.url.path, request.query_params)
+    headers = {"ETag": etag, "Cache-Control": http_cache.CACHE_CONTROL, "X-Dataset-Version": version}
+    if http_cache.not_modified(request.headers.get("if-none-match"), etag):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+def uncacheable(response: Response):
+    # エラーで空の結果を返すときは CDN やブラウザに残さない
+    response.headers["Cache-Control"] = http_cache.NO_STORE
+    for name in ("ETag", "X-Dataset-Version"):
+        if name in response.headers:
+            del response.headers[name]
+
+def reference_response(response: Response, build, shape=None):
+    # 同じ ETag (= 同じ version・パス・クエリ) ならエンコード済みの本文をそのまま返す
+    etag = response.headers.get("etag")
+    body = encoded_bodies.get(etag) if etag else None
+    if body is None:
+        body = fastjson.encode_rows(build(), shape)
+        # エラーで uncacheable にしたもの・障害中の古いデータから作ったものは覚えない
+        if etag and response.headers.get("etag") == etag and not circuit.is_stale():
+            encoded_bodies.put(etag, body)
+    return fastjson.respond(body, response.headers)
+
+@app.get("/version")
+def get_version():
+    return JSONResponse({"dataset_version": dataset_version.get(), "source": dataset_version.source(),
+                         "backend": backend_name()}, headers={"Cache-Control": "no-cache"})
+
+@app.get("/healthz", include_in_schema=False)
+def healthz():
+    # プロセスが動いていれば 200 (liveness。DB には触らない)
+    return JSONResponse({"status": "ok"}, headers={"Cache-Control": "no-store"})
+
+@app.get("/readyz", include_in_schema=False)
+def readyz():
+    # warm-up が終わるまで 503 (readiness)。起動の各段階の所要時間も返す
+    return JSONResponse(startup.STARTUP.report(), status_code=200 if startup.STARTUP.is_ready else 503,
+                        headers={"Cache-Control": "no-store"})
+
+def require_profile_token(x_profile_token: Optional[str] = Header(None)):
+    # PROFILE_TOKEN が未設定ならプロファイルの取得自体を無効にする
+    if not profiling.PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiling.token_matches(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+@app.get("/debug/profiles", include_in_schema=False, dependencies=[Depends(require_profile_token)])
+def list_profiles():
+    return profiling.PROFILES.summaries()
+
+@app.get("/debug/profiles/{request_id}", include_in_schema=False, dependencies=[Depends(require_profile_token)])
+def get_profile(request_id: str, format: str = Query("json", pattern="^(json|collapsed|speedscope)$")):
+    profile = profiling.PROFILES.get(request_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return PlainTextResponse(profiling.to_collapsed(profile))
+    if format == "speedscope":
+        return JSONResponse(profiling.to_speedscope(profile))
+    return profiling.summary(profile)
+
+@app.get("/lines", response_model=List[LineInfo], dependencies=[Depends(reference_cache)])
+def get_lines(response: Response, lat: Optional[float] = None, lng: Optional[float] = None):
+    return reference_response(response, lambda: build_lines(response, lat, lng), LINE_SHAPE)
+
+def build_lines(response: Response, lat: Optional[float], lng: Optional[float]):
     try:
         # 全路線データを取得（キャッシュとして利用）
         all_lines = supabase.table("lines").select("*").execute().data
@@ -189,8 +323,9 @@ def get_lines(lat: Optional[float] = None, lng: Optional[float] = None):
                     return []
 
             except Exception as e:
-                print(f"[Warning] Nearest station search error: {e}")
+                log.warning("Nearest station search error: %s", e)
                 # エラー時は空リスト（何も表示しない）
+                uncacheable(response)
                 return []
 
         # 結果の構築
@@ -217,11 +352,15 @@ def get_lines(lat: Optional[float] = None, lng: Optional[float] = None):
         return result_lines
 
     except Exception as e:
-        print(f"[Error] /lines failed: {e}")
+        log.exception("/lines failed: %s", e)
+        uncacheable(response)
         return []
 
-@app.get("/stations", response_model=List[dict])
-def get_stations(line_id: str):
+@app.get("/stations", response_model=List[dict], dependencies=[Depends(reference_cache)])
+def get_stations(response: Response, line_id: str):
+    return reference_response(response, lambda: build_stations(line_id))
+
+def build_stations(line_id: str):
     patterns = [
         "station_order, dir_1_label, dir_m1_label, stations!line_stations_station_id_fkey(id, name, lat, lng)",
         "station_order, stations!line_stations_station_id_fkey(id, name, lat, lng)",
@@ -252,7 +391,8 @@ def get_stations(line_id: str):
     return stations
 
 @app.get("/predict", response_model=List[PredictionResult])
-def predict_best_station(line_id: str, current_station_id: str, user_car: int, direction: int = Query(1)):
+def predict_best_station(line_id: str, current_station_id: str, user_car: int, direction: int = Query(1),
+                         door: Optional[int] = Query(None, ge=1, description="乗っているドア番号 (号車内で1始まり)")):
     try:
         try:
             current_link_res = supabase.table("line_stations").select("*").eq("line_id", line_id).eq("station_id", current_station_id).single().execute()
@@ -278,6 +418,8 @@ def predict_best_station(line_id: str, current_station_id: str, user_car: int, d
             if n1: target_ids.append({'id': n1, 'stop_order': 1})
             if n2: target_ids.append({'id': n2, 'stop_order': 2})
 
+        line_name = get_line_name(line_id) if door is not None and len(door_index) else None
+
         results = []
         
         for target in target_ids:
@@ -311,6 +453,21 @@ def predict_best_station(line_id: str, current_station_id: str, user_car: int, d
                     if dist < min_dist:
                         min_dist = dist
                         best_cand = cand
+
+                # ドア単位の索引のトイレが、いま使える攻略データの行にあるときだけそれを優先する
+                # (攻略データにないトイレは号車・方向・設備が分からないので、上の号車単位の結果のままにする)
+                lookup_level = "car"
+                door_toilet_id = door_index.lookup(st_data['name'], line_name, direction, user_car, door) if line_name else None
+                if door_toilet_id:
+                    same = [c for c in strategies if c.get('target_toilet_id') == door_toilet_id
+                            and is_time_available(str(c.get('available_time', 'ALL')))]
+                    if same:
+                        lookup_level = "door"
+                        best_cand = same[0]
+                        # 歩く距離は乗っているドアの位置から数える
+                        door_pos = door_index.door_position(st_data['name'], line_name, direction, user_car, door)
+                        min_dist = abs((door_pos if door_pos is not None else user_car)
+                                       - safe_float(best_cand.get('car_pos') or best_cand.get('target_car_number'), 0.0))
                 
                 wc, tc, fac, crd, msg = 99.0, 1.0, "調査中", 3, ""
                 realtime_crowd = None
@@ -355,6 +512,8 @@ def predict_best_station(line_id: str, current_station_id: str, user_car: int, d
                                 
                         except Exception as e:
                             pass
+                        if not toilet_name:
+                            toilet_name = door_index.toilet_names.get(toilet_id)
 
                 if wc < 0.5: msg = "降りてすぐ目の前！"
                 elif wc <= 2.0: msg = "かなり近いです"
@@ -379,16 +538,17 @@ def predict_best_station(line_id: str, current_station_id: str, user_car: int, d
                     "latitude": dest_lat,
                     "longitude": dest_lng,
                     "location_type": location_type,
-                    "toilet_id": toilet_id
+                    "toilet_id": toilet_id,
+                    "lookup_level": lookup_level
                 })
-            except Exception as e:
-                traceback.print_exc()
+            except Exception:
+                log.exception("/predict failed for station %s", target['id'])
                 continue
 
-        return results
+        return fastjson.respond(fastjson.encode_rows(results, PREDICTION_SHAPE))
 
-    except Exception as e:
-        traceback.print_exc()
+    except Exception:
+        log.exception("/predict failed")
         return []
 
 @app.post("/report_congestion")
@@ -402,9 +562,51 @@ def report_congestion(report: CongestionReport):
         supabase.table("congestion_reports").insert(data).execute()
         return {"status": "success", "message": "Report received"}
     except Exception as e:
-        print(f"Report Error: {e}")
+        log.exception("Report Error: %s", e)
         raise HTTPException(status_code=500, detail="Failed to save report")
 
+# -----------------------------------------------------------------
+# 起動時の warm-up (登録した順に実行。終わったら /readyz が 200 になる)
+# client は必須: DB クライアントが作れるまで ready にしない
+# -----------------------------------------------------------------
+
+@startup.STARTUP.step("client", required=True)
+def warm_client():
+    # DB クライアントを作る (Supabase のライブラリの import、REFDATA_DIR のスナップショットを開くのもここ)
+    supabase.resolve()
+
+@startup.STARTUP.step("dataset_version")
+def warm_dataset_version():
+    dataset_version.get()
+
+@startup.STARTUP.step("reference_bodies")
+def warm_reference_bodies():
+    # /lines と全路線の /stations の本文を、リクエストと同じ ETag で encoded_bodies に入れておく
+    version = dataset_version.get()
+    response = Response()
+    lines = build_lines(response, None, None)
+    if response.headers.get("cache-control") == http_cache.NO_STORE:
+        raise RuntimeError("/lines could not be built")
+    encoded_bodies.put(http_cache.etag_for(version, "/lines", QueryParams()), fastjson.encode_rows(lines, LINE_SHAPE))
+    for line in lines:
+        get_line_name(line['id'])
+        try:
+            body = fastjson.encode_rows(build_stations(line['id']))
+        except HTTPException:
+            continue
+        encoded_bodies.put(http_cache.etag_for(version, "/stations", QueryParams({"line_id": line['id']})), body)
+
+startup.STARTUP.mark("import")
+
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Toilet Finder API を起動する")
+    parser.add_argument('--host', default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument('--port', type=int, default=int(os.environ.get("PORT", "8000") or 8000))
+    parser.add_argument('--reload', action='store_true',
+                        default=os.environ.get("API_RELOAD", "0").strip().lower() in ("1", "true", "yes", "on"),
+                        help="ソースの変更で再起動する (開発用。API_RELOAD=1 でも有効)")
+    args = parser.parse_args()
+    # reload のときだけ import 文字列で渡す (app をそのまま渡せば api.py をもう1回 import しない)
+    uvicorn.run("api:app" if args.reload else app, host=args.host, port=args.port, reload=args.reload)
\ No newline at end of file
@@ -0,0 +1,177 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+
+# ---------------------------------------------------------
+# API 用の構造化ログ (リクエストのスレッドでは書き出さない)
+# ---------------------------------------------------------
+# リクエスト処理中の log.warning() / log.exception() はキューに積むだけで、
+# 標準エラーへの書き出し (と例外のスタックトレースの整形) はバックグラウンドのスレッドが行う。
+#
+# - 1行1レコードの JSON (LOG_FORMAT=text で人が読む形式)。request_id / endpoint を自動で付ける
+# - 同じ種類のレコード (ロガー・レベル・メッセージの書式・例外の型) は LOG_RATE_WINDOW 秒あたり LOG_RATE_LIMIT 件まで。
+#   超えた分は数だけ数えて、次に出たレコードの suppressed に載せる (障害時に同じトレースが何千行も出ないように)
+# - INFO 以下は LOG_SAMPLE_RATE の割合だけ残す
+# - キューがあふれたら捨てて数える (リクエストを待たせない)
+#
+#   from applog import get_logger
+#   log = get_logger(__name__)
+#   log.warning("terminal lookup failed: %s", e)   # f-string ではなく % の引数にすると同じ種類としてまとまる
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0") or 1.0)
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", "5") or 5)
+LOG_RATE_WINDOW = float(os.environ.get("LOG_RATE_WINDOW", "60") or 60)
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000") or 10000)
+
+ROOT_LOGGER = "toilet_api"
+MAX_RATE_KEYS = 1000
+
+log_suppressed = metrics.REGISTRY.register(metrics.Counter(
+    "toilet_api_log_records_suppressed_total", "レート制限・サンプリングで出さなかったログ", ("logger", "level")))
+log_dropped = metrics.REGISTRY.register(metrics.Counter(
+    "toilet_api_log_records_dropped_total", "キューがあふれて捨てたログ"))
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class RequestContextFilter(logging.Filter):
+    """ 処理中のリクエストの ID とエンドポイントをレコードに付ける """
+
+    def filter(self, record):
+        request = metrics.current_request()
+        record.request_id = request.request_id if request else None
+        record.endpoint = request.endpoint if request else None
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """ 同じ種類のレコードを window 秒あたり limit 件までにする (固定窓) """
+
+    def __init__(self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW, sample_rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.sample_rate = sample_rate
+        self._state = {}    # key -> [窓の開始, 件数, 抑止した件数]
+        self._lock = threading.Lock()
+
+    def _suppress(self, record):
+        log_suppressed.inc(record.name, record.levelname)
+        return False
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return self._suppress(record)
+        exc_type = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else None
+        key = (record.name, record.levelno, str(record.msg), exc_type)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None:
+                if len(self._state) >= MAX_RATE_KEYS:
+                    self._state.clear()
+                state = self._state[key] = [now, 0, 0]
+            elif now - state[0] >= self.window:
+                state[0], state[1] = now, 0
+            if state[1] >= self.limit:
+                state[2] += 1
+                return self._suppress(record)
+            state[1] += 1
+            record.suppressed, state[2] = state[2], 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # メッセージだけ先に確定させる。スタックトレースの整形はリスナーのスレッドで行うので exc_info は残す
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_dropped.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, 'request_id', None),
+            "endpoint": getattr(record, 'endpoint', None),
+        }
+        if getattr(record, 'suppressed', 0):
+            entry["suppressed"] = record.suppressed
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc_type"] = record.exc_info[0].__name__ if record.exc_info[0] else None
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s %(endpoint)s] %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            text += f" (同種のログ {record.suppressed} 件を省略)"
+        return text
+
+
+def setup(stream=None):
+    """ toilet_api 配下のロガーをキュー経由にする (何度呼んでも1回だけ) """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+
+        handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        handler.addFilter(RateLimitFilter())
+        handler.addFilter(RequestContextFilter())
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(handler)
+        root.propagate = False
+
+        _listener = QueueListener(handler.queue, output)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """ キューに残ったログを書き出してリスナーを止める """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name):
+    setup()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
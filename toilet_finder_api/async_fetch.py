@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+# ---------------------------------------------------------
+# 外部API収集用の非同期HTTPクライアント
+# ---------------------------------------------------------
+# - ホストごとのレートリミッタ (トークンバケット)
+# - ジッター付き指数バックオフでのリトライ
+# - ディスク上のコンテンツアドレス型レスポンスキャッシュ
+#
+# URLは呼び出し側が渡すので、環境変数でローカルのスタブサーバー
+# (dev_stub_server.py) に向ければオフラインで動作確認できる。
+
+DEFAULT_CACHE_DIR = '.cache/http'
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """ 1ホスト分のレート制限。rate: 1秒あたりの補充数, burst: 最大貯留数 """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, cost=1.0):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+
+class HostRateLimiter:
+    """ ホスト名ごとに TokenBucket を持つ。未登録ホストは default_rate で作る """
+
+    def __init__(self, rates=None, default_rate=1.0, default_burst=1):
+        self.rates = dict(rates or {})
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.buckets = {}
+
+    def bucket_for(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            rate, burst = self.rates.get(host, (self.default_rate, self.default_burst))
+            self.buckets[host] = TokenBucket(rate, burst)
+        return self.buckets[host]
+
+    async def acquire(self, url):
+        await self.bucket_for(url).acquire()
+
+
+class ResponseCache:
+    """ リクエスト内容のSHA-256をキーにしたディスクキャッシュ (成功レスポンスのみ保存) """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(method, url, params=None, body=None):
+        material = json.dumps(
+            {"method": method, "url": url, "params": params or {}, "body": body},
+            ensure_ascii=False, sort_keys=True,
+        )
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+class FetchError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncFetcher:
+    """ aiohttp セッション + レート制限 + リトライ + キャッシュ """
+
+    def __init__(self, limiter=None, cache=None, max_retries=3, base_delay=2.0,
+                 max_delay=60.0, timeout=100, headers=None):
+        self.limiter = limiter or HostRateLimiter()
+        self.cache = cache
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.headers = headers or {}
+        self.session = None
+        self.request_count = 0
+        self.retry_count = 0
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(timeout=self.timeout, headers=self.headers)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def _backoff(self, attempt):
+        # Full Jitter: 0 〜 min(max_delay, base * 2^attempt) の一様乱数
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def request_json(self, method, url, params=None, json_body=None, cache_url=None):
+        """ JSONレスポンスを返す。cache_url を渡すとキャッシュキーにはそちらを使う (APIキー除外用) """
+        key = None
+        if self.cache is not None:
+            key = ResponseCache.make_key(method, cache_url or url, params, json_body)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(url)
+            self.request_count += 1
+            try:
+                async with self.session.request(method, url, params=params, json=json_body) as resp:
+                    if resp.status == 200:
+                        data = await resp.json(content_type=None)
+                        if key is not None:
+                            self.cache.put(key, data)
+                        return data
+                    text = await resp.text()
+                    last_error = FetchError(f"HTTP {resp.status}: {text[:80]}", status=resp.status)
+                    if resp.status not in RETRY_STATUS:
+                        raise last_error
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                last_error = FetchError(f"{type(e).__name__}: {e}")
+
+            if attempt < self.max_retries:
+                self.retry_count += 1
+                await asyncio.sleep(self._backoff(attempt))
+
+        raise last_error
+
+    async def get_json(self, url, params=None, cache_url=None):
+        return await self.request_json('GET', url, params=params, cache_url=cache_url)
+
+    async def post_json(self, url, json_body, cache_url=None):
+        return await self.request_json('POST', url, json_body=json_body, cache_url=cache_url)
@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from local_backend import LocalClient, LocalBackendError, LOCAL_DB_PATH, BASE_DIR  # noqa: E402
+
+# ---------------------------------------------------------
+# Supabase (PostgREST) 互換のローカルスタブ
+# ---------------------------------------------------------
+# CSV から作ったローカルの SQLite (local_backend.py) を /rest/v1/<table> で返す。
+# 本物の supabase-py クライアントをそのまま向けられるので、api.py を実際の通信経路ごと計測できる。
+# 1回の問い合わせごとに --latency-ms (+ --jitter-ms) だけ待って、本番のネットワーク往復を再現する。
+#
+#   python bench/postgrest_stub.py --port 54321 --latency-ms 15
+#   SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=stub python api.py
+#
+# GET  /__stats        テーブルごとの問い合わせ回数
+# POST /__stats/reset  回数をリセット
+
+OPERATORS = {'eq': 'eq', 'neq': 'neq', 'gt': 'gt', 'gte': 'gte', 'lt': 'lt', 'lte': 'lte', 'in': 'in_', 'is': 'is_'}
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+_IN_LIST = re.compile(r'^\((.*)\)$')
+
+
+def _value(text):
+    """ PostgREST のフィルタ値 (文字列) を SQLite に渡す値にする """
+    if text in ('true', 'false'):
+        return text == 'true'
+    if text == 'null':
+        return None
+    return text
+
+
+def apply_query(query, params):
+    """ ?col=eq.1&order=station_order.desc&limit=1 をクエリビルダの呼び出しに直す """
+    for key, raw in params:
+        if key in RESERVED_PARAMS:
+            continue
+        op, _, value = raw.partition('.')
+        if op not in OPERATORS:
+            raise LocalBackendError(f'"failed to parse filter ({raw})"', code="PGRST100")
+        if op == 'in':
+            m = _IN_LIST.match(value)
+            items = [v.strip().strip('"') for v in m.group(1).split(',')] if m and m.group(1) else []
+            query = query.in_(key, items)
+        else:
+            query = getattr(query, OPERATORS[op])(key, _value(value))
+    for key, raw in params:
+        if key == 'order':
+            for term in raw.split(','):
+                parts = term.split('.')
+                query = query.order(parts[0], desc='desc' in parts[1:])
+        elif key == 'limit':
+            query = query.limit(int(raw))
+    return query
+
+
+class PostgrestStubHandler(BaseHTTPRequestHandler):
+    client = None
+    latency = 0.0
+    jitter = 0.0
+    calls = Counter()
+    calls_lock = threading.Lock()
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, e):
+        status = {"PGRST116": 406, "42P01": 404}.get(e.code, 400)
+        self._send_json(status, {"code": e.code, "message": e.message, "details": None, "hint": None})
+
+    def _table(self):
+        url = urlsplit(self.path)
+        m = re.match(r'^/rest/v1/(\w+)$', url.path)
+        return (m.group(1) if m else None), parse_qsl(url.query, keep_blank_values=True)
+
+    def _wait(self, table):
+        with self.calls_lock:
+            self.calls[table] += 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def do_GET(self):
+        if self.path.startswith('/__stats'):
+            with self.calls_lock:
+                self._send_json(200, {"calls": dict(self.calls), "total": sum(self.calls.values())})
+            return
+        table, params = self._table()
+        if table is None:
+            self._send_json(404, {"error": "not found"})
+            return
+        self._wait(table)
+        try:
+            select = unquote(dict(params).get('select', '*'))
+            query = apply_query(self.client.table(table).select(select), params)
+            if 'vnd.pgrst.object' in self.headers.get('Accept', ''):
+                query = query.single()
+            self._send_json(200, query.execute().data)
+        except LocalBackendError as e:
+            self._send_error(e)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.end_headers()
+
+    def do_POST(self):
+        if self.path.startswith('/__stats/reset'):
+            with self.calls_lock:
+                self.calls.clear()
+            self._send_json(200, {"status": "reset"})
+            return
+        table, _ = self._table()
+        if table is None:
+            self._send_json(404, {"error": "not found"})
+            return
+        self._wait(table)
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {"code": "PGRST102", "message": "Empty or invalid json"})
+            return
+        try:
+            rows = self.client.table(table).insert(payload).execute().data
+        except LocalBackendError as e:
+            self._send_error(e)
+            return
+        except Exception as e:
+            self._send_json(409, {"code": "23503", "message": str(e), "details": None, "hint": None})
+            return
+        if 'return=minimal' in self.headers.get('Prefer', ''):
+            self.send_response(201)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self._send_json(201, rows)
+
+
+def serve(host='127.0.0.1', port=54321, latency_ms=0.0, jitter_ms=0.0, db_path=LOCAL_DB_PATH, base_dir=BASE_DIR):
+    """ スタブを別スレッドで起動して server を返す (計測スクリプトから使う) """
+    PostgrestStubHandler.client = LocalClient(db_path, base_dir=base_dir)
+    PostgrestStubHandler.latency = latency_ms / 1000
+    PostgrestStubHandler.jitter = jitter_ms / 1000
+    server = ThreadingHTTPServer((host, port), PostgrestStubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Supabase (PostgREST) 互換のローカルスタブ")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="問い合わせ1回ごとに待つミリ秒 (本番の往復時間)")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="latency に加える 0〜N ミリ秒のゆらぎ")
+    parser.add_argument('--data-dir', default=BASE_DIR, help="CSV の置き場所 (合成データセットを返すとき)")
+    parser.add_argument('--db', default=None, help="ローカルバックエンドのスナップショット")
+    args = parser.parse_args()
+
+    db_path = args.db or (LOCAL_DB_PATH if args.data_dir == BASE_DIR else os.path.join(args.data_dir, 'local.sqlite'))
+    server = serve(args.host, args.port, args.latency_ms, args.jitter_ms, db_path, args.data_dir)
+    print(f"PostgREST スタブ起動: http://{args.host}:{args.port}/rest/v1 (latency={args.latency_ms}ms +{args.jitter_ms}ms)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,489 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import timeit
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BASE_DIR)
+
+import db  # noqa: E402
+from local_backend import LocalClient, LOCAL_DB_PATH  # noqa: E402
+
+# ---------------------------------------------------------
+# API のエンドツーエンド計測
+# ---------------------------------------------------------
+# 1. ヘルパー関数のマイクロベンチ (1回あたりの ns)
+# 2. 朝ラッシュを模したリクエスト混合を一定の並列度で流す負荷生成
+#    -> エンドポイントごとの p50/p95/p99 と、1リクエストあたりのDB問い合わせ回数
+# 3. 同じリクエストを1件ずつ流したときの、エンドポイントごとの1リクエストあたりのCPU時間
+#    (DB の待ち時間は含まない。シリアライズなどの Python 側の処理の重さを見る)
+# 4. bench/baseline.json と比べて、悪化していれば終了コード1
+#
+# 既定では api.py をプロセス内で (ASGI を直接呼んで) 動かし、DB はローカルバックエンドに
+# 問い合わせ1回ごとの待ち時間 (--latency-ms) を足したもの。
+#   python bench/run_bench.py                     # 計測して baseline と比較
+#   python bench/run_bench.py --save-baseline     # 今回の結果を baseline にする
+#   python bench/run_bench.py --via-stub          # supabase-py -> PostgREST スタブ (HTTP) 経由
+#   python bench/run_bench.py --url http://127.0.0.1:8000 --stub-url http://127.0.0.1:54321
+#                                                 # 起動済みの API を HTTP で叩く (API は TRUST_PROXY=1 で起動する)
+
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+
+# 朝ラッシュのリクエスト比率 (乗車中の /predict が大半、起動直後の /lines・/stations が続く)
+RUSH_HOUR_MIX = {
+    'predict': 50,
+    'predict_door': 10,
+    'stations': 12,
+    'lines': 4,
+    'lines_near': 6,
+    'report_congestion': 10,
+    'commuter_search': 8,
+}
+
+# 比較の許容幅 (計測のゆらぎ分)
+LATENCY_TOLERANCE = 0.25
+MICRO_TOLERANCE = 0.5
+CPU_TOLERANCE = 0.3
+MIN_DELTA_MS = 5.0        # これより小さい差は (比率が大きくても) 悪化と見なさない
+MIN_SAMPLES_P99 = 100     # 件数が少ないエンドポイントの p99 はゆらぎが大きいので比べない
+BENCH_USERS = 500         # リクエストを送る利用者の数 (接続元 IP。受け付け制御のレート制限はこの単位)
+
+_db_calls = contextvars.ContextVar('bench_db_calls', default=None)
+
+
+# ---------------------------------------------------------
+# DB 問い合わせの記録 (execute() 1回ごとに待ち時間を足して数える)
+# ---------------------------------------------------------
+
+class RecordingQuery:
+    def __init__(self, recorder, table, query):
+        self._recorder = recorder
+        self._table = table
+        self._query = query
+
+    def __getattr__(self, name):
+        attr = getattr(self._query, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # ビルダーのメソッドは (新しい) ビルダーを返すので包み直す
+            return RecordingQuery(self._recorder, self._table, result) if hasattr(result, 'execute') else result
+        return call
+
+    def execute(self):
+        return self._recorder.execute(self._table, self._query)
+
+
+class RecordingClient:
+    def __init__(self, client, latency_ms=0.0, jitter_ms=0.0):
+        self.client = client
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        return RecordingQuery(self, name, self.client.table(name))
+
+    def execute(self, table, query):
+        calls = _db_calls.get()
+        if calls is not None:
+            calls.append(table)
+        with self._lock:
+            self.calls[table] += 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        return query.execute()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+# ---------------------------------------------------------
+# 負荷の組み立て
+# ---------------------------------------------------------
+
+def build_workload(client, count, seed=1):
+    """ スナップショットから実在のID・座標を拾って、朝ラッシュの混合リクエストを count 件作る """
+    rng = random.Random(seed)
+    lines = client.table("lines").select("id, max_cars").execute().data
+    links = client.table("line_stations").select("line_id, station_id").execute().data
+    toilets = client.table("toilets").select("id, lat, lng").execute().data
+    located = [t for t in toilets if t['lat'] is not None and t['lng'] is not None]
+    stations = client.table("stations").select("lat, lng").execute().data
+    stations = [s for s in stations if s['lat'] is not None and s['lng'] is not None]
+    max_cars = {line['id']: line['max_cars'] or 10 for line in lines}
+
+    # 利用者は一部の大きな駅に集中する (Zipf 風の重み)
+    rng.shuffle(links)
+    link_weights = [1 / (rank + 1) ** 0.8 for rank in range(len(links))]
+
+    names = list(RUSH_HOUR_MIX)
+    weights = list(RUSH_HOUR_MIX.values())
+    workload = []
+    for kind in rng.choices(names, weights, k=count):
+        if kind.startswith('predict'):
+            link = rng.choices(links, link_weights)[0]
+            params = {"line_id": link['line_id'], "current_station_id": link['station_id'],
+                      "user_car": rng.randint(1, max_cars.get(link['line_id'], 10)), "direction": rng.choice([1, -1])}
+            if kind == 'predict_door':
+                params["door"] = rng.randint(1, 4)
+            workload.append((kind, 'GET', '/predict', params, None))
+        elif kind == 'stations':
+            link = rng.choices(links, link_weights)[0]
+            workload.append((kind, 'GET', '/stations', {"line_id": link['line_id']}, None))
+        elif kind == 'lines':
+            workload.append((kind, 'GET', '/lines', {}, None))
+        elif kind == 'lines_near':
+            s = rng.choice(stations)
+            workload.append((kind, 'GET', '/lines', {"lat": s['lat'] + rng.uniform(-0.003, 0.003),
+                                                     "lng": s['lng'] + rng.uniform(-0.003, 0.003)}, None))
+        elif kind == 'report_congestion':
+            t = rng.choice(toilets)
+            workload.append((kind, 'POST', '/report_congestion', {},
+                             {"toilet_id": t['id'], "congestion_level": rng.randint(1, 3)}))
+        else:
+            t = rng.choice(located)
+            workload.append((kind, 'GET', '/commuter/search', {"lat": t['lat'] + rng.uniform(-0.01, 0.01),
+                                                               "lng": t['lng'] + rng.uniform(-0.01, 0.01)}, None))
+    return workload
+
+
+# ---------------------------------------------------------
+# リクエストの送信 (プロセス内 ASGI / HTTP)
+# ---------------------------------------------------------
+
+def client_addr(i):
+    user = i % BENCH_USERS
+    return f"10.0.{user // 256}.{user % 256}"
+
+
+async def asgi_request(app, method, path, params, body, client=None):
+    """ httpx などを使わずに ASGI アプリを直接呼ぶ。(status, 本文) を返す """
+    payload = json.dumps(body).encode('utf-8') if body is not None else b''
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": urlencode(params).encode(),
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode())],
+        "client": (client or "127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    sent = False
+    status = 0
+    chunks = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+async def run_inprocess(app, workload, concurrency):
+    results = []
+    queue = iter(enumerate(workload))
+
+    async def worker():
+        for i, (kind, method, path, params, body) in queue:
+            calls = []
+            _db_calls.set(calls)
+            started = time.perf_counter()
+            try:
+                status, _ = await asgi_request(app, method, path, params, body, client_addr(i))
+            except Exception:
+                status = 599
+            results.append((kind, status, (time.perf_counter() - started) * 1000, len(calls)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+async def cpu_per_request(app, workload):
+    """ 1件ずつ流して、エンドポイントごとの1リクエストあたりのCPU時間 (プロセス全体の process_time) を測る """
+    used = defaultdict(float)
+    counts = Counter()
+    for i, (kind, method, path, params, body) in enumerate(workload):
+        started = time.process_time()
+        await asgi_request(app, method, path, params, body, client_addr(i))
+        used[kind] += time.process_time() - started
+        counts[kind] += 1
+    used['ALL'] = sum(used.values())
+    counts['ALL'] = len(workload)
+    return {kind: {"requests": counts[kind], "cpu_us_per_request": round(used[kind] / counts[kind] * 1e6, 1)}
+            for kind in used}
+
+
+def run_http(base_url, workload, concurrency):
+    def send(indexed):
+        i, (kind, method, path, params, body) = indexed
+        url = f"{base_url.rstrip('/')}{path}" + (f"?{urlencode(params)}" if params else "")
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = Request(url, data=data, method=method,
+                      headers={"Content-Type": "application/json", "X-Forwarded-For": client_addr(i)})
+        started = time.perf_counter()
+        try:
+            with urlopen(req, timeout=30) as res:
+                res.read()
+                status = res.status
+        except Exception as e:
+            status = getattr(e, 'code', 599)
+        return kind, status, (time.perf_counter() - started) * 1000, None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, enumerate(workload)))
+    return results, time.perf_counter() - started
+
+
+def _stub_total(stub_url):
+    with urlopen(f"{stub_url.rstrip('/')}/__stats", timeout=5) as res:
+        return json.loads(res.read())["total"]
+
+
+# ---------------------------------------------------------
+# 集計
+# ---------------------------------------------------------
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def summarize(results, elapsed):
+    groups = defaultdict(list)
+    for row in results:
+        groups[row[0]].append(row)
+    groups['ALL'] = list(results)
+
+    endpoints = {}
+    for kind, rows in groups.items():
+        latencies = sorted(r[2] for r in rows)
+        calls = [r[3] for r in rows if r[3] is not None]
+        endpoints[kind] = {
+            "requests": len(rows),
+            "errors": sum(1 for r in rows if r[1] >= 500),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "db_calls_per_request": round(sum(calls) / len(calls), 2) if calls else None,
+        }
+    return {"throughput_rps": round(len(results) / elapsed, 1) if elapsed else None, "endpoints": endpoints}
+
+
+# ---------------------------------------------------------
+# マイクロベンチ
+# ---------------------------------------------------------
+
+def micro_benchmarks(api, client):
+    from geo import haversine_m
+    from line_rules import platform_for, display_line_name
+
+    link = client.table("line_stations").select("line_id, station_id").limit(1).execute().data[0]
+    key = next(iter(api.door_index.slots), None)
+    cases = {
+        "safe_float": lambda: api.safe_float("12.5"),
+        "safe_int": lambda: api.safe_int("3.0"),
+        "is_time_available": lambda: api.is_time_available("05:00-12:30,13:00-23:30"),
+        "format_facility": lambda: api.format_facility("stairs,escalator,elevator"),
+        "platform_for": lambda: platform_for("東京メトロ銀座線", 1),
+        "display_line_name": lambda: display_line_name("JR山手線"),
+        "haversine_m": lambda: haversine_m(35.681, 139.767, 35.690, 139.700),
+        "local_strategies_query": lambda: client.table("toilet_strategies").select("*")
+                                                .eq("station_id", link['station_id']).eq("direction", 1).execute(),
+    }
+    if key:
+        station, line, direction = key
+        cases["door_index_lookup"] = lambda: api.door_index.lookup(station, line, direction, 2, 1)
+
+    results = {}
+    for name, fn in cases.items():
+        timer = timeit.Timer(fn)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=3, number=number)) / number
+        results[name] = {"ns_per_op": round(best * 1e9, 1)}
+    return results
+
+
+# ---------------------------------------------------------
+# baseline との比較
+# ---------------------------------------------------------
+
+def compare(report, baseline, latency_tol=LATENCY_TOLERANCE, micro_tol=MICRO_TOLERANCE):
+    """ 悪化した項目のリストを返す (db問い合わせ回数は1回でも増えたら悪化) """
+    regressions = []
+    for kind, cur in report.get("load", {}).get("endpoints", {}).items():
+        base = baseline.get("load", {}).get("endpoints", {}).get(kind)
+        if not base:
+            continue
+        for metric in ("p95_ms", "p99_ms"):
+            if metric == "p99_ms" and cur.get("requests", 0) < MIN_SAMPLES_P99:
+                continue
+            if base.get(metric) and cur.get(metric) and cur[metric] > base[metric] * (1 + latency_tol) \
+                    and cur[metric] - base[metric] > MIN_DELTA_MS:
+                regressions.append(f"{kind} {metric}: {base[metric]} -> {cur[metric]}")
+        if base.get("db_calls_per_request") is not None and cur.get("db_calls_per_request") is not None \
+                and cur["db_calls_per_request"] > base["db_calls_per_request"] + 0.05:
+            regressions.append(f"{kind} db_calls_per_request: {base['db_calls_per_request']} -> {cur['db_calls_per_request']}")
+        if cur.get("errors", 0) > base.get("errors", 0):
+            regressions.append(f"{kind} errors: {base.get('errors', 0)} -> {cur['errors']}")
+    for name, cur in report.get("micro", {}).items():
+        base = baseline.get("micro", {}).get(name)
+        if base and cur["ns_per_op"] > base["ns_per_op"] * (1 + micro_tol):
+            regressions.append(f"micro {name}: {base['ns_per_op']} ns -> {cur['ns_per_op']} ns")
+    for kind, cur in report.get("cpu", {}).items():
+        base = baseline.get("cpu", {}).get(kind)
+        if base and cur["cpu_us_per_request"] > base["cpu_us_per_request"] * (1 + CPU_TOLERANCE):
+            regressions.append(f"cpu {kind}: {base['cpu_us_per_request']} us -> {cur['cpu_us_per_request']} us")
+    return regressions
+
+
+def print_report(report):
+    config = report["config"]
+    print(f"--- API ベンチマーク ({config['mode']}, {config['requests']} 件, 並列 {config['concurrency']}, "
+          f"DB待ち {config['latency_ms']}ms) ---")
+    if "micro" in report:
+        print("\n[マイクロベンチ]")
+        for name, row in report["micro"].items():
+            print(f"  {name:<24} {row['ns_per_op']:>12,.1f} ns/op")
+    if "load" in report:
+        load = report["load"]
+        print(f"\n[負荷] {load['throughput_rps']} req/s")
+        print(f"  {'endpoint':<18} {'件数':>6} {'5xx':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'DB/req':>7}")
+        for kind, row in load["endpoints"].items():
+            calls = '-' if row['db_calls_per_request'] is None else row['db_calls_per_request']
+            print(f"  {kind:<18} {row['requests']:>6} {row['errors']:>4} {row['p50_ms']:>9} "
+                  f"{row['p95_ms']:>9} {row['p99_ms']:>9} {calls:>7}")
+    if "cpu" in report:
+        print("\n[CPU/リクエスト] (1件ずつ、DB待ちを除く)")
+        for kind, row in report["cpu"].items():
+            print(f"  {kind:<18} {row['requests']:>6} {row['cpu_us_per_request']:>12,.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API のマイクロベンチ・負荷計測と baseline 比較")
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="DB問い合わせ1回ごとの待ち時間")
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--via-stub', action='store_true', help="supabase-py で PostgREST スタブ (HTTP) を経由する")
+    parser.add_argument('--url', help="起動済みの API を HTTP で叩く (例: http://127.0.0.1:8000)")
+    parser.add_argument('--stub-url', help="--url のとき、DB問い合わせ回数を数える PostgREST スタブ")
+    parser.add_argument('--data-dir', help="CSV の置き場所 (bench/synth_dataset.py の出力で規模試験をする)")
+    parser.add_argument('--db', help="ローカルバックエンドのスナップショット (既定: .cache/local.sqlite か <data-dir>/local.sqlite)")
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-load', action='store_true')
+    parser.add_argument('--skip-cpu', action='store_true')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="今回の結果を baseline として保存する")
+    parser.add_argument('--output', help="結果を JSON で保存する")
+    args = parser.parse_args()
+
+    mode = "http" if args.url else ("stub" if args.via_stub else "inprocess")
+    if args.data_dir:
+        # api.py は import 時に db.DATA_DIR からドア索引を読むので、import より前に差し替える
+        os.environ["DATA_DIR"] = db.DATA_DIR = os.path.abspath(args.data_dir)
+    db_path = args.db or (os.path.join(args.data_dir, 'local.sqlite') if args.data_dir else LOCAL_DB_PATH)
+
+    report = {"config": {"mode": mode, "requests": args.requests, "concurrency": args.concurrency,
+                         "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "seed": args.seed,
+                         "data_dir": args.data_dir, "python": platform.python_version(),
+                         "machine": platform.machine()}}
+
+    local = LocalClient(db_path, base_dir=db.DATA_DIR)
+    workload = build_workload(local, args.requests, args.seed)
+
+    if args.url:
+        before = _stub_total(args.stub_url) if args.stub_url else None
+        results, elapsed = run_http(args.url, workload, args.concurrency)
+        report["load"] = summarize(results, elapsed)
+        if before is not None:
+            report["load"]["endpoints"]["ALL"]["db_calls_per_request"] = \
+                round((_stub_total(args.stub_url) - before) / len(results), 2)
+    else:
+        if args.via_stub:
+            # 本物のクライアントでスタブを叩く (待ち時間はスタブ側で入れる)
+            from postgrest_stub import serve
+            server = serve(port=0, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, db_path=db_path,
+                           base_dir=db.DATA_DIR)
+            os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+            os.environ["SUPABASE_KEY"] = "stub"
+            client = RecordingClient(db.create_data_client("supabase"))
+        else:
+            client = RecordingClient(local, args.latency_ms, args.jitter_ms)
+        db.set_client(client)
+        import api
+
+        if not args.skip_micro:
+            report["micro"] = micro_benchmarks(api, local)
+        if not args.skip_load:
+            # 1周分流してキャッシュ等を温めてから計測する
+            asyncio.run(run_inprocess(api.app, workload[:max(1, len(workload) // 20)], args.concurrency))
+            results, elapsed = asyncio.run(run_inprocess(api.app, workload, args.concurrency))
+            report["load"] = summarize(results, elapsed)
+        if not args.skip_cpu:
+            if args.skip_load:
+                asyncio.run(run_inprocess(api.app, workload[:max(1, len(workload) // 20)], args.concurrency))
+            report["cpu"] = asyncio.run(cpu_per_request(api.app, workload))
+
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nbaseline を保存しました: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("\n(baseline がありません。--save-baseline で作成できます)")
+        return
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get("config", {}).get("mode") != mode or \
+            baseline.get("config", {}).get("latency_ms") != args.latency_ms or \
+            baseline.get("config", {}).get("concurrency") != args.concurrency:
+        print("\n[注意] baseline と計測条件 (mode / latency / concurrency) が違います")
+    regressions = compare(report, baseline)
+    if regressions:
+        print(f"\n[悪化] {len(regressions)} 件")
+        for line in regressions:
+            print(f"  - {line}")
+        sys.exit(1)
+    print("\nbaseline から悪化した項目はありません")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+import argparse
+import csv
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from geo import GridIndex, METERS_PER_DEG_LAT  # noqa: E402
+
+# ---------------------------------------------------------
+# 規模試験用の全国合成データセット
+# ---------------------------------------------------------
+# 実データ (東京の約800駅・路線行) と同じ列・同じ整合性 (駅名・トイレID・方面ラベルの対応) を持つCSVを
+# 任意の規模で作る。出力フォルダはリポジトリと同じ配置なので、そのまま各ツールの入力にできる:
+#
+#   python bench/synth_dataset.py --scale 50 --out .cache/synth50
+#   cd .cache/synth50 && python ../../generate_sql.py               # SQL生成の規模試験
+#   python bench/run_bench.py --data-dir .cache/synth50              # API の負荷試験
+#
+# 路線は都市圏ごとに 放射線 (中心から郊外へ)・直通線 (中心を貫く)・環状線・支線 (途中駅で分岐) を作る。
+# 駅間は都心ほど短く郊外ほど長い。別の路線の駅と 350m 以内なら同じ駅 (乗換駅) にする。
+
+# 実データの駅・路線行数 (scale=1 のときの目安)
+BASE_ROWS = 818
+
+# 都市圏: (名前, 中心緯度, 中心経度, 重み, 都市圏の半径km)
+REGIONS = [
+    ("東京", 35.6812, 139.7671, 40, 45),
+    ("大阪", 34.7025, 135.4959, 16, 35),
+    ("名古屋", 35.1709, 136.8815, 8, 30),
+    ("横浜", 35.4658, 139.6223, 6, 20),
+    ("福岡", 33.5902, 130.4207, 5, 20),
+    ("京都", 34.9858, 135.7588, 4, 15),
+    ("神戸", 34.6937, 135.1955, 4, 15),
+    ("札幌", 43.0687, 141.3508, 3, 15),
+    ("仙台", 38.2601, 140.8821, 2, 15),
+    ("広島", 34.3975, 132.4753, 2, 15),
+    ("新潟", 37.9120, 139.0613, 1, 12),
+    ("静岡", 34.9717, 138.3890, 1, 12),
+    ("岡山", 34.6661, 133.9184, 1, 12),
+    ("熊本", 32.7899, 130.6886, 1, 10),
+    ("鹿児島", 31.5840, 130.5417, 1, 10),
+    ("那覇", 26.2124, 127.6792, 1, 8),
+]
+
+NAME_HEADS = ["", "", "", "新", "東", "西", "南", "北", "上", "下", "中", "大", "本", "元"]
+NAME_CORES = [
+    "松原", "桜台", "若葉", "緑町", "旭", "栄", "本町", "宮前", "高田", "青葉", "川口", "平和台", "港", "浜",
+    "富士見", "日の出", "住吉", "八幡", "天神", "寺町", "今池", "清水", "白山", "石川", "森下", "菊川", "池田",
+    "岡本", "山下", "山手", "野方", "福田", "吉田", "長沢", "鶴見", "亀戸", "鷺沼", "藤が丘", "桃山", "柳町",
+    "杉並", "松山", "春日", "秋津", "夏見", "冬木", "水道", "泉", "湊", "岬", "橋本", "古川", "新田", "東山",
+    "北野", "南野", "上野原", "中島", "大島", "小島", "宮町", "天王", "王子", "大門", "元町", "幸町", "錦",
+    "朝日", "夕陽丘", "星が丘", "月見", "花園", "竹下", "松島", "黒崎", "白石", "赤坂", "青山", "金山", "瑞穂",
+    "緑が丘", "桜木", "梅ヶ丘", "萩原", "柏木", "榎本", "槙町", "樫山", "楠", "椿", "菖蒲", "蓮沼", "葵",
+]
+NAME_TAILS = ["", "", "", "", "町", "前", "口", "台", "公園", "橋", "通", "坂", "ヶ丘"]
+
+PALETTE = ["#F39700", "#E60012", "#9CAEB7", "#00A7DB", "#009944", "#D7C447", "#9B7CB6", "#00ADA9",
+           "#BB641D", "#E85298", "#0079C2", "#6CBB5A", "#B6007A", "#80C241", "#FF6600", "#0067C0"]
+FACILITIES = ["stairs", "stairs", "escalator", "elevator", "stairs,escalator", "escalator,elevator"]
+GATES = ["中央", "北", "南", "東", "西"]
+FLOORS = ["B2F", "B1F", "B1F", "1F", "2F"]
+TIME_WINDOWS = ["05:00-24:00", "06:00-23:30", "05:30-12:00,13:00-24:00", "07:00-22:00"]
+
+# 混雑報告の時間帯ごとの重み (朝夕のラッシュに集中する)
+HOUR_WEIGHTS = [1, 0, 0, 0, 1, 3, 8, 20, 22, 10, 5, 5, 6, 5, 5, 6, 8, 14, 18, 15, 9, 6, 4, 2]
+
+SNAP_RADIUS_M = 350
+
+
+def _offset(lat, lng, east_m, north_m):
+    d_lat = north_m / METERS_PER_DEG_LAT
+    d_lng = east_m / (METERS_PER_DEG_LAT * math.cos(math.radians(lat)))
+    return lat + d_lat, lng + d_lng
+
+
+class Generator:
+    def __init__(self, scale=1.0, seed=1):
+        self.rng = random.Random(seed)
+        self.target_rows = max(40, int(BASE_ROWS * scale))
+        # 規模を大きくしても路線が都心に詰め込まれすぎないよう、都市圏を郊外へ広げる
+        self.spread = max(1.0, math.sqrt(scale) / 2)
+        self.namespace = uuid.uuid5(uuid.NAMESPACE_URL, f"toilet-finder/synth/{seed}")
+        self.used_names = set()
+        self.line_names = set()
+        self.stations = {}     # 駅名 -> {"lat", "lng", "lines": [...], "region"}
+        self.lines = []        # {"name", "color", "max_cars", "stations": [駅名...], "labels": (dir_1, dir_m1)}
+        self.grids = {}
+        self.rows = 0
+
+    # --- 名前 ---
+
+    def _station_name(self, region):
+        for _ in range(50):
+            name = self.rng.choice(NAME_HEADS) + self.rng.choice(NAME_CORES) + self.rng.choice(NAME_TAILS)
+            if name not in self.used_names:
+                break
+        else:
+            name = f"{region}{self.rng.choice(NAME_CORES)}"
+            n = 2
+            while f"{name}{n}" in self.used_names:
+                n += 1
+            name = f"{name}{n}"
+        self.used_names.add(name)
+        return name
+
+    def _line_name(self, base):
+        name, n = base, 2
+        while name in self.line_names:
+            name = f"{base[:-1]}{n}線" if base.endswith("線") else f"{base}{n}"
+            n += 1
+        self.line_names.add(name)
+        return name
+
+    # --- 駅の配置 ---
+
+    def _place(self, region, lat, lng, taken):
+        """ 座標に駅を置く。近くに別路線の駅があればそれを使う (乗換駅) """
+        grid = self.grids[region[0]]
+        for _, name in grid.within(lat, lng, SNAP_RADIUS_M):
+            if name not in taken:
+                return name
+        name = self._station_name(region[0])
+        lat, lng = round(lat, 4), round(lng, 4)
+        self.stations[name] = {"lat": lat, "lng": lng, "lines": [], "region": region[0]}
+        grid.insert(lat, lng, name)
+        return name
+
+    def _trace(self, region, lat, lng, bearing, count, taken, spacing_from_center=True):
+        """ bearing (度) の方向へ count 駅ぶん進む。駅間は中心から離れるほど広がる """
+        _, c_lat, c_lng, _, _ = region
+        names = []
+        for _ in range(count):
+            dist_center = math.hypot((lat - c_lat) * METERS_PER_DEG_LAT,
+                                     (lng - c_lng) * METERS_PER_DEG_LAT * math.cos(math.radians(lat)))
+            spacing = 800 + min(dist_center, 40000) * 0.06 if spacing_from_center else 1200
+            spacing *= self.rng.uniform(0.7, 1.3)
+            bearing += self.rng.uniform(-12, 12)
+            rad = math.radians(bearing)
+            lat, lng = _offset(lat, lng, math.sin(rad) * spacing, math.cos(rad) * spacing)
+            name = self._place(region, lat, lng, taken)
+            if name in taken:
+                continue
+            taken.add(name)
+            names.append(name)
+        return names, lat, lng, bearing
+
+    def _add_line(self, name, names, max_cars, labels=None):
+        if len(names) < 2:
+            return None
+        line = {"name": name, "color": self.rng.choice(PALETTE), "max_cars": max_cars, "stations": names,
+                "labels": labels or (f"{names[-1]} 方面", f"{names[0]} 方面")}
+        for s in names:
+            self.stations[s]["lines"].append(name)
+        self.lines.append(line)
+        self.rows += len(names)
+        return line
+
+    # --- 路線の種類 ---
+
+    def radial(self, region):
+        _, c_lat, c_lng, _, radius_km = region
+        radius_km *= self.spread
+        start_r = self.rng.uniform(0, 2500)
+        bearing = self.rng.uniform(0, 360)
+        lat, lng = _offset(c_lat, c_lng, math.sin(math.radians(bearing)) * start_r, math.cos(math.radians(bearing)) * start_r)
+        taken = set()
+        first = self._place(region, lat, lng, taken)
+        taken.add(first)
+        count = self.rng.randint(8, max(10, int(radius_km * 0.8)))
+        names, _, _, _ = self._trace(region, lat, lng, bearing, count, taken)
+        names = [first] + names
+        return self._add_line(self._line_name(f"{names[-1]}線"), names, self.rng.choice([8, 10, 10, 10, 12]))
+
+    def through(self, region):
+        _, c_lat, c_lng, _, radius_km = region
+        radius_km *= self.spread
+        bearing = self.rng.uniform(0, 360)
+        half = self.rng.randint(5, max(7, int(radius_km * 0.4)))
+        taken = set()
+        back, _, _, _ = self._trace(region, c_lat, c_lng, bearing + 180, half, taken)
+        fwd, _, _, _ = self._trace(region, c_lat, c_lng, bearing, half, taken)
+        names = list(reversed(back)) + fwd
+        n = sum(1 for line in self.lines if line["name"].startswith(region[0])) + 1
+        return self._add_line(self._line_name(f"{region[0]}{n}号線"), names, self.rng.choice([6, 8, 10]))
+
+    def loop(self, region):
+        _, c_lat, c_lng, _, radius_km = region
+        radius = self.rng.uniform(3000, max(3500, radius_km * 150))
+        count = max(12, int(2 * math.pi * radius / 1300))
+        taken = set()
+        names = []
+        phase = self.rng.uniform(0, 360)
+        for k in range(count):
+            angle = math.radians(phase + 360 * k / count)
+            r = radius * self.rng.uniform(0.9, 1.1)
+            name = self._place(region, *_offset(c_lat, c_lng, math.sin(angle) * r, math.cos(angle) * r), taken)
+            if name not in taken:
+                taken.add(name)
+                names.append(name)
+        # 環状線のラベルは途中の主要駅2つ (山手線の「池袋・上野 方面」と同じ形)
+        a, b = names[len(names) // 3], names[2 * len(names) // 3]
+        labels = (f"{a}・{b} 方面", f"{b}・{a} 方面")
+        return self._add_line(self._line_name(f"{region[0]}環状線"), names, 11, labels)
+
+    def branch(self, region):
+        parents = [line for line in self.lines if self.stations[line["stations"][0]]["region"] == region[0]
+                   and len(line["stations"]) >= 8 and "支線" not in line["name"] and not line["name"].endswith("環状線")]
+        if not parents:
+            return self.radial(region)
+        parent = self.rng.choice(parents)
+        fork = self.rng.randint(len(parent["stations"]) // 3, len(parent["stations"]) - 3)
+        junction = parent["stations"][fork]
+        prev = self.stations[parent["stations"][fork - 1]]
+        here = self.stations[junction]
+        base = math.degrees(math.atan2((here["lng"] - prev["lng"]) * math.cos(math.radians(here["lat"])),
+                                       here["lat"] - prev["lat"]))
+        bearing = base + self.rng.choice([-1, 1]) * self.rng.uniform(35, 70)
+        taken = {junction}
+        names, _, _, _ = self._trace(region, here["lat"], here["lng"], bearing, self.rng.randint(3, 8), taken)
+        names = [junction] + names
+        return self._add_line(self._line_name(f"{parent['name']}({names[-1]}支線)"), names,
+                              min(parent["max_cars"], self.rng.choice([3, 4, 6])))
+
+    def build(self):
+        for region in REGIONS:
+            self.grids[region[0]] = GridIndex(SNAP_RADIUS_M, ref_lat=region[1])
+        weights = [r[3] for r in REGIONS]
+        # 大きい都市圏には先に環状線を1本ずつ
+        for region in REGIONS:
+            if region[3] >= 4 and self.rows < self.target_rows:
+                self.loop(region)
+        kinds = [self.radial, self.radial, self.radial, self.radial, self.through, self.branch]
+        while self.rows < self.target_rows:
+            region = self.rng.choices(REGIONS, weights)[0]
+            kind = self.rng.choice(kinds)
+            if kind == self.through and region[3] < 3:
+                kind = self.radial
+            kind(region)
+        return self
+
+    # --- トイレ・攻略データ・ドア・混雑報告 ---
+
+    def toilet_id(self, *parts):
+        return str(uuid.uuid5(self.namespace, ":".join(map(str, parts))))
+
+    def toilets(self):
+        """ 駅ごとに1〜4件 (乗換駅ほど多い)。各トイレは路線ごとのホーム上の位置 (号車) を持つ """
+        toilets = []
+        for name, st in self.stations.items():
+            count = min(4, 1 + len(st["lines"]) // 2 + (self.rng.random() < 0.3))
+            for k in range(count):
+                t_lat, t_lng = _offset(st["lat"], st["lng"], self.rng.uniform(-80, 80), self.rng.uniform(-80, 80))
+                gate = GATES[k % len(GATES)]
+                toilets.append({
+                    "id": self.toilet_id("toilet", name, k),
+                    "line_name": self.rng.choice(st["lines"]),
+                    "station_name": name,
+                    "toilet_name": f"{gate}改札内",
+                    "lat": f"{t_lat:.4f}", "lng": f"{t_lng:.4f}",
+                    "floor": self.rng.choice(FLOORS),
+                    "wheelchair": "TRUE" if self.rng.random() < 0.7 else "FALSE",
+                    "baby_chair": "TRUE" if self.rng.random() < 0.5 else "FALSE",
+                    "ostomate": "TRUE" if self.rng.random() < 0.4 else "FALSE",
+                    "notes": f"{gate}口方面改札付近",
+                    "platform_name": self.rng.choice(["改札内コンコース", "ホーム階"]),
+                    "_pos": self.rng.random(),  # ホーム上の位置 (0=1号車側, 1=最後尾側)
+                })
+        return toilets
+
+    def strategies(self, toilets, coverage):
+        by_station = {}
+        for t in toilets:
+            by_station.setdefault(t["station_name"], []).append(t)
+        rows = []
+        for line in self.lines:
+            for name in line["stations"]:
+                if self.rng.random() > coverage:
+                    continue
+                for direction in (1, -1):
+                    for t in by_station.get(name, []):
+                        pos = t["_pos"] if direction == 1 else 1 - t["_pos"]
+                        car = max(1, min(line["max_cars"], 1 + round(pos * (line["max_cars"] - 1))))
+                        fac = self.rng.choice(FACILITIES)
+                        rows.append({
+                            "line_name": line["name"], "station_name": name, "direction": direction,
+                            "platform_name": "1番線" if direction == 1 else "2番線", "car_pos": car,
+                            "facility": fac,
+                            "available_time": "ALL" if self.rng.random() < 0.9 else self.rng.choice(TIME_WINDOWS),
+                            "crowd": self.rng.choices([1, 2, 3, 4, 5], [1, 3, 5, 3, 1])[0],
+                            "target_toilet_id": t["id"],
+                            "route_memo": f"{car}号車付近の{'階段' if fac.startswith('stairs') else '昇降設備'}から{t['toilet_name']}",
+                        })
+        return rows
+
+    def doors(self, toilets, coverage):
+        by_station = {}
+        for t in toilets:
+            by_station.setdefault(t["station_name"], []).append(t)
+        rows = []
+        for line in self.lines:
+            cars = line["max_cars"]
+            doors_per_car = 3 if cars >= 10 else 4
+            for name in line["stations"]:
+                candidates = by_station.get(name)
+                if not candidates or self.rng.random() > coverage:
+                    continue
+                for direction, label in ((1, line["labels"][0]), (-1, line["labels"][1])):
+                    for car in range(1, cars + 1):
+                        for door in range(1, doors_per_car + 1):
+                            here = (car - 1 + (door - 0.5) / doors_per_car) / cars
+                            here = here if direction == 1 else 1 - here
+                            nearest = min(candidates, key=lambda t: abs(t["_pos"] - here))
+                            rows.append({"station_name": name, "line_name": line["name"], "direction": label,
+                                         "car_number": car, "door_number": door, "nearest_toilet_id": nearest["id"]})
+        return rows
+
+    def reports(self, toilets, per_toilet, days, end=None):
+        """ 混雑報告の履歴。乗換駅ほど件数が多く、ラッシュの時間帯ほど混む """
+        end = end or datetime.now(timezone.utc).replace(microsecond=0)
+        jst = timedelta(hours=9)
+        rows = []
+        for t in toilets:
+            weight = len(self.stations[t["station_name"]]["lines"])
+            for i in range(int(self.rng.expovariate(1 / (per_toilet * weight)))):
+                day = self.rng.randrange(days)
+                hour = self.rng.choices(range(24), HOUR_WEIGHTS)[0]
+                local = (end + jst - timedelta(days=day)).replace(hour=hour, minute=self.rng.randrange(60),
+                                                                  second=self.rng.randrange(60))
+                rush = HOUR_WEIGHTS[hour] >= 14
+                level = self.rng.choices([1, 2, 3], [1, 3, 4] if rush else [5, 3, 1])[0]
+                rows.append({"id": self.toilet_id("report", t["id"], i), "toilet_id": t["id"],
+                             "congestion_level": level, "user_id": "",
+                             "reported_at": (local - jst).strftime('%Y-%m-%dT%H:%M:%S+00:00')})
+        rows.sort(key=lambda r: r["reported_at"])
+        return rows
+
+    def station_rows(self):
+        for line in self.lines:
+            for order, name in enumerate(line["stations"], start=1):
+                st = self.stations[name]
+                yield {"line_name": line["name"], "line_color": line["color"], "station_order": order,
+                       "station_name": name, "lat": f"{st['lat']:.4f}", "lng": f"{st['lng']:.4f}",
+                       "dir_1_label": line["labels"][0], "dir_m1_label": line["labels"][1],
+                       "max_cars": line["max_cars"]}
+
+
+def write_csv(path, fieldnames, rows, encoding='utf-8-sig'):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    count = 0
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def generate(out_dir, scale=1.0, seed=1, strategy_coverage=0.5, door_coverage=0.1, reports_per_toilet=5, report_days=7):
+    gen = Generator(scale, seed).build()
+    toilets = gen.toilets()
+    counts = {
+        "data/stations.csv": write_csv(os.path.join(out_dir, 'data', 'stations.csv'),
+                                       ["line_name", "line_color", "station_order", "station_name", "lat", "lng",
+                                        "dir_1_label", "dir_m1_label", "max_cars"], gen.station_rows()),
+        "data/strategies.csv": write_csv(os.path.join(out_dir, 'data', 'strategies.csv'),
+                                         ["line_name", "station_name", "direction", "platform_name", "car_pos",
+                                          "facility", "available_time", "crowd", "target_toilet_id", "route_memo"],
+                                         gen.strategies(toilets, strategy_coverage)),
+        "station_toilet.csv": write_csv(os.path.join(out_dir, 'station_toilet.csv'),
+                                        ["id", "line_name", "station_name", "toilet_name", "lat", "lng", "floor",
+                                         "wheelchair", "baby_chair", "ostomate", "notes", "platform_name"], toilets,
+                                        encoding='utf-8'),
+        "station_doors.csv": write_csv(os.path.join(out_dir, 'station_doors.csv'),
+                                       ["station_name", "line_name", "direction", "car_number", "door_number",
+                                        "nearest_toilet_id"], gen.doors(toilets, door_coverage), encoding='utf-8'),
+        "toilet_id_list.csv": write_csv(os.path.join(out_dir, 'toilet_id_list.csv'),
+                                        ["駅名", "トイレ表示名", "住所(場所)", "固定ID (これをコピー)"],
+                                        ({"駅名": t["station_name"], "トイレ表示名": f"{t['station_name']}駅 {t['toilet_name']}",
+                                          "住所(場所)": f"{t['line_name']} {t['station_name']}",
+                                          "固定ID (これをコピー)": t["id"]} for t in toilets)),
+        "congestion_reports.csv": write_csv(os.path.join(out_dir, 'congestion_reports.csv'),
+                                            ["id", "toilet_id", "congestion_level", "user_id", "reported_at"],
+                                            gen.reports(toilets, reports_per_toilet, report_days), encoding='utf-8'),
+    }
+    summary = {
+        "lines": len(gen.lines),
+        "stations": len(gen.stations),
+        "interchanges": sum(1 for s in gen.stations.values() if len(s["lines"]) >= 2),
+        "loops": sum(1 for line in gen.lines if line["name"].endswith("環状線")),
+        "branches": sum(1 for line in gen.lines if "支線" in line["name"]),
+    }
+    return counts, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="規模試験用の全国合成データセットを作る")
+    parser.add_argument('--scale', type=float, default=1.0, help="実データ (約800駅・路線行) の何倍にするか")
+    parser.add_argument('--out', default=None, help="出力フォルダ (既定: .cache/synth<scale>)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--strategy-coverage', type=float, default=0.5, help="攻略データがある駅・路線の割合")
+    parser.add_argument('--door-coverage', type=float, default=0.1, help="ドア単位のデータがある駅・路線の割合")
+    parser.add_argument('--reports-per-toilet', type=float, default=5, help="路線1本あたりの混雑報告の平均件数")
+    parser.add_argument('--report-days', type=int, default=7)
+    args = parser.parse_args()
+
+    out = args.out or os.path.join('.cache', f"synth{args.scale:g}")
+    started = time.perf_counter()
+    counts, summary = generate(out, args.scale, args.seed, args.strategy_coverage, args.door_coverage,
+                               args.reports_per_toilet, args.report_days)
+    print(f"--- 合成データセット (scale={args.scale:g}, seed={args.seed}) -> {out} ---")
+    print(f"  路線 {summary['lines']} (環状線 {summary['loops']} / 支線 {summary['branches']}) / "
+          f"駅 {summary['stations']} (乗換駅 {summary['interchanges']})")
+    for path, count in counts.items():
+        print(f"  {path:<24} {count:>9,} 行")
+    print(f"完了 ({time.perf_counter() - started:.1f} 秒)")
+
+
+if __name__ == "__main__":
+    main()
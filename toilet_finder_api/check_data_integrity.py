@@ -1,67 +1,324 @@
-import pandas as pd
+import argparse
+import json
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import dataset
+from geo import haversine_np
+from line_rules import display_line_name
+
+# ---------------------------------------------------------
+# トイレアプリ データ整合性監査
+# ---------------------------------------------------------
+# ファイル間の参照関係と値の妥当性をまとめて検査する。
+# 各チェックはベクトル化した anti-join (merge + indicator) で行い、スレッドで並列に走らせる。
+# --json で機械可読な結果を出し、エラーがあれば終了コード1 (ロード前のゲートに使う)。
 
 # パス設定
 STRATEGIES_CSV = 'data/strategies.csv'
+STATIONS_CSV = 'data/stations.csv'
 TOILET_MASTER_CSV = 'station_toilet.csv'
+STATION_DOORS_CSV = 'station_doors.csv'
+TOILET_ID_LIST_CSV = 'toilet_id_list.csv'
+
+# 日本の範囲 (これを外れる座標は入力ミス)
+LAT_RANGE = (20.0, 46.0)
+LNG_RANGE = (122.0, 154.0)
+# トイレが駅の代表座標からこれ以上離れていたら警告
+MAX_TOILET_STATION_DIST_M = 1500
+SAMPLE_LIMIT = 5
+
+TIME_RANGE_PATTERN = r"(?:[01]\d|2[0-3]):[0-5]\d-(?:[01]\d|2[0-3]):[0-5]\d"
+AVAILABLE_TIME_PATTERN = rf"ALL|{TIME_RANGE_PATTERN}(?:\s*,\s*{TIME_RANGE_PATTERN})*"
+
+
+def load_csv_safe(filepath):
+    """ 取り込み済みデータセットから読む (すべて文字列)。ファイルがなければ None """
+    if not os.path.exists(filepath):
+        return None
+    df = dataset.load_csv_safe(filepath)
+    return df if len(df.columns) else None
+
+
+def anti_join(left, right, left_on, right_on):
+    """ left のうち right に対応する行がないものを返す (ハッシュ結合1回) """
+    keys = right[right_on].drop_duplicates()
+    keys.columns = left_on
+    merged = left.merge(keys, on=left_on, how='left', indicator=True)
+    return left[(merged['_merge'] == 'left_only').to_numpy()]
+
+
+def _result(name, severity, failed, total, description, columns=None):
+    samples = []
+    if columns:
+        head = failed[columns].head(SAMPLE_LIMIT).astype(object)
+        samples = head.where(head.notna(), None).to_dict('records')  # NaN は JSON で null にする
+    return {
+        "check": name,
+        "severity": severity,
+        "description": description,
+        "failed": int(len(failed)),
+        "total": int(total),
+        "samples": samples,
+    }
+
+
+def _toilet_id_column(df):
+    return 'toilet_id' if 'toilet_id' in df.columns else 'id'
+
+
+def _with_line_key(df):
+    out = df.copy()
+    out['line_key'] = out['line_name'].map(display_line_name).str.strip()
+    out['station_name'] = out['station_name'].str.strip()
+    return out
+
+
+# --- 各チェック (data: ファイル名 -> DataFrame) ---
+
+def check_strategies_toilets(data):
+    st, tm = data['strategies'], data['toilets']
+    left = st.assign(target_toilet_id=st['target_toilet_id'].str.strip())
+    right = tm.assign(target_toilet_id=tm[_toilet_id_column(tm)].str.strip())
+    failed = anti_join(left, right, ['target_toilet_id'], ['target_toilet_id'])
+    return _result("strategies_to_toilets", "error", failed, len(st),
+                   "攻略データの target_toilet_id がトイレマスタに存在しない",
+                   ['line_name', 'station_name', 'target_toilet_id'])
+
+
+def check_strategies_stations(data):
+    st, sta = _with_line_key(data['strategies']), _with_line_key(data['stations'])
+    failed = anti_join(st, sta, ['line_key', 'station_name'], ['line_key', 'station_name'])
+    return _result("strategies_to_stations", "error", failed, len(st),
+                   "攻略データの (路線, 駅) が駅データに存在しない",
+                   ['line_name', 'station_name'])
+
+
+def check_doors_toilets(data):
+    doors, ids = data['doors'], data['toilet_ids']
+    id_col = next((c for c in ids.columns if c.startswith('固定ID')), ids.columns[-1])
+    left = doors.assign(nearest_toilet_id=doors['nearest_toilet_id'].str.strip())
+    right = ids.assign(nearest_toilet_id=ids[id_col].str.strip())
+    failed = anti_join(left, right, ['nearest_toilet_id'], ['nearest_toilet_id'])
+    return _result("doors_to_toilet_ids", "error", failed, len(doors),
+                   "station_doors の nearest_toilet_id が toilet_id_list に存在しない",
+                   ['station_name', 'line_name', 'direction', 'car_number', 'nearest_toilet_id'])
+
+
+def check_doors_toilet_master(data):
+    """ ドア索引のトイレがトイレマスタ (station_toilet.csv) にない -> /predict ではドア単位の結果に使えない """
+    doors, tm = data['doors'], data['toilets']
+    left = doors.assign(nearest_toilet_id=doors['nearest_toilet_id'].str.strip())
+    right = tm.assign(nearest_toilet_id=tm[_toilet_id_column(tm)].str.strip())
+    failed = anti_join(left, right, ['nearest_toilet_id'], ['nearest_toilet_id'])
+    return _result("doors_to_toilet_master", "warning", failed, len(doors),
+                   "station_doors の nearest_toilet_id がトイレマスタに存在しない (ドア単位の案内に使えない)",
+                   ['station_name', 'line_name', 'nearest_toilet_id'])
+
+
+def _max_cars_by_line(data):
+    sta = _with_line_key(data['stations'])
+    sta['max_cars'] = pd.to_numeric(sta['max_cars'], errors='coerce')
+    return sta.groupby('line_key', as_index=False)['max_cars'].max()
+
+
+def check_car_positions(data):
+    st = _with_line_key(data['strategies']).merge(_max_cars_by_line(data), on='line_key', how='left')
+    car = pd.to_numeric(st['car_pos'], errors='coerce')
+    # 0 は「未調査」、路線の両数不明は strategies_max_cars_unknown で別に数える。ここでは範囲外・非数値をエラーにする
+    bad = car.isna() | (car < 0) | (st['max_cars'].notna() & (car > st['max_cars']))
+    failed = st[bad.to_numpy()]
+    return _result("strategies_car_pos", "error", failed, len(st),
+                   "car_pos が数値でない、または路線の両数 (max_cars) を超えている",
+                   ['line_name', 'station_name', 'car_pos', 'max_cars'])
 
-def check_integrity():
-    print("--- トイレアプリ データ整合性監査レポート (詳細診断モード V2) ---\n")
-
-    if not os.path.exists(STRATEGIES_CSV) or not os.path.exists(TOILET_MASTER_CSV):
-        print("エラー: CSVファイルが不足しています。")
-        return
-
-    # すべて文字列として読み込み
-    df_str = pd.read_csv(STRATEGIES_CSV, dtype=str).fillna('')
-    df_tm = pd.read_csv(TOILET_MASTER_CSV, dtype=str).fillna('')
-
-    print(f"ファイル確認:")
-    print(f"  Strategies: {len(df_str)} 行")
-    print(f"  Master:     {len(df_tm)} 行")
-    
-    # --- 構造診断 ---
-    print(f"\n[構造診断] Masterファイルのカラム名と最初のデータの対応:")
-    if len(df_tm) > 0:
-        cols = list(df_tm.columns)
-        first_vals = list(df_tm.iloc[0])
-        for i in range(max(len(cols), len(first_vals))):
-            c = cols[i] if i < len(cols) else "!!! カラム名不足 !!!"
-            v = first_vals[i] if i < len(first_vals) else "!!! データ不足 !!!"
-            print(f"  列{i+1}: [{c}] -> 値: {v}")
 
+def check_door_cars(data):
+    doors = _with_line_key(data['doors']).merge(_max_cars_by_line(data), on='line_key', how='left')
+    car = pd.to_numeric(doors['car_number'], errors='coerce')
+    # 路線の両数不明は doors_max_cars_unknown で別に数える
+    bad = car.isna() | (car < 1) | (doors['max_cars'].notna() & (car > doors['max_cars']))
+    failed = doors[bad.to_numpy()]
+    return _result("doors_car_number", "error", failed, len(doors),
+                   "station_doors の car_number が路線の両数の範囲外",
+                   ['line_name', 'station_name', 'car_number', 'max_cars'])
+
+
+def check_max_cars_unknown(data):
+    """ 路線の両数 (max_cars) が分からず、号車の範囲を確かめられない行 """
+    max_cars = _max_cars_by_line(data)
+    results = []
+    for name, key, label in (("strategies_max_cars_unknown", 'strategies', "strategies"),
+                             ("doors_max_cars_unknown", 'doors', "station_doors")):
+        rows = _with_line_key(data[key]).merge(max_cars, on='line_key', how='left')
+        failed = rows[rows['max_cars'].isna().to_numpy()]
+        results.append(_result(name, "error", failed, len(rows),
+                               f"{label} の路線の両数 (stations.csv の max_cars) が不明で、号車の範囲を確認できない",
+                               ['line_name', 'station_name']))
+    return results
+
+
+def check_uninvestigated(data):
+    st = data['strategies']
+    failed = st[(pd.to_numeric(st['car_pos'], errors='coerce') == 0).to_numpy()]
+    return _result("strategies_uninvestigated", "warning", failed, len(st),
+                   "号車未調査 (car_pos = 0) の攻略データ", ['line_name', 'station_name'])
+
+
+def check_duplicates(data):
+    st = data['strategies']
+    subset = [c for c in ['line_name', 'station_name', 'direction', 'car_pos', 'target_toilet_id'] if c in st.columns]
+    failed = st[st.duplicated(subset=subset, keep=False)]
+    return _result("strategies_duplicates", "warning", failed, len(st), "攻略データの重複行", subset)
+
+
+def _bad_coords(lat, lng):
+    return lat.isna() | lng.isna() | ~lat.between(*LAT_RANGE) | ~lng.between(*LNG_RANGE)
+
+
+def check_station_coords(data):
+    sta = data['stations']
+    lat, lng = pd.to_numeric(sta['lat'], errors='coerce'), pd.to_numeric(sta['lng'], errors='coerce')
+    failed = sta[_bad_coords(lat, lng).to_numpy()]
+    return _result("station_coordinates", "error", failed, len(sta),
+                   "駅の座標が欠損しているか日本の範囲外", ['line_name', 'station_name', 'lat', 'lng'])
+
+
+def check_toilet_coords(data):
+    tm = data['toilets']
+    lng_col = 'lng' if 'lng' in tm.columns else 'lon'
+    t = pd.DataFrame({
+        "id": tm[_toilet_id_column(tm)],
+        "station_name": tm['station_name'].str.strip(),
+        "lat": pd.to_numeric(tm['lat'], errors='coerce'),
+        "lng": pd.to_numeric(tm[lng_col], errors='coerce'),
+    })
+    bad = _bad_coords(t['lat'], t['lng'])
+
+    # 駅の代表座標から離れすぎているトイレ (駅名で結合して一括で距離計算)
+    sta = data['stations']
+    st_coords = pd.DataFrame({
+        "station_name": sta['station_name'].str.strip(),
+        "s_lat": pd.to_numeric(sta['lat'], errors='coerce'),
+        "s_lng": pd.to_numeric(sta['lng'], errors='coerce'),
+    }).dropna().drop_duplicates('station_name')
+    t = t.merge(st_coords, on='station_name', how='left')
+    t['distance_m'] = haversine_np(t['lat'], t['lng'], t['s_lat'], t['s_lng']).round(0)
+    far = ~bad.to_numpy() & (t['distance_m'] > MAX_TOILET_STATION_DIST_M).to_numpy()
+
+    return [
+        _result("toilet_coordinates", "error", t[bad.to_numpy()], len(t),
+                "トイレの座標が欠損しているか日本の範囲外", ['id', 'station_name', 'lat', 'lng']),
+        _result("toilet_station_distance", "warning", t[far], len(t),
+                f"トイレが駅から {MAX_TOILET_STATION_DIST_M}m 以上離れている", ['id', 'station_name', 'distance_m']),
+    ]
+
+
+def check_available_time(data):
+    st = data['strategies']
+    value = st['available_time'].str.strip()
+    # 空欄は「常時」として扱われるので許容する
+    bad = (value != '') & ~value.str.fullmatch(AVAILABLE_TIME_PATTERN)
+    failed = st[bad.to_numpy()]
+    return _result("available_time_syntax", "error", failed, len(st),
+                   "available_time が 'ALL' または 'HH:MM-HH:MM[,HH:MM-HH:MM...]' の形式でない",
+                   ['line_name', 'station_name', 'available_time'])
+
+
+# (チェック関数, 必要なファイル)
+CHECKS = [
+    (check_strategies_toilets, ('strategies', 'toilets')),
+    (check_strategies_stations, ('strategies', 'stations')),
+    (check_doors_toilets, ('doors', 'toilet_ids')),
+    (check_doors_toilet_master, ('doors', 'toilets')),
+    (check_car_positions, ('strategies', 'stations')),
+    (check_door_cars, ('doors', 'stations')),
+    (check_max_cars_unknown, ('strategies', 'doors', 'stations')),
+    (check_uninvestigated, ('strategies',)),
+    (check_duplicates, ('strategies',)),
+    (check_station_coords, ('stations',)),
+    (check_toilet_coords, ('toilets', 'stations')),
+    (check_available_time, ('strategies',)),
+]
+
+FILES = {
+    'strategies': STRATEGIES_CSV,
+    'stations': STATIONS_CSV,
+    'toilets': TOILET_MASTER_CSV,
+    'doors': STATION_DOORS_CSV,
+    'toilet_ids': TOILET_ID_LIST_CSV,
+}
+
+
+def run_audit(files=FILES, workers=None):
+    """ 全ファイルを並列に読み込み、全チェックを並列に実行して結果の dict を返す """
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        loaded = dict(zip(files, pool.map(load_csv_safe, files.values())))
+        data = {name: df for name, df in loaded.items() if df is not None}
+
+        futures = []
+        skipped = []
+        for check, needs in CHECKS:
+            missing = [n for n in needs if n not in data]
+            if missing:
+                skipped.append({"check": check.__name__, "missing_files": [files[n] for n in missing]})
+                continue
+            futures.append(pool.submit(check, data))
+
+        results = []
+        for future in futures:
+            r = future.result()
+            results.extend(r if isinstance(r, list) else [r])
+
+    errors = sum(r["failed"] for r in results if r["severity"] == "error")
+    warnings = sum(r["failed"] for r in results if r["severity"] == "warning")
+    return {
+        "ok": errors == 0 and not skipped,
+        "errors": errors,
+        "warnings": warnings,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "files": {files[n]: (len(df) if df is not None else None) for n, df in loaded.items()},
+        "checks": results,
+        "skipped": skipped,
+    }
+
+
+def print_report(report):
+    print("--- トイレアプリ データ整合性監査レポート ---\n")
+    print("ファイル確認:")
+    for path, rows in report["files"].items():
+        print(f"  {path}: {'見つかりません' if rows is None else f'{rows} 行'}")
     print("-" * 40)
+    for r in report["checks"]:
+        mark = "OK" if r["failed"] == 0 else ("NG" if r["severity"] == "error" else "注意")
+        print(f"[{mark}] {r['description']}: {r['failed']} / {r['total']} 件")
+        for sample in r["samples"][:3]:
+            print(f"    - {sample}")
+    for s in report["skipped"]:
+        print(f"[スキップ] {s['check']} (ファイルなし: {', '.join(s['missing_files'])})")
+    print(f"\nエラー {report['errors']} 件 / 警告 {report['warnings']} 件 ({report['elapsed_ms']} ms)")
+    print("--- 監査完了 ---")
+
+
+def check_integrity(as_json=False, output=None):
+    report = run_audit()
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if as_json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return report
 
-    # 1. 未調査の号車位置
-    df_str['car_pos_num'] = pd.to_numeric(df_str['car_pos'], errors='coerce').fillna(0.0)
-    uninvestigated = df_str[df_str['car_pos_num'] == 0.0]
-    print(f"\n[1] 号車未調査(0.0)のデータ: {len(uninvestigated)} / {len(df_str)} 件")
-
-    # 2. リンク切れチェック
-    # マスタ側のIDカラムを特定
-    m_id_col = 'toilet_id' if 'toilet_id' in df_tm.columns else 'id'
-    
-    # エラー修正: .str.strip() を使用
-    master_ids = set(df_tm[m_id_col].astype(str).str.strip())
-    
-    # 攻略データ側のIDを整形
-    df_str['target_toilet_id'] = df_str['target_toilet_id'].astype(str).str.strip()
-    
-    broken_links = df_str[~df_str['target_toilet_id'].isin(master_ids)]
-    
-    print(f"[2] IDリンク切れ: {len(broken_links)} / {len(df_str)} 件")
-    if len(broken_links) > 0:
-        print("    最初の3件の不一致詳細:")
-        for idx, row in broken_links.head(3).iterrows():
-            print(f"    - 駅: {row['station_name']}, 探しているID: '{row['target_toilet_id']}'")
-            print(f"      (マスタの先頭IDサンプル: {list(master_ids)[:3]})")
-
-    # 3. 重複チェック
-    dup_subset = ['line_name', 'station_name', 'direction', 'car_pos', 'target_toilet_id']
-    duplicates = df_str[df_str.duplicated(subset=[c for c in dup_subset if c in df_str.columns], keep=False)]
-    print(f"[3] 攻略データの重複: {len(duplicates)} 件")
-
-    print("\n--- 監査完了 ---")
 
 if __name__ == "__main__":
-    check_integrity()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="CSVデータのファイル間整合性を監査する")
+    parser.add_argument('--json', action='store_true', help="結果をJSONで標準出力に出す")
+    parser.add_argument('--output', help="結果のJSONを書き出すファイル")
+    args = parser.parse_args()
+    result = check_integrity(as_json=args.json, output=args.output)
+    sys.exit(0 if result["ok"] else 1)
@@ -1,6 +1,7 @@
 import requests
 import json
 import time
+from geocoder import StationGeocoder
 
 # ---------------------------------------------------------
 # 設定
@@ -14,36 +15,21 @@ SEARCH_RADIUSES = [200, 500] # 調査範囲 (広すぎるとタイムアウト
 # "https://lz4.overpass-api.de/api/interpreter" (公式ミラー)
 OVERPASS_URL = "https://overpass.kumi.systems/api/interpreter"
 
-def get_station_location_debug(station_name):
-    """ 駅の中心座標を取得し、詳細を表示する """
-    url = "https://nominatim.openstreetmap.org/search"
-    params = {
-        'q': f"{station_name}駅 東京都",
-        'format': 'json',
-        'limit': 1
-    }
-    headers = {'User-Agent': 'station_toilet_debugger_v2'}
-    
+def get_station_location_debug(geocoder, station_name):
+    """ 駅の中心座標を取得し、詳細を表示する (stations.csv → キャッシュ → Nominatim) """
     print(f"--- 1. 座標検索: {station_name}駅 ---")
-    try:
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        data = response.json()
-        
-        if data and len(data) > 0:
-            lat = float(data[0]['lat'])
-            lon = float(data[0]['lon'])
-            display_name = data[0]['display_name']
-            print(f"  成功: 緯度={lat}, 経度={lon}")
-            print(f"  認識された場所: {display_name}")
-            # Google Mapリンク
-            print(f"  [確認用] 駅の位置: https://www.google.com/maps?q={lat},{lon}")
-            return lat, lon
-        else:
-            print("  失敗: 座標が見つかりませんでした。")
-            return None, None
-    except Exception as e:
-        print(f"  エラー: {e}")
-        return None, None
+    local = geocoder.lookup_local(station_name)
+    source = {"known": "stations.csv", "cache": "ローカルキャッシュ"}.get(local[2]) if local else "Nominatim"
+    lat, lon = geocoder.lookup(station_name, timeout=10)
+
+    if lat and lon:
+        print(f"  成功: 緯度={lat}, 経度={lon}")
+        print(f"  取得元: {source}")
+        # Google Mapリンク
+        print(f"  [確認用] 駅の位置: https://www.google.com/maps?q={lat},{lon}")
+        return lat, lon
+    print("  失敗: 座標が見つかりませんでした。")
+    return None, None
 
 def check_osm_data(lat, lon, radius):
     """ Overpass APIで生データを取得して表示 """
@@ -118,7 +104,11 @@ def check_osm_data(lat, lon, radius):
 def main():
     print(f"=== 駅周辺トイレデータ デバッグツール (強化版) ===")
     
-    lat, lon = get_station_location_debug(TARGET_STATION)
+    geocoder = StationGeocoder()
+    try:
+        lat, lon = get_station_location_debug(geocoder, TARGET_STATION)
+    finally:
+        geocoder.close()
     
     if lat and lon:
         for r in SEARCH_RADIUSES:
@@ -126,7 +116,8 @@ def main():
             # サーバー負荷軽減のため少し待つ
             time.sleep(2) 
             
-    print("\n=== 調査終了 ===")
+    print(f"\n{geocoder.summary()}")
+    print("=== 調査終了 ===")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,272 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+from applog import get_logger
+
+# ---------------------------------------------------------
+# Supabase 障害時のサーキットブレーカーと「最後に取れたデータ」での応答
+# ---------------------------------------------------------
+# - 直近 CIRCUIT_WINDOW_SECONDS 秒の問い合わせのうち、障害 (接続エラー・タイムアウト・CIRCUIT_SLOW_MS 超え) が
+#   CIRCUIT_ERROR_RATE 以上 (かつ CIRCUIT_MIN_CALLS 件以上) になったら回路を開く
+# - 開いているあいだは DB に問い合わせず、同じ問い合わせの最後の成功結果を返す (なければすぐ CircuitOpenError)
+#   閉じていても障害になった問い合わせは、最後の成功結果があればそれを返す
+# - 古い結果を返したリクエストには X-Data-Stale / X-Data-Stale-Age / Warning ヘッダーを付け、キャッシュさせない
+# - 開いているあいだはバックグラウンドのスレッドが CIRCUIT_PROBE_SECONDS ごとに軽い問い合わせを投げ、成功したら閉じる
+#
+# 0件の .single() (PGRST116) など、コード付きのエラーは DB が返した正常な応答なので障害に数えない。
+
+CIRCUIT_ENABLED = os.environ.get("CIRCUIT_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+CIRCUIT_WINDOW_SECONDS = float(os.environ.get("CIRCUIT_WINDOW_SECONDS", "30") or 30)
+CIRCUIT_MIN_CALLS = int(os.environ.get("CIRCUIT_MIN_CALLS", "10") or 10)
+CIRCUIT_ERROR_RATE = float(os.environ.get("CIRCUIT_ERROR_RATE", "0.5") or 0.5)
+CIRCUIT_SLOW_MS = float(os.environ.get("CIRCUIT_SLOW_MS", "3000") or 3000)
+CIRCUIT_PROBE_SECONDS = float(os.environ.get("CIRCUIT_PROBE_SECONDS", "5") or 5)
+STALE_MAX_AGE = float(os.environ.get("STALE_MAX_AGE", str(7 * 24 * 3600)) or 0)
+STALE_MAX_ENTRIES = int(os.environ.get("STALE_MAX_ENTRIES", "10000") or 10000)
+
+CLOSED, OPEN = "closed", "open"
+PROBE_TABLE = "lines"
+WRITE_METHODS = {'insert', 'upsert', 'update', 'delete'}
+
+log = get_logger("circuit")
+
+circuit_state = metrics.REGISTRY.register(metrics.Gauge(
+    "toilet_api_circuit_open", "データバックエンドへの回路が開いているか (1: 開・DB に問い合わせない)"))
+circuit_transitions = metrics.REGISTRY.register(metrics.Counter(
+    "toilet_api_circuit_transitions_total", "回路の開閉の回数", ("state",)))
+circuit_rejected = metrics.REGISTRY.register(metrics.Counter(
+    "toilet_api_circuit_rejected_total", "回路が開いていて、古い結果もなく失敗させた問い合わせ", ("table",)))
+stale_served = metrics.REGISTRY.register(metrics.Counter(
+    "toilet_api_stale_results_total", "最後の成功結果で代わりに答えた問い合わせ", ("table", "reason")))
+
+
+class CircuitOpenError(Exception):
+    """ 回路が開いていて問い合わせなかった (古い結果もない) """
+    code = None
+
+
+def is_outage(exc):
+    """ DB まで届いていない・DB が答えられない種類の例外か (コード付きは DB の正常な応答) """
+    return not getattr(exc, 'code', None)
+
+
+class CircuitBreaker:
+    def __init__(self, probe=None, window=CIRCUIT_WINDOW_SECONDS, min_calls=CIRCUIT_MIN_CALLS,
+                 error_rate=CIRCUIT_ERROR_RATE, probe_seconds=CIRCUIT_PROBE_SECONDS):
+        self.probe = probe
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.probe_seconds = probe_seconds
+        self.state = CLOSED
+        self.opened_at = None
+        self._outcomes = deque()     # (時刻, 障害なら True)
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    @property
+    def is_open(self):
+        return self.state == OPEN
+
+    def record(self, failed):
+        now = time.monotonic()
+        with self._lock:
+            self._outcomes.append((now, failed))
+            self._failures += failed
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                _, old = self._outcomes.popleft()
+                self._failures -= old
+            calls = len(self._outcomes)
+            if (self.state == CLOSED and calls >= self.min_calls
+                    and self._failures / calls >= self.error_rate):
+                self._open(calls)
+
+    def _open(self, calls):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        circuit_state.set(value=1)
+        circuit_transitions.inc(OPEN)
+        log.error("circuit opened: %d of %d data calls failed in %.0fs", self._failures, calls, self.window)
+        if self.probe is not None and (self._probe_thread is None or not self._probe_thread.is_alive()):
+            self._probe_thread = threading.Thread(target=self._probe_loop, name="circuit-probe", daemon=True)
+            self._probe_thread.start()
+
+    def close(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            self.state = CLOSED
+            self._outcomes.clear()
+            self._failures = 0
+            down = time.monotonic() - self.opened_at
+        circuit_state.set(value=0)
+        circuit_transitions.inc(CLOSED)
+        log.warning("circuit closed after %.0fs", down)
+
+    def _probe_loop(self):
+        while self.is_open:
+            time.sleep(self.probe_seconds)
+            try:
+                started = time.perf_counter()
+                self.probe()
+                if (time.perf_counter() - started) * 1000 < CIRCUIT_SLOW_MS:
+                    self.close()
+            except Exception as e:
+                log.info("circuit probe failed: %s", e)
+
+
+class StaleStore:
+    """ 問い合わせごとの最後の成功結果 (件数で LRU) """
+
+    def __init__(self, size=STALE_MAX_ENTRIES, max_age=STALE_MAX_AGE):
+        self.size = size
+        self.max_age = max_age
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, response):
+        with self._lock:
+            self._items[key] = (time.time(), response)
+            self._items.move_to_end(key)
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def get(self, key):
+        """ (経過秒, 結果)。なければ / 古すぎれば None """
+        with self._lock:
+            item = self._items.get(key)
+        if item is None:
+            return None
+        age = time.time() - item[0]
+        if self.max_age and age > self.max_age:
+            return None
+        return age, item[1]
+
+
+def _mark_stale(age):
+    request = metrics.current_request()
+    if request is not None:
+        request.stale_age = max(request.stale_age or 0.0, age)
+
+
+def is_stale():
+    """ 処理中のリクエストが古い結果を使ったか """
+    request = metrics.current_request()
+    return request is not None and request.stale_age is not None
+
+
+# ---------------------------------------------------------
+# DB クライアントへの組み込み (InstrumentedClient と同じく table() から包む)
+# ---------------------------------------------------------
+
+class BreakerQuery:
+    def __init__(self, client, table, query, chain=()):
+        self._client = client
+        self._table = table
+        self._query = query
+        self._chain = chain
+
+    def __getattr__(self, name):
+        attr = getattr(self._query, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # ビルダーのメソッドは (新しい) ビルダーを返すので、呼び出しを覚えて包み直す
+            if hasattr(result, 'execute'):
+                return BreakerQuery(self._client, self._table, result,
+                                    self._chain + ((name, args, tuple(sorted(kwargs.items()))),))
+            return result
+        return call
+
+    def execute(self):
+        return self._client.execute(self._table, self._chain, self._query)
+
+
+class BreakerClient:
+    def __init__(self, client, breaker=None, store=None):
+        self.client = client
+        self.breaker = breaker or CircuitBreaker(probe=self._probe)
+        self.stale = store or StaleStore()
+
+    def _probe(self):
+        self.client.table(PROBE_TABLE).select("id").limit(1).execute()
+
+    def table(self, name):
+        return BreakerQuery(self, name, self.client.table(name))
+
+    def _fallback(self, table, key, reason, error):
+        found = self.stale.get(key) if key is not None else None
+        if found is None:
+            if reason == "open":
+                circuit_rejected.inc(table)
+            raise error
+        age, response = found
+        stale_served.inc(table, reason)
+        _mark_stale(age)
+        return response
+
+    def execute(self, table, chain, query):
+        write = any(name in WRITE_METHODS for name, _, _ in chain)
+        key = None if write else repr((table, chain))
+        if self.breaker.is_open:
+            return self._fallback(table, key, "open", CircuitOpenError(f"data backend unavailable (circuit open): {table}"))
+        started = time.perf_counter()
+        try:
+            response = query.execute()
+        except Exception as e:
+            failed = is_outage(e)
+            self.breaker.record(failed)
+            if not failed:
+                raise
+            return self._fallback(table, key, "error", e)
+        self.breaker.record((time.perf_counter() - started) * 1000 >= CIRCUIT_SLOW_MS)
+        if key is not None:
+            self.stale.put(key, response)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def protect(client):
+    """ DB クライアントにサーキットブレーカーを付ける (二重には付けない) """
+    if not CIRCUIT_ENABLED or client is None or isinstance(client, BreakerClient):
+        return client
+    return BreakerClient(client)
+
+
+# ---------------------------------------------------------
+# ASGI ミドルウェア (MetricsMiddleware の内側に置く)
+# ---------------------------------------------------------
+
+STALE_DROP_HEADERS = {b"cache-control", b"etag", b"x-dataset-version"}
+
+
+class StaleMarkerMiddleware:
+    """ 古い結果を使ったリクエストの応答に印を付ける """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                request = metrics.current_request()
+                if request is not None and request.stale_age is not None:
+                    headers = [(k, v) for k, v in message.get("headers", ()) if k.lower() not in STALE_DROP_HEADERS]
+                    headers += [(b"x-data-stale", b"true"), (b"x-data-stale-age", str(int(request.stale_age)).encode()),
+                                (b"warning", b'110 - "Response is Stale"'), (b"cache-control", b"no-store")]
+                    message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,333 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# ---------------------------------------------------------
+# CSVの取り込み (ingest) と型付き列指向データセット
+# ---------------------------------------------------------
+# 各スクリプトが個別に CSV を読み直していた部分をここに集約する。
+# - CSV を1回だけ読み、型を検査・変換して Arrow IPC (.arrow) に書き出す
+# - 読み出し側はファイルをメモリマップして開くので、変換なしにすぐ使える
+# - 元のCSVが更新されていれば (サイズ・更新時刻で判定) そのテーブルだけ自動で取り込み直す
+#
+#   python dataset.py          # 全テーブルを取り込み、検査結果を表示
+#   python dataset.py --check  # 取り込みが古くなっているテーブルを表示
+#
+# pyarrow が無い環境では、読み出しは従来どおり CSV を直接読む。
+# pandas は読み込みに使う関数の中で import する (スナップショットが新しければ API の起動時に読み込まない)。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_DIR = os.environ.get("DATASET_DIR", os.path.join(BASE_DIR, '.cache', 'dataset'))
+MANIFEST = 'manifest.json'
+SCHEMA_VERSION = 2
+# 型変換した列の元の文字列を入れておく列 (<列名>::text)。text=True の読み出しはこれを返す
+TEXT_SUFFIX = '::text'
+
+BOOL_VALUES = {
+    'true': True, '1': True, 'yes': True, 't': True, '○': True,
+    'false': False, '0': False, 'no': False, 'f': False, '×': False, '-': False,
+}
+
+# テーブル名 -> 元CSV・列の型・必須列・列名の読み替え
+# 型: str / int / float / bool。定義にない列は str のまま残す
+SOURCES = {
+    'stations': {
+        'path': 'data/stations.csv',
+        'types': {'line_name': 'str', 'line_color': 'str', 'station_order': 'int', 'station_name': 'str',
+                  'lat': 'float', 'lng': 'float', 'dir_1_label': 'str', 'dir_m1_label': 'str', 'max_cars': 'int'},
+        'required': ['line_name', 'station_name', 'station_order'],
+    },
+    'strategies': {
+        'path': 'data/strategies.csv',
+        'types': {'line_name': 'str', 'station_name': 'str', 'direction': 'int', 'platform_name': 'str',
+                  'car_pos': 'float', 'facility': 'str', 'available_time': 'str', 'crowd': 'int',
+                  'target_toilet_id': 'str', 'route_memo': 'str'},
+        'required': ['line_name', 'station_name', 'direction'],
+    },
+    'toilets': {
+        'path': 'station_toilet.csv',
+        'types': {'lat': 'float', 'lng': 'float', 'lon': 'float',
+                  'wheelchair': 'bool', 'baby_chair': 'bool', 'ostomate': 'bool'},
+        'required': ['station_name'],
+    },
+    'doors': {
+        'path': 'station_doors.csv',
+        'types': {'station_name': 'str', 'line_name': 'str', 'direction': 'str',
+                  'car_number': 'int', 'door_number': 'int', 'nearest_toilet_id': 'str'},
+        'required': ['station_name', 'line_name', 'direction', 'car_number', 'nearest_toilet_id'],
+    },
+    'toilet_ids': {
+        'path': 'toilet_id_list.csv',
+        'rename': {'駅名': 'station_name', 'トイレ表示名': 'toilet_name', '住所(場所)': 'address',
+                   '固定ID (これをコピー)': 'toilet_id'},
+        'types': {},
+        'required': ['station_name', 'toilet_id'],
+    },
+}
+
+
+class DatasetError(ValueError):
+    pass
+
+
+def read_csv_any(filepath):
+    """ BOM付きUTF-8 / CP932 のどちらでも読む (すべて文字列・欠損は空文字) """
+    import pandas as pd
+    for encoding in ('utf-8-sig', 'cp932'):
+        try:
+            df = pd.read_csv(filepath, dtype=str, encoding=encoding, keep_default_na=False)
+            df.columns = df.columns.str.strip()
+            return df
+        except UnicodeDecodeError:
+            continue
+    raise DatasetError(f"{filepath}: 文字コードを判別できません")
+
+
+def _cast(series, kind):
+    """ 型変換した列と、変換できなかった (空でない) 行のマスクを返す """
+    import pandas as pd
+    text = series.str.strip()
+    blank = text == ''
+    if kind == 'int':
+        num = pd.to_numeric(text, errors='coerce')
+        bad = (num.isna() | (num % 1 != 0)) & ~blank
+        return num.where(~bad).astype('Int64'), bad
+    if kind == 'float':
+        num = pd.to_numeric(text, errors='coerce')
+        return num.astype('float64'), num.isna() & ~blank
+    if kind == 'bool':
+        value = text.str.lower().map(BOOL_VALUES)
+        return value.astype('boolean'), value.isna() & ~blank
+    return series, pd.Series(False, index=series.index)
+
+
+def validate_and_cast(name, df):
+    """ 列名の読み替え・必須列の確認・型変換。(DataFrame, 問題のリスト) を返す """
+    spec = SOURCES[name]
+    df = df.rename(columns=spec.get('rename', {}))
+    df = df.loc[:, [c for c in df.columns if c and not c.startswith('Unnamed')]]
+
+    missing = [c for c in spec['required'] if c not in df.columns]
+    if missing:
+        raise DatasetError(f"{spec['path']}: 必須列がありません: {', '.join(missing)}")
+
+    issues = []
+    for col in spec['required']:
+        empty = int((df[col].str.strip() == '').sum())
+        if empty:
+            issues.append({"column": col, "problem": "empty", "rows": empty})
+
+    for col, kind in spec['types'].items():
+        if col not in df.columns:
+            continue
+        if kind != 'str':
+            # 変換できなかった値も元の CSV の表記のまま読めるように、元の文字列を隣に残す
+            df[col + TEXT_SUFFIX] = df[col]
+        df[col], bad = _cast(df[col], kind)
+        if bad.any():
+            issues.append({"column": col, "problem": f"not_{kind}", "rows": int(bad.sum()),
+                           "samples": df.index[bad.to_numpy()][:5].map(lambda i: int(i) + 2).tolist()})  # CSVの行番号
+    return df, issues
+
+
+def _source_path(name, base_dir):
+    return os.path.join(base_dir, SOURCES[name]['path'])
+
+
+def _stat(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if manifest.get("schema_version") == SCHEMA_VERSION else {"tables": {}}
+    except (OSError, ValueError):
+        return {"tables": {}}
+
+
+def _write_manifest(out_dir, manifest):
+    manifest["schema_version"] = SCHEMA_VERSION
+    path = os.path.join(out_dir, MANIFEST)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _arrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc  # noqa: F401
+        return pa
+    except ImportError:
+        return None
+
+
+def ingest_table(name, base_dir=BASE_DIR, out_dir=DATASET_DIR, manifest=None):
+    """ 1テーブルを取り込んで .arrow に書き出す。manifest のエントリを返す """
+    pa = _arrow()
+    if pa is None:
+        raise DatasetError("pyarrow がインストールされていません (pip install pyarrow)")
+    src = _source_path(name, base_dir)
+    if not os.path.exists(src):
+        raise DatasetError(f"{src} が見つかりません")
+
+    started = time.perf_counter()
+    stat = _stat(src)
+    df, issues = validate_and_cast(name, read_csv_any(src))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{name}.arrow")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # 圧縮しない IPC ファイル形式にしておくと、メモリマップでそのまま読める
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+    entry = {
+        "source": SOURCES[name]['path'],
+        **stat,
+        "rows": table.num_rows,
+        "columns": {f.name: str(f.type) for f in table.schema if not f.name.endswith(TEXT_SUFFIX)},
+        "issues": issues,
+        "ingest_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    if manifest is not None:
+        manifest.setdefault("tables", {})[name] = entry
+    return entry
+
+
+def is_stale(name, base_dir=BASE_DIR, out_dir=DATASET_DIR, manifest=None):
+    manifest = manifest if manifest is not None else _read_manifest(out_dir)
+    entry = manifest.get("tables", {}).get(name)
+    src = _source_path(name, base_dir)
+    if entry is None or not os.path.exists(os.path.join(out_dir, f"{name}.arrow")):
+        return True
+    if not os.path.exists(src):
+        return False
+    stat = _stat(src)
+    return stat["size"] != entry.get("size") or stat["mtime_ns"] != entry.get("mtime_ns")
+
+
+def ingest(names=None, base_dir=BASE_DIR, out_dir=DATASET_DIR, force=False):
+    """ 古くなったテーブル (force なら全部) を取り込み直し、manifest を返す """
+    manifest = _read_manifest(out_dir)
+    errors = {}
+    for name in names or SOURCES:
+        if not force and not is_stale(name, base_dir, out_dir, manifest):
+            continue
+        try:
+            ingest_table(name, base_dir, out_dir, manifest)
+        except DatasetError as e:
+            errors[name] = str(e)
+    if manifest.get("tables"):
+        os.makedirs(out_dir, exist_ok=True)
+        _write_manifest(out_dir, manifest)
+    manifest["errors"] = errors
+    return manifest
+
+
+def load_table(name, base_dir=BASE_DIR, out_dir=DATASET_DIR, refresh=True):
+    """
+    pyarrow.Table をメモリマップで開く (列データはコピーしない)。
+    refresh=True なら元CSVが更新されていれば先に取り込み直す。
+    """
+    pa = _arrow()
+    if pa is None:
+        raise DatasetError("pyarrow がインストールされていません (pip install pyarrow)")
+    if refresh and is_stale(name, base_dir, out_dir):
+        result = ingest([name], base_dir, out_dir)
+        if name in result["errors"]:
+            raise DatasetError(result["errors"][name])
+    source = pa.memory_map(os.path.join(out_dir, f"{name}.arrow"), 'r')
+    return pa.ipc.open_file(source).read_all()
+
+
+def load_frame(name, text=False, base_dir=BASE_DIR, out_dir=DATASET_DIR):
+    """
+    pandas の DataFrame で返す。text=True なら従来の load_csv_safe と同じ
+    「すべて文字列・欠損は空文字」の形にする (既存スクリプトの置き換え用)。
+    text=True の値は元の CSV の表記のまま (型変換できなかった値も空にしない)。
+    pyarrow が無ければ CSV を直接読む。
+    """
+    import pandas as pd
+    if _arrow() is None:
+        df = read_csv_any(_source_path(name, base_dir)).rename(columns=SOURCES[name].get('rename', {}))
+        return df if text else _typed_columns(validate_and_cast(name, df)[0])
+
+    df = load_table(name, base_dir, out_dir).to_pandas()
+    if not text:
+        return _typed_columns(df)
+    return pd.DataFrame({c: df[c + TEXT_SUFFIX] if c + TEXT_SUFFIX in df.columns else df[c]
+                         for c in df.columns if not c.endswith(TEXT_SUFFIX)}, index=df.index)
+
+
+def _typed_columns(df):
+    """ 元の文字列の列 (<列名>::text) を除いたもの """
+    return df[[c for c in df.columns if not c.endswith(TEXT_SUFFIX)]]
+
+
+def source_name(filepath):
+    """ CSVパスに対応するテーブル名 (なければ None) """
+    target = os.path.normpath(os.path.abspath(filepath))
+    for name in SOURCES:
+        if os.path.normpath(_source_path(name, BASE_DIR)) == target:
+            return name
+    return None
+
+
+def load_csv_safe(filepath):
+    """ 既存スクリプトの load_csv_safe の置き換え。取り込み対象のCSVならデータセットから読む """
+    import pandas as pd
+    name = source_name(filepath)
+    if name is not None:
+        try:
+            df = load_frame(name, text=True)
+            # 取り込み時の読み替えを戻して、元のCSVと同じ列名で返す
+            reverse = {v: k for k, v in SOURCES[name].get('rename', {}).items()}
+            return df.rename(columns=reverse)
+        except DatasetError as e:
+            print(f"[dataset] {e}")
+            return pd.DataFrame()
+    if not os.path.exists(filepath):
+        return pd.DataFrame()
+    try:
+        return read_csv_any(filepath)
+    except DatasetError:
+        return pd.DataFrame()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSVを検査・型変換して Arrow IPC のデータセットにする")
+    parser.add_argument('--force', action='store_true', help="更新がなくても全テーブルを取り込み直す")
+    parser.add_argument('--check', action='store_true', help="取り込みが古くなっているテーブルを表示するだけ")
+    parser.add_argument('--out', default=DATASET_DIR)
+    args = parser.parse_args()
+
+    if args.check:
+        stale = [name for name in SOURCES if is_stale(name, out_dir=args.out)]
+        print("古いテーブル: " + (", ".join(stale) if stale else "なし"))
+        sys.exit(1 if stale else 0)
+
+    started = time.perf_counter()
+    manifest = ingest(out_dir=args.out, force=args.force)
+    print(f"--- データセット取り込み ({args.out}) ---")
+    for name, entry in manifest.get("tables", {}).items():
+        print(f"  {name:<11} {entry['rows']:>6} 行  {entry['source']}")
+        for issue in entry["issues"]:
+            print(f"    [注意] {issue['column']}: {issue['problem']} {issue['rows']} 行 {issue.get('samples', '')}")
+    for name, message in manifest["errors"].items():
+        print(f"  [エラー] {name}: {message}")
+    print(f"完了 ({(time.perf_counter() - started) * 1000:.0f} ms)")
+    sys.exit(1 if manifest["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
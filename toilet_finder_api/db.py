@@ -0,0 +1,126 @@
+import os
+import threading
+from dotenv import load_dotenv
+import metrics
+from metrics import instrument
+from applog import get_logger
+from singleflight import coalesce
+from circuit import protect
+
+# ---------------------------------------------------------
+# データバックエンドの選択 (api.py / routers/commuter.py 共通)
+# ---------------------------------------------------------
+# DATA_BACKEND=auto      SUPABASE_URL / SUPABASE_KEY があれば Supabase、なければローカル (既定)
+# DATA_BACKEND=supabase  常に Supabase
+# DATA_BACKEND=local     CSV から作った SQLite スナップショット (local_backend.py)
+#
+# どちらのクライアントも table().select()...execute() の同じ書き方で使える。
+# get_client() が返すクライアントは metrics.py の計測付き (execute() ごとの回数・所要時間が /metrics に出る)。
+# 同時に届いた同じ読み取りは1回の問い合わせにまとめる (singleflight.py)。
+# 障害が続いたら問い合わせを止め、最後に取れた結果で答える (circuit.py)。
+# REFDATA_DIR を設定すると、参照テーブル (路線・駅・攻略・トイレ) は共有スナップショット (refdata.py) から読む。
+# モジュールの変数には LazyClient を置く (import 時には Supabase のライブラリを読み込まず、接続もしない)。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv()
+load_dotenv(dotenv_path=os.path.join(BASE_DIR, '.env'))
+
+BACKENDS = ('auto', 'supabase', 'local')
+# ローカルバックエンドとドア索引が読むCSVの置き場所 (合成データセットで試すときに差し替える)
+DATA_DIR = os.environ.get("DATA_DIR", BASE_DIR)
+# 参照データのスナップショットの公開先 (python refdata.py build)。空ならすべて DB から読む
+REFDATA_DIR = os.environ.get("REFDATA_DIR", "")
+
+refdata_version = metrics.REGISTRY.register(metrics.Gauge(
+    "toilet_api_refdata_snapshot", "使用中の参照データのスナップショット (値が1の version)", ("version",)))
+
+_client = None
+_lock = threading.Lock()
+
+
+def supabase_credentials():
+    # キー名が違っても対応できるようにORで繋ぐ (Next.js 側の .env を流用する場合)
+    url = os.environ.get("SUPABASE_URL") or os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
+    key = os.environ.get("SUPABASE_KEY") or os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+    return url, key
+
+
+def backend_name():
+    """ 設定から実際に使うバックエンド名 ('supabase' / 'local') を決める """
+    backend = os.environ.get("DATA_BACKEND", "auto").strip().lower()
+    if backend not in BACKENDS:
+        print(f"Warning: DATA_BACKEND={backend} は不明な値です (auto / supabase / local)。auto として扱います。")
+        backend = "auto"
+    if backend == "auto":
+        url, key = supabase_credentials()
+        return "supabase" if url and key else "local"
+    return backend
+
+
+def create_data_client(backend=None):
+    backend = backend or backend_name()
+    if backend == "local":
+        from local_backend import LocalClient
+        return LocalClient(base_dir=DATA_DIR)
+
+    from supabase import create_client
+    url, key = supabase_credentials()
+    if not url or not key:
+        print("Warning: SUPABASE_URL or SUPABASE_KEY is missing.")
+    return create_client(url or "", key or "")
+
+
+def _on_refdata_swap(previous, snapshot):
+    if previous is not None:
+        refdata_version.set(previous.version, value=0)
+    refdata_version.set(snapshot.version, value=1)
+    get_logger("refdata").info("reference data snapshot %s loaded from %s", snapshot.version, snapshot.path)
+
+
+def wrap_client(client):
+    """ 計測・相乗り・サーキットブレーカーを付け、REFDATA_DIR があれば参照テーブルをスナップショットに回す """
+    # 相乗りした呼び出しは DB に行かないので、計測は相乗りの内側 (実際の問い合わせだけ数える)。
+    # ブレーカーは相乗りの外側に置き、古い結果で答えたことをリクエストごとに記録する
+    client = protect(coalesce(instrument(client)))
+    if REFDATA_DIR and client is not None:
+        from refdata import RefDataClient
+        client = RefDataClient(client, REFDATA_DIR, on_swap=_on_refdata_swap)
+    return client
+
+
+def set_client(client):
+    """ 計測・検証用にクライアントを差し替える (api.py を import する前に呼ぶ) """
+    global _client
+    with _lock:
+        _client = wrap_client(client)
+
+
+def get_client():
+    """ プロセスで1つのクライアントを返す (最初の呼び出しで作る) """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = wrap_client(create_data_client())
+    return _client
+
+
+class LazyClient:
+    """ get_client() の代わりにモジュールの変数に置く。最初に使われたときにクライアントを作る """
+
+    def resolve(self):
+        return get_client()
+
+    def table(self, name):
+        return get_client().table(name)
+
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+    def __bool__(self):
+        return get_client() is not None
+
+
+def resolve_client(client):
+    """ LazyClient なら実体 (作っていなければここで作る) を返す """
+    return client.resolve() if isinstance(client, LazyClient) else client
@@ -0,0 +1,167 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# ---------------------------------------------------------
+# 収集スクリプト動作確認用のローカルスタブサーバー
+# ---------------------------------------------------------
+# Nominatim / Overpass / Gemini の最低限のレスポンスを決定的に返す。
+# generate_station_csv.py を外部APIに触れずに動かすときに使う:
+#
+#   python dev_stub_server.py --port 8765 --fail-rate 0.2
+#   NOMINATIM_URL=http://127.0.0.1:8765/search \
+#   OVERPASS_URL=http://127.0.0.1:8765/api/interpreter \
+#   GEMINI_BASE_URL=http://127.0.0.1:8765/v1beta \
+#   python generate_station_csv.py --fresh
+
+TOKYO_LAT, TOKYO_LON = 35.68, 139.76
+
+
+def _seeded(text):
+    """ 文字列から決定的な乱数生成器を作る """
+    return random.Random(int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16))
+
+
+def fake_geocode(query):
+    rng = _seeded(query)
+    return [{
+        "lat": str(TOKYO_LAT + rng.uniform(-0.15, 0.15)),
+        "lon": str(TOKYO_LON + rng.uniform(-0.2, 0.2)),
+        "display_name": f"{query} (stub)",
+    }]
+
+
+def fake_overpass(query):
+    around = re.search(r"around:(\d+),([\d.\-]+),([\d.\-]+)", query)
+    bbox = re.search(r"\(([\d.\-]+),([\d.\-]+),([\d.\-]+),([\d.\-]+)\)", query)
+    if around:
+        lat, lon = float(around.group(2)), float(around.group(3))
+        span = int(around.group(1)) / 111000
+        south, west, north, east = lat - span, lon - span, lat + span, lon + span
+    elif bbox:
+        south, west, north, east = (float(v) for v in bbox.groups())
+    else:
+        return {"elements": []}
+
+    # 約0.002度のグリッド上に決定的にトイレを置く (範囲が重なれば同じ要素が返る)
+    step = 0.002
+    elements = []
+    i = int(south / step)
+    while i * step <= north:
+        j = int(west / step)
+        while j * step <= east:
+            rng = _seeded(f"{i}:{j}")
+            if rng.random() < 0.15:
+                lat, lon = i * step, j * step
+                if south <= lat <= north and west <= lon <= east:
+                    elements.append({
+                        "type": "node",
+                        "id": abs(hash((i, j))) % 10 ** 10,
+                        "lat": lat,
+                        "lon": lon,
+                        "tags": {
+                            "amenity": "toilets",
+                            "name": f"スタブトイレ{i % 100}-{j % 100}",
+                            "wheelchair": rng.choice(["yes", "no"]),
+                        },
+                    })
+            j += 1
+        i += 1
+    return {"elements": elements}
+
+
+def fake_gemini(payload):
+    text = payload.get("contents", [{}])[0].get("parts", [{}])[0].get("text", "")
+    digest = hashlib.md5(text.encode('utf-8')).hexdigest()[:6]
+    # まとめて生成 (route_guide.py) の場合はプロンプト末尾のJSON配列に1件ずつ答える
+    start = text.rfind('\n[')
+    if start >= 0:
+        try:
+            items = json.loads(text[start + 1:])
+            answer = [{"i": it["i"], "guide": f"{it['station']}のスタブ案内文 {it['toilet']}"} for it in items]
+            return {"candidates": [{"content": {"parts": [{"text": json.dumps(answer, ensure_ascii=False)}]}}]}
+        except (ValueError, KeyError, TypeError):
+            pass
+    return {"candidates": [{"content": {"parts": [{"text": f"スタブ案内文 {digest}"}]}}]}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    fail_rate = 0.0
+    latency = 0.0
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _maybe_fail(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            self._send_json(503, {"error": "stub: simulated overload"})
+            return True
+        return False
+
+    def do_GET(self):
+        if self._maybe_fail():
+            return
+        url = urlsplit(self.path)
+        qs = parse_qs(url.query)
+        if url.path.endswith('/search'):
+            self._send_json(200, fake_geocode(qs.get('q', [''])[0]))
+        elif url.path.endswith('/interpreter'):
+            self._send_json(200, fake_overpass(qs.get('data', [''])[0]))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self._maybe_fail():
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {"error": "invalid json"})
+            return
+        url = urlsplit(self.path)
+        if url.path.endswith(':generateContent'):
+            self._send_json(200, fake_gemini(payload))
+        elif url.path.endswith('/interpreter'):
+            self._send_json(200, fake_overpass(payload.get('data', '')))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nominatim/Overpass/Gemini のローカルスタブ")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="503を返す確率 (リトライ確認用)")
+    parser.add_argument('--latency', type=float, default=0.0, help="応答前に待つ秒数")
+    args = parser.parse_args()
+
+    StubHandler.fail_rate = args.fail_rate
+    StubHandler.latency = args.latency
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"スタブサーバー起動: http://{args.host}:{args.port} (fail_rate={args.fail_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
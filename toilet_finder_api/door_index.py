@@ -0,0 +1,146 @@
+import csv
+import os
+from array import array
+from line_rules import display_line_name as line_key
+
+# ---------------------------------------------------------
+# ドア単位の最寄りトイレ索引 (station_doors.csv)
+# ---------------------------------------------------------
+# (駅, 路線, 方向) ごとに「号車 x ドア」の密な配列を持ち、
+# 値はトイレIDの文字列テーブルへの添字 (-1 = 対応なし)。
+# /predict からは dict 1回 + 配列の添字アクセス1回で引ける。
+#
+# CSV の方向は「渋谷方面」「内回り」のようなラベルなので、
+# data/stations.csv の dir_1_label / dir_m1_label と突き合わせて API の direction (1 / -1) に直す。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATION_DOORS_CSV = os.path.join(BASE_DIR, 'station_doors.csv')
+STATIONS_CSV = os.path.join(BASE_DIR, 'data', 'stations.csv')
+TOILET_ID_LIST_CSV = os.path.join(BASE_DIR, 'toilet_id_list.csv')
+
+# 環状線はラベルが「方面」にならないので固定で対応させる
+LOOP_DIRECTIONS = {
+    '山手線': {'外回り': 1, '内回り': -1},
+}
+
+NO_TOILET = -1
+
+
+def _direction_terms(label):
+    """ '横浜・大船 方面' -> {'横浜', '大船'} """
+    label = str(label or '').replace(' ', '').replace('　', '').removesuffix('方面')
+    return {t for t in label.split('・') if t}
+
+
+def _read_csv(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+class DoorIndex:
+    def __init__(self):
+        self.slots = {}        # (station_name, line_key, direction) -> (doors_per_car, array)
+        self.toilet_ids = []   # 文字列テーブル
+        self.toilet_names = {}
+        self._toilet_pos = {}
+
+    def _toilet_index(self, toilet_id):
+        pos = self._toilet_pos.get(toilet_id)
+        if pos is None:
+            pos = self._toilet_pos[toilet_id] = len(self.toilet_ids)
+            self.toilet_ids.append(toilet_id)
+        return pos
+
+    @classmethod
+    def from_csv(cls, doors_csv=STATION_DOORS_CSV, stations_csv=STATIONS_CSV, toilet_list_csv=TOILET_ID_LIST_CSV):
+        index = cls()
+
+        # 路線ごとの方向ラベルと駅順 (ラベルで決まらない場合は行き先駅の順番で判定する)
+        labels = {}
+        orders = {}
+        for row in _read_csv(stations_csv):
+            key = line_key(row.get('line_name'))
+            labels.setdefault(key, (set(), set()))
+            labels[key][0].update(_direction_terms(row.get('dir_1_label')))
+            labels[key][1].update(_direction_terms(row.get('dir_m1_label')))
+            try:
+                orders[(key, row.get('station_name', '').strip())] = int(row.get('station_order') or 0)
+            except ValueError:
+                pass
+
+        def resolve_direction(lkey, station, label):
+            label = str(label or '').strip()
+            if label in LOOP_DIRECTIONS.get(lkey, {}):
+                return LOOP_DIRECTIONS[lkey][label]
+            terms = _direction_terms(label)
+            dir_1, dir_m1 = labels.get(lkey, (set(), set()))
+            if terms & dir_1:
+                return 1
+            if terms & dir_m1:
+                return -1
+            here = orders.get((lkey, station))
+            there = next((orders[(lkey, t)] for t in terms if (lkey, t) in orders), None)
+            if here is not None and there is not None and here != there:
+                return 1 if there > here else -1
+            return None
+
+        # 1パス目で (駅, 路線, 方向) ごとの号車数・ドア数を求め、2パス目で密な配列を埋める
+        entries = []
+        sizes = {}
+        for row in _read_csv(doors_csv):
+            lkey = line_key(row.get('line_name'))
+            station = row.get('station_name', '').strip()
+            direction = resolve_direction(lkey, station, row.get('direction'))
+            toilet_id = (row.get('nearest_toilet_id') or '').strip()
+            try:
+                car, door = int(row.get('car_number')), int(row.get('door_number') or 1)
+            except (TypeError, ValueError):
+                continue
+            if direction is None or not toilet_id or car < 1 or door < 1:
+                continue
+            key = (station, lkey, direction)
+            max_car, max_door = sizes.get(key, (0, 0))
+            sizes[key] = (max(max_car, car), max(max_door, door))
+            entries.append((key, car, door, toilet_id))
+
+        for key, (max_car, max_door) in sizes.items():
+            index.slots[key] = (max_door, array('i', [NO_TOILET]) * (max_car * max_door))
+        for key, car, door, toilet_id in entries:
+            doors_per_car, slots = index.slots[key]
+            slots[(car - 1) * doors_per_car + (door - 1)] = index._toilet_index(toilet_id)
+
+        # 表示名 (DB の toilets に無いIDでも名前だけは返せるように)
+        for row in _read_csv(toilet_list_csv):
+            tid = next((v for k, v in row.items() if k and k.startswith('固定ID')), None)
+            if tid and tid.strip() in index._toilet_pos:
+                index.toilet_names[tid.strip()] = (row.get('トイレ表示名') or '').strip() or None
+        return index
+
+    def lookup(self, station_name, line_name, direction, car, door=1):
+        """ 最寄りトイレIDを返す。対応がなければ None (呼び出し側は号車単位の攻略データに戻る) """
+        entry = self.slots.get((str(station_name).strip(), line_key(line_name), direction))
+        if entry is None or car < 1 or door < 1:
+            return None
+        doors_per_car, slots = entry
+        if door > doors_per_car:
+            return None
+        pos = (car - 1) * doors_per_car + (door - 1)
+        if pos >= len(slots) or slots[pos] == NO_TOILET:
+            return None
+        return self.toilet_ids[slots[pos]]
+
+    def door_position(self, station_name, line_name, direction, car, door=1):
+        """ 号車内のドアの位置を号車単位の小数で返す (号車の中央 = car。ドア番号は号車番号と同じ向きに数える前提) """
+        entry = self.slots.get((str(station_name).strip(), line_key(line_name), direction))
+        if entry is None or car < 1 or not 1 <= door <= entry[0]:
+            return None
+        return car + (door - 0.5) / entry[0] - 0.5
+
+    def summary(self):
+        filled = sum(sum(1 for v in slots if v != NO_TOILET) for _, slots in self.slots.values())
+        return f"ドア索引: {len(self.slots)} 駅・方向 / {filled} ドア / トイレ {len(self.toilet_ids)} 件"
+
+    def __len__(self):
+        return len(self.slots)
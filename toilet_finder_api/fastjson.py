@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Union, get_args, get_origin
+
+from starlette.responses import Response
+
+import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ---------------------------------------------------------
+# 検証済み・エンコード済みの JSON 応答
+# ---------------------------------------------------------
+# FastAPI は response_model のあるエンドポイントの戻り値を1行ずつ pydantic で検証し直し、
+# jsonable_encoder を通してから json.dumps する。/predict・/lines のように自分で型をそろえて組み立てた dict では
+# データがキャッシュに載ったあとはこれが CPU の大半になるので、次のようにする。
+#   - 行は Shape (response_model から作る) でキーの並びと型が一致しているかだけを見る
+#     一致しない行だけ pydantic に通す (出力は今までと同じ)
+#   - エンコードは orjson があれば orjson、なければ json (JSONResponse と同じ書式)
+#   - /lines・/stations はエンコード済みの本文を ETag ごとに覚えておき、同じ version の間は組み立て直さない
+# エンドポイントが Response を返すと FastAPI は検証しないが、response_model は OpenAPI にそのまま残る。
+
+ENCODED_CACHE_SIZE = int(os.environ.get("ENCODED_CACHE_SIZE", "256") or 0)
+
+JSON_MEDIA_TYPE = "application/json"
+PLAIN_TYPES = (str, int, float, bool, type(None))
+
+
+def dumps(obj):
+    """ bytes を返す。orjson がなければ JSONResponse と同じ書式の json.dumps """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode('utf-8')
+
+
+def _plain_types(annotation):
+    """ そのまま JSON に出してよい Python の型 (Optional[float] -> {float, NoneType})。それ以外は空 """
+    if get_origin(annotation) is Union:
+        types = [_plain_types(arg) for arg in get_args(annotation)]
+        return frozenset().union(*types) if all(types) else frozenset()
+    return frozenset((annotation,)) if annotation in PLAIN_TYPES else frozenset()
+
+
+class Shape:
+    """ pydantic モデルのフィールドの並びと型 (モデルごとに1回だけ作る) """
+
+    def __init__(self, model):
+        self.model = model
+        self.names = tuple(model.model_fields)
+        self.types = tuple(_plain_types(field.annotation) for field in model.model_fields.values())
+
+    def conform(self, row):
+        """ 並びと型が一致していればそのまま、していなければ pydantic で検証して dict に戻したもの """
+        if tuple(row) == self.names and all(type(v) in t for v, t in zip(row.values(), self.types)):
+            return row
+        return self.model.model_validate(row).model_dump(mode="json")
+
+
+def encode_rows(rows, shape=None):
+    return dumps([shape.conform(row) for row in rows] if shape is not None else rows)
+
+
+def respond(body, headers=None):
+    """ エンコード済みの本文をそのまま返す (依存関係で付けたヘッダーは headers で渡す) """
+    return Response(body, media_type=JSON_MEDIA_TYPE, headers=headers)
+
+
+class EncodedBodies:
+    """ ETag -> エンコード済みの本文 (件数で LRU) """
+
+    def __init__(self, size=ENCODED_CACHE_SIZE):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        with self._lock:
+            body = self._items.get(etag)
+            if body is not None:
+                self._items.move_to_end(etag)
+        if body is None:
+            metrics.cache_miss("encoded_body")
+        else:
+            metrics.cache_hit("encoded_body")
+        return body
+
+    def put(self, etag, body):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._items[etag] = body
+            self._items.move_to_end(etag)
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
@@ -1,22 +1,14 @@
-import pandas as pd
 import requests
 from bs4 import BeautifulSoup
 import time
 import re
 import urllib.parse
+from dataset import load_csv_safe  # 取り込み済みデータセット (python dataset.py) から読む
 
 # ファイルパス
 STATIONS_CSV = 'data/stations.csv'
 STRATEGIES_CSV = 'data/strategies.csv'
 
-def load_csv_safe(filepath):
-    try:
-        df = pd.read_csv(filepath, dtype=str, encoding='utf-8-sig').fillna('')
-        df.columns = df.columns.str.strip()
-        return df
-    except:
-        return pd.DataFrame()
-
 def clean_text(text):
     if not text: return ""
     # "1・2番線" -> "1,2" (今回は単純化のため最初の数字だけ取る)
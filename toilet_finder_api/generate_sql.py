@@ -1,7 +1,8 @@
 import pandas as pd
-import os
 import uuid
 import re
+from line_rules import platform_for, DEFAULT_MATCHER
+from dataset import load_csv_safe  # 取り込み済みデータセット (python dataset.py) から読む
 
 # ファイルパス定義
 STATIONS_CSV = 'data/stations.csv'
@@ -16,69 +17,12 @@ OUTPUT_SQL_3_PREFIX = '03_strategies'
 # 分割設定
 MAX_INSERTS_PER_FILE = 500
 
-# ---------------------------------------------------------
-# 路線ごとのホーム規則定義
-# ---------------------------------------------------------
-PLATFORM_RULES = {
-    "銀座線": {1: "1番線", -1: "2番線"},
-    "丸ノ内線": {1: "1番線", -1: "2番線"},
-    "日比谷線": {1: "1番線", -1: "2番線"},
-    "東西線": {1: "1番線", -1: "2番線"},
-    "千代田線": {1: "1番線", -1: "2番線"},
-    "有楽町線": {1: "1番線", -1: "2番線"},
-    "半蔵門線": {1: "1番線", -1: "2番線"},
-    "南北線": {1: "1番線", -1: "2番線"},
-    "副都心線": {1: "1番線", -1: "2番線"},
-    "都営浅草線": {1: "1番線", -1: "2番線"},
-    "都営三田線": {1: "1番線", -1: "2番線"},
-    "都営新宿線": {1: "1番線", -1: "2番線"},
-    "都営大江戸線": {1: "1番線", -1: "2番線"},
-    "山手線": {1: "内回りホーム", -1: "外回りホーム"}, 
-    "京浜東北線": {1: "1番線", -1: "2番線"},
-    "中央線": {1: "1番線", -1: "2番線"},
-    "総武線": {1: "1番線", -1: "2番線"},
-    "小田急小田原線": {1: "1番線", -1: "2番線"},
-    "東急東横線": {1: "1番線", -1: "2番線"},
-    # 必要に応じて追加
-}
-
-def normalize_line_name(name: str) -> str:
-    if not name: return ""
-    normalized = str(name).strip()
-    prefixes = ["東京メトロ", "都営地下鉄", "都営", "JR", "東急", "小田急", "京王", "西武", "東武", "京急", "京成"]
-    for p in prefixes:
-        normalized = normalized.replace(p, "")
-    if normalized.endswith("線"): normalized = normalized[:-1]
-    elif normalized.endswith("ライン"): normalized = normalized.replace("ライン", "")
-    return normalized.strip()
-
-def get_platform_name_from_rules(line_name, direction):
-    norm_target = normalize_line_name(line_name)
-    for key in PLATFORM_RULES:
-        norm_key = normalize_line_name(key)
-        if norm_key in norm_target or norm_target in norm_key:
-            return PLATFORM_RULES[key].get(direction, "ホーム")
-    return "ホーム"
+# 路線ごとのホーム規則は line_rules.py に集約 (fix_strategies.py と共通)
 
 def get_max_cars_from_config(line_name):
     # stations.csv から読み込むのが基本だが、ここでもデフォルト値を持てると安全
     return 10
 
-def load_csv_safe(filepath):
-    if not os.path.exists(filepath): return pd.DataFrame()
-    try:
-        # BOM付きUTF-8やCP932などに対応
-        df = pd.read_csv(filepath, dtype=str, encoding='utf-8-sig').fillna('')
-        df.columns = df.columns.str.strip()
-        return df
-    except UnicodeDecodeError:
-        try:
-            df = pd.read_csv(filepath, dtype=str, encoding='cp932').fillna('')
-            df.columns = df.columns.str.strip()
-            return df
-        except: return pd.DataFrame()
-    except: return pd.DataFrame()
-
 def save_sql_split(sql_statements, base_filename, max_lines=MAX_INSERTS_PER_FILE):
     if not sql_statements: return
     total_parts = (len(sql_statements) // max_lines) + 1
@@ -121,6 +65,8 @@ def generate_sql():
         "DROP TABLE IF EXISTS lines CASCADE;",
         "DROP TABLE IF EXISTS congestion_reports CASCADE;",
         "DROP TABLE IF EXISTS profiles CASCADE;",
+        # テーブルを作り直すのでインデックス等のマイグレーションも再適用させる (run_migrations.py)
+        "DROP TABLE IF EXISTS schema_migrations;",
         "",
         # マスタテーブル
         "CREATE TABLE public.lines (id uuid NOT NULL DEFAULT gen_random_uuid(), name text NOT NULL UNIQUE, color text, max_cars integer DEFAULT 10, PRIMARY KEY (id));",
@@ -359,7 +305,7 @@ def generate_sql():
             
             platform = row.get('platform_name', '')
             if not platform or str(platform) == 'nan':
-                platform = get_platform_name_from_rules(line_name, direction)
+                platform = platform_for(line_name, direction)
             platform = str(platform).replace("'", "''")
             
             sql_3.append(
@@ -369,6 +315,12 @@ def generate_sql():
             )
 
     save_sql_split(sql_3, OUTPUT_SQL_3_PREFIX)
+
+    # ホーム規則とデータの食い違いを報告 (詳細は python line_rules.py)
+    if not df_str.empty and 'line_name' in df_str.columns:
+        report = DEFAULT_MATCHER.report(df_str['line_name'])
+        if report['unmatched_lines'] or report['conflicts']:
+            print(f"[注意] ホーム規則のない路線: {', '.join(report['unmatched_lines']) or 'なし'} / 規則の衝突: {len(report['conflicts'])} 件")
     
     print("完了: SQLファイルを生成しました。")
 
@@ -1,103 +1,55 @@
-import requests
+import asyncio
+import argparse
 import pandas as pd
-import time
 import uuid
 import os
 import json
-import sys
 from dotenv import load_dotenv
+from async_fetch import AsyncFetcher, HostRateLimiter, ResponseCache, FetchError
+from geo import GridIndex, bounding_box
+from geocoder import StationGeocoder
+from route_guide import GuideGenerator, guide_inputs
 
 # ---------------------------------------------------------
 # 設定
 # ---------------------------------------------------------
 STATIONS_CSV = 'data/stations.csv'
 OUTPUT_CSV = 'station_toilet.csv'
+LINKS_CSV = 'station_toilet_links.csv'  # トイレと駅(路線)の多対多の対応
+CHECKPOINT_FILE = 'station_toilet.checkpoint.jsonl'
+CACHE_DIR = '.cache/http'
 SEARCH_RADIUS = 500
 
-# Overpass APIのエンドポイント
-OVERPASS_URL = "https://overpass.kumi.systems/api/interpreter"
+# Overpass一括取得のタイルの一辺 (度)。大きすぎるとタイムアウトしやすい
+TILE_SIZE_DEG = 0.2
+
+# 各APIのエンドポイント (環境変数でローカルのスタブサーバーに差し替え可能)
+# Nominatim は geocoder.py 側 (NOMINATIM_URL)、Gemini は route_guide.py 側 (GEMINI_BASE_URL)
+OVERPASS_URL = os.environ.get("OVERPASS_URL", "https://overpass.kumi.systems/api/interpreter")
 
 # リトライ設定
 MAX_RETRIES = 3
-RETRY_DELAY = 5 
+RETRY_DELAY = 5
+
+# 同時に処理する駅の数
+CONCURRENCY = 4
+
+# ホストごとのレート制限 (1秒あたりのリクエスト数, バースト)
+# Nominatim の利用規約は 1req/s
+HOST_RATES = {
+    "nominatim.openstreetmap.org": (1.0, 1),
+    "overpass.kumi.systems": (1.0, 2),
+}
 
-# Gemini API設定
+# Gemini API設定 (案内文の生成は route_guide.py のステージで行う)
 load_dotenv()
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-USE_GEMINI = False 
+USE_GEMINI = bool(os.environ.get("GEMINI_API_KEY"))
 
-if GEMINI_API_KEY:
-    USE_GEMINI = True
-    print("Gemini API: 有効 (REST APIモード)")
+if USE_GEMINI:
+    print("Gemini API: 有効 (まとめて生成・キャッシュ)")
 else:
     print("Gemini API: 無効 (APIキーが設定されていません)")
 
-def generate_route_guide(line_name, station_name, toilet_name, floor, features):
-    """ Gemini APIを使ってトイレへの案内文を生成する (モデル自動切替版) """
-    if not USE_GEMINI:
-        return f"{station_name}駅周辺のトイレ情報です。"
-
-    # 試行するモデルのリスト (優先順)
-    models_to_try = [
-        "gemini-1.5-flash", 
-        "gemini-1.5-flash-latest", 
-        "gemini-1.0-pro"
-    ]
-
-    prompt = f"""
-    あなたは親切な駅員です。以下の情報をもとに、駅のホームからトイレへの行き方を推測して、簡潔で分かりやすい案内文（100文字以内）を作成してください。
-    
-    条件:
-    - 駅名: {station_name}駅
-    - 路線: {line_name}
-    - トイレの場所: {toilet_name}
-    - 階数: {floor if floor else "不明"}
-    - 特徴: {features}
-    
-    もし情報が少なくて推測できない場合は、「{station_name}駅の係員にお尋ねください。」のような無難な案内にして、嘘の道順は書かないでください。
-    トーン: 丁寧語で、急いでいる人に配慮した簡潔さ。
-    """
-    
-    payload = {
-        "contents": [{
-            "parts": [{"text": prompt}]
-        }]
-    }
-    
-    for model_name in models_to_try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={GEMINI_API_KEY}"
-        
-        try:
-            response = requests.post(url, headers={'Content-Type': 'application/json'}, json=payload, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if 'candidates' in data and data['candidates']:
-                    text = data['candidates'][0]['content']['parts'][0]['text']
-                    return text.replace("\n", " ")
-                else:
-                    return f"{station_name}駅周辺のトイレ情報です。"
-            
-            elif response.status_code == 404:
-                # モデルが見つからない場合は次のモデルを試す
-                # print(f"  [Info] Model {model_name} not found, trying next...")
-                continue
-            
-            elif response.status_code == 429:
-                print("  [Gemini] Rate limit exceeded. Using default text.")
-                return f"{station_name}駅周辺のトイレ情報です。"
-                
-            else:
-                print(f"  [Gemini Error] {response.status_code}: {response.text[:50]}...")
-                return f"{station_name}駅周辺のトイレ情報です。"
-
-        except Exception as e:
-            print(f"  [Gemini Error] {e}")
-            continue
-
-    # 全モデル失敗時
-    return f"{station_name}駅周辺のトイレ情報です。"
-
 def load_target_stations():
     """ stations.csv から検索対象の駅リストを読み込む """
     if not os.path.exists(STATIONS_CSV):
@@ -109,7 +61,7 @@ def load_target_stations():
         ]
     
     try:
-        df = pd.read_csv(STATIONS_CSV, dtype=str).fillna('')
+        df = pd.read_csv(STATIONS_CSV, dtype=str, encoding='utf-8-sig').fillna('')
         if 'station_name' not in df.columns or 'line_name' not in df.columns:
             print("Error: stations.csv に必要なカラム(station_name, line_name)がありません。")
             return []
@@ -120,175 +72,342 @@ def load_target_stations():
         print(f"Error loading CSV: {e}")
         return []
 
-def get_station_location(station_name):
-    """ 駅の中心座標を取得 (Nominatim API) """
-    url = "https://nominatim.openstreetmap.org/search"
-    params = {
-        'q': f"{station_name}駅 東京都",
-        'format': 'json',
-        'limit': 1
-    }
-    headers = {
-        'User-Agent': 'station_toilet_collector_v6_robust'
-    }
-    
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.get(url, params=params, headers=headers, timeout=20)
-            response.raise_for_status()
-            data = response.json()
-            if data and len(data) > 0:
-                return float(data[0]['lat']), float(data[0]['lon'])
-            return None, None
-        except Exception:
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(RETRY_DELAY)
-                continue
-            pass
-    return None, None
-
-def fetch_osm_toilets(lat, lon, radius):
-    """ Overpass APIでトイレデータを取得 """
-    query = f"""
-    [out:json][timeout:90];
+def _overpass_query(south, west, north, east):
+    return f"""
+    [out:json][timeout:180];
     (
-      node["amenity"="toilets"](around:{radius},{lat},{lon});
-      way["amenity"="toilets"](around:{radius},{lat},{lon});
+      node["amenity"="toilets"]({south},{west},{north},{east});
+      way["amenity"="toilets"]({south},{west},{north},{east});
     );
     out center;
     """
-    
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.get(OVERPASS_URL, params={'data': query}, timeout=100)
-            
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    return data.get('elements', [])
-                except ValueError:
-                    print(f"  [Error] Invalid JSON response.")
-                    return []
-            
-            if response.status_code in [429, 500, 502, 503, 504]:
-                print(f"  [Retry {attempt+1}/{MAX_RETRIES}] Server Busy ({response.status_code}). Waiting...")
-                time.sleep(RETRY_DELAY * (attempt + 1))
+
+async def fetch_osm_toilets_bbox(fetcher, south, west, north, east):
+    """ Overpass APIで矩形内のトイレデータをまとめて取得 """
+    query = _overpass_query(round(south, 5), round(west, 5), round(north, 5), round(east, 5))
+    data = await fetcher.get_json(OVERPASS_URL, params={'data': query})
+    return data.get('elements', [])
+
+def load_osm_extract(path, bbox):
+    """
+    ローカルのOSMデータからトイレ要素を読み込む。
+    Overpass の JSON 出力 (.json) と OSM XML (.osm) に対応。XMLはストリームで読み、
+    way の中心座標用に矩形内のノード座標だけを保持する。
+    """
+    south, west, north, east = bbox
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('elements', [])
+
+    import xml.etree.ElementTree as ET
+    node_coords = {}
+    elements = []
+    tags, refs = {}, []
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            # relation の tag も新しい dict に入れる (直前に追加した way の tags を書き換えないように)
+            if elem.tag in ('node', 'way', 'relation'):
+                tags, refs = {}, []
+            continue
+        if elem.tag == 'tag':
+            tags[elem.get('k')] = elem.get('v')
+        elif elem.tag == 'nd':
+            refs.append(elem.get('ref'))
+        elif elem.tag == 'node':
+            lat, lon = float(elem.get('lat')), float(elem.get('lon'))
+            if south <= lat <= north and west <= lon <= east:
+                node_coords[elem.get('id')] = (lat, lon)
+                if tags.get('amenity') == 'toilets':
+                    elements.append({"type": "node", "id": int(elem.get('id')), "lat": lat, "lon": lon, "tags": tags})
+            elem.clear()
+        elif elem.tag == 'way':
+            if tags.get('amenity') == 'toilets':
+                pts = [node_coords[r] for r in refs if r in node_coords]
+                if pts:
+                    center = {"lat": sum(p[0] for p in pts) / len(pts), "lon": sum(p[1] for p in pts) / len(pts)}
+                    elements.append({"type": "way", "id": int(elem.get('id')), "center": center, "tags": tags})
+            elem.clear()
+        elif elem.tag == 'relation':
+            elem.clear()
+    return elements
+
+def plan_tiles(station_coords, radius, tile_size=TILE_SIZE_DEG):
+    """ 全駅の外接矩形をタイルに分割し、駅から半径以内にかかるタイルだけを返す """
+    south, west, north, east = bounding_box(station_coords, margin_m=radius)
+    tiles = set()
+    for lat, lon in station_coords:
+        s, w, n, e = bounding_box([(lat, lon)], margin_m=radius)
+        for i in range(int((s - south) // tile_size), int((n - south) // tile_size) + 1):
+            for j in range(int((w - west) // tile_size), int((e - west) // tile_size) + 1):
+                tiles.add((i, j))
+    result = []
+    for i, j in sorted(tiles):
+        t_south = south + i * tile_size
+        t_west = west + j * tile_size
+        result.append((f"{i}:{j}", (t_south, t_west, min(t_south + tile_size, north), min(t_west + tile_size, east))))
+    return result
+
+# ---------------------------------------------------------
+# チェックポイント (1レコード1行のJSONL。中断しても次回はここから再開)
+# kind=station: 駅の座標 / kind=tile: タイル内のトイレ要素
+# ---------------------------------------------------------
+def load_checkpoint(path):
+    stations, tiles = {}, {}
+    if not os.path.exists(path):
+        return stations, tiles
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
                 continue
-            else:
-                print(f"  [Error] API Error: {response.status_code}")
-                return []
-                
-        except Exception as e:
-            print(f"  [Error] Connection failed: {e}")
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(RETRY_DELAY)
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # 書き込み途中で落ちた最終行は捨てる
                 continue
-            return []
-    
-    return []
+            if rec.get('kind') == 'tile':
+                tiles[rec['tile']] = rec
+            elif 'station_name' in rec:
+                stations[rec['station_name']] = rec
+    return stations, tiles
 
-def main():
-    print("=== トイレデータ収集開始 (堅牢版) ===")
-    
-    targets = load_target_stations()
-    print(f"対象: {len(targets)} 件の駅データ")
-    
-    all_toilets = []
-    processed_stations = {}
+def append_checkpoint(path, record):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+async def locate_station(fetcher, geocoder, station_name, semaphore):
+    """ 駅の中心座標 (stations.csv の既知座標 → キャッシュ → Nominatim) """
+    async with semaphore:
+        lat, lon = await geocoder.lookup_async(station_name, fetcher)
+        return {"kind": "station", "station_name": station_name, "lat": lat, "lon": lon}
 
+async def collect_tile(fetcher, tile_key, bbox, semaphore):
+    """ 1タイル分のトイレ要素を取得する (失敗時は None) """
+    async with semaphore:
+        try:
+            elements = await fetch_osm_toilets_bbox(fetcher, *bbox)
+        except FetchError as e:
+            print(f"  [Error] タイル {tile_key}: Overpass取得失敗 ({e}) -> 次回再試行")
+            return None
+        return {"kind": "tile", "tile": tile_key, "bbox": list(bbox), "elements": elements}
+
+async def gather_checkpointed(tasks, label, store, key_name):
+    """ タスクを完了順に受け取り、チェックポイントへ追記する (中断されたら残りのタスクも止める) """
     try:
-        for i, station in enumerate(targets):
-            s_name = station["station_name"]
-            l_name = station["line_name"]
-            
-            print(f"[{i+1}/{len(targets)}] {s_name} ({l_name})...", end=" ", flush=True)
-            
-            if s_name in processed_stations:
-                lat, lon = processed_stations[s_name]
-            else:
-                lat, lon = get_station_location(s_name)
-                if lat:
-                    processed_stations[s_name] = (lat, lon)
-                time.sleep(1.2)
-            
-            if not lat:
-                print("座標不明 -> Skip")
+        for i, task in enumerate(asyncio.as_completed(tasks), start=1):
+            rec = await task
+            if rec is None:
                 continue
+            append_checkpoint(CHECKPOINT_FILE, rec)
+            store[rec[key_name]] = rec
+            print(f"  [{label} {i}/{len(tasks)}] {rec[key_name]}", flush=True)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+def group_lines_by_station(targets):
+    """ 駅名 -> その駅を通る路線名のリスト (stations.csv の出現順) """
+    lines_by_station = {}
+    for t in targets:
+        lines = lines_by_station.setdefault(t["station_name"], [])
+        if t["line_name"] not in lines:
+            lines.append(t["line_name"])
+    return lines_by_station
+
+def assign_toilets(elements, targets, station_coords, radius):
+    """
+    トイレ要素を格子インデックスで駅に割り当てる。
+    トイレは1件1行、駅(路線)との対応は多対多のリンクとして返す。
+    """
+    lines_by_station = group_lines_by_station(targets)
+
+    # 経度方向のセル幅は対象地域の緯度に合わせる (駅の緯度の平均)
+    lats = [lat for lat, _ in station_coords.values()]
+    index = GridIndex(radius, ref_lat=sum(lats) / len(lats)) if lats else GridIndex(radius)
+    for s_name, (lat, lon) in station_coords.items():
+        index.insert(lat, lon, s_name)
+
+    toilets = {}
+    links = []
+    for el in elements:
+        t_lat = el.get('lat') or el.get('center', {}).get('lat')
+        t_lon = el.get('lon') or el.get('center', {}).get('lon')
+        if not t_lat: continue
+
+        osm_key = f"osm:{el.get('type')}/{el.get('id')}"
+        if osm_key in toilets: continue
+
+        nearby = index.within(t_lat, t_lon)
+        if not nearby: continue
 
-            elements = fetch_osm_toilets(lat, lon, SEARCH_RADIUS)
-            print(f"発見: {len(elements)}件")
-            
-            for el in elements:
-                t_lat = el.get('lat') or el.get('center', {}).get('lat')
-                t_lon = el.get('lon') or el.get('center', {}).get('lon')
-                if not t_lat: continue
-
-                tags = el.get('tags', {})
-                
-                wheelchair = "○" if tags.get('wheelchair') == 'yes' else ""
-                baby_chair = "○" if (tags.get('diaper') == 'yes' or tags.get('changing_table') == 'yes') else ""
-                ostomate = "○" if tags.get('ostomate') == 'yes' else ""
-                
-                t_name = tags.get('name', '駅周辺トイレ')
-                level = tags.get('level', '')
-                floor = f"{level}階" if level else ""
-                
-                base_note = t_name
-                if tags.get('fee') == 'yes': base_note += " (有料)"
-                if tags.get('access') == 'customers': base_note += " (店舗客用)"
-
-                # 特徴リスト作成
-                feat_list = []
-                if wheelchair: feat_list.append("車椅子対応")
-                if baby_chair: feat_list.append("ベビーチェア/シート")
-                if ostomate: feat_list.append("オストメイト")
-                if tags.get('fee') == 'yes': feat_list.append("有料")
-                features_str = ", ".join(feat_list) if feat_list else "特になし"
-                
-                # Geminiで案内文生成
-                gemini_note = ""
-                if USE_GEMINI:
-                    print("  [Gemini] 生成中...", end="", flush=True)
-                    gemini_note = generate_route_guide(l_name, s_name, t_name, floor, features_str)
-                    print("完了")
-                    # 無料枠の制限(15RPM)を考慮して待機。
-                    # ここを短くしすぎると429エラーになります。
-                    time.sleep(4) 
-                
-                final_note = f"{gemini_note} ({base_note})" if gemini_note else base_note
-                
-                row = {
-                    "id": str(uuid.uuid4()),
+        t_id = str(uuid.uuid5(uuid.NAMESPACE_URL, osm_key))
+        toilets[osm_key] = {"id": t_id, "element": el, "lat": t_lat, "lon": t_lon, "nearest": nearby[0][1]}
+        for dist, s_name in nearby:
+            for l_name in lines_by_station.get(s_name, []):
+                links.append({
+                    "toilet_id": t_id,
                     "line_name": l_name,
                     "station_name": s_name,
-                    "toilet_name": t_name,
-                    "lat": t_lat,
-                    "lng": t_lon,
-                    "floor": floor,
-                    "wheelchair": wheelchair,
-                    "baby_chair": baby_chair,
-                    "ostomate": ostomate,
-                    "notes": final_note,
-                    "platform_name": ""
-                }
-                all_toilets.append(row)
-            
-            # 通常待機
-            time.sleep(1) 
+                    "distance_m": round(dist, 1),
+                })
+    return list(toilets.values()), links
 
-    except KeyboardInterrupt:
-        print("\n\nユーザーによる中断。ここまでのデータを保存します...")
-    except Exception as e:
-        print(f"\n\n予期せぬエラー: {e}")
-        print("ここまでのデータを保存します...")
+async def build_rows(toilets, lines_by_station, guides=None):
+    """ トイレ1件につき1行を作る。代表の駅・路線は最寄り駅とする """
+    rows = []
+    guide_requests = []
+    for t in toilets:
+        el = t["element"]
+        s_name = t["nearest"]
+        l_name = lines_by_station.get(s_name, [""])[0]
+
+        tags = el.get('tags', {})
+        
+        wheelchair = "○" if tags.get('wheelchair') == 'yes' else ""
+        baby_chair = "○" if (tags.get('diaper') == 'yes' or tags.get('changing_table') == 'yes') else ""
+        ostomate = "○" if tags.get('ostomate') == 'yes' else ""
+        
+        t_name = tags.get('name', '駅周辺トイレ')
+        level = tags.get('level', '')
+        floor = f"{level}階" if level else ""
+        
+        base_note = t_name
+        if tags.get('fee') == 'yes': base_note += " (有料)"
+        if tags.get('access') == 'customers': base_note += " (店舗客用)"
+
+        # 特徴リスト作成
+        feat_list = []
+        if wheelchair: feat_list.append("車椅子対応")
+        if baby_chair: feat_list.append("ベビーチェア/シート")
+        if ostomate: feat_list.append("オストメイト")
+        if tags.get('fee') == 'yes': feat_list.append("有料")
+        features_str = ", ".join(feat_list) if feat_list else "特になし"
+        
+        guide_requests.append(guide_inputs(l_name, s_name, t_name, floor, features_str))
+        rows.append({
+            "id": t["id"],
+            "line_name": l_name,
+            "station_name": s_name,
+            "toilet_name": t_name,
+            "lat": t["lat"],
+            "lng": t["lon"],
+            "floor": floor,
+            "wheelchair": wheelchair,
+            "baby_chair": baby_chair,
+            "ostomate": ostomate,
+            "notes": base_note,
+            "platform_name": ""
+        })
 
-    # CSV保存 (中断時も実行される)
-    if all_toilets:
-        df = pd.DataFrame(all_toilets)
+    # Geminiで案内文をまとめて生成 (バッチ・キャッシュ・レート制限は GuideGenerator 側)
+    if guides is not None and rows:
+        texts = await guides.generate(guide_requests)
+        for row, text in zip(rows, texts):
+            row["notes"] = f"{text} ({row['notes']})"
+    return rows
+
+async def run(fresh=False, osm_file=None):
+    print("=== トイレデータ収集開始 (広域一括取得版) ===")
+    
+    targets = load_target_stations()
+    station_names = list(dict.fromkeys(t["station_name"] for t in targets if t["station_name"]))
+    print(f"対象: {len(targets)} 件の駅データ (ユニーク駅 {len(station_names)} 件)")
+
+    if fresh and os.path.exists(CHECKPOINT_FILE):
+        os.remove(CHECKPOINT_FILE)
+    located, tiles_done = load_checkpoint(CHECKPOINT_FILE)
+    if located or tiles_done:
+        print(f"チェックポイントから再開: 座標 {len(located)} 駅 / タイル {len(tiles_done)} 件")
+
+    limiter = HostRateLimiter(HOST_RATES)
+    cache = ResponseCache(CACHE_DIR)
+    fetcher = AsyncFetcher(limiter=limiter, cache=cache, max_retries=MAX_RETRIES, base_delay=RETRY_DELAY,
+                           headers={'User-Agent': 'station_toilet_collector_v8_regional'})
+
+    geocoder = StationGeocoder(STATIONS_CSV)
+
+    try:
+        async with fetcher:
+            semaphore = asyncio.Semaphore(CONCURRENCY)
+            try:
+                # 1. 駅の座標
+                pending = [s for s in station_names if not located.get(s, {}).get('lat')]
+                if pending:
+                    print(f"駅座標を取得中: {len(pending)} 駅")
+                    tasks = [asyncio.create_task(locate_station(fetcher, geocoder, s, semaphore)) for s in pending]
+                    await gather_checkpointed(tasks, "座標", located, "station_name")
+
+                station_coords = {s: (r['lat'], r['lon']) for s, r in located.items() if r.get('lat')}
+                missing = [s for s in station_names if s not in station_coords]
+                if missing:
+                    print(f"座標不明 -> Skip: {len(missing)} 駅 ({', '.join(missing[:5])}...)")
+                if not station_coords:
+                    print("\nデータが見つかりませんでした。")
+                    return
+
+                # 2. トイレ要素 (ローカル抽出ファイル or タイル単位の一括取得)
+                if osm_file:
+                    bbox = bounding_box(list(station_coords.values()), margin_m=SEARCH_RADIUS)
+                    elements = load_osm_extract(osm_file, bbox)
+                    print(f"OSM抽出ファイルから {len(elements)} 件のトイレ要素を読み込みました。")
+                else:
+                    tiles = plan_tiles(list(station_coords.values()), SEARCH_RADIUS)
+                    pending_tiles = [(k, b) for k, b in tiles if k not in tiles_done]
+                    print(f"Overpass一括取得: {len(tiles)} タイル (残り {len(pending_tiles)})")
+                    tasks = [asyncio.create_task(collect_tile(fetcher, k, b, semaphore)) for k, b in pending_tiles]
+                    await gather_checkpointed(tasks, "タイル", tiles_done, "tile")
+                    if len(tiles_done) < len(tiles):
+                        print("\n取得に失敗したタイルがあります。もう一度実行すると続きから再開します。")
+                        return
+                    elements = [el for k, _ in tiles for el in tiles_done[k]['elements']]
+
+            except KeyboardInterrupt:
+                print("\n\nユーザーによる中断。取得済みのデータはチェックポイントに保存済みです。")
+                return
+            except asyncio.CancelledError:
+                # 取得済みの分はチェックポイントに書いてあるので、キャンセルは呼び出し元に伝える
+                print("\n\n処理がキャンセルされました。取得済みのデータはチェックポイントに保存済みです。")
+                raise
+
+            # 3. 駅への割り当て (ローカルの空間インデックス)
+            toilets, links = assign_toilets(elements, targets, station_coords, SEARCH_RADIUS)
+            lines_by_station = group_lines_by_station(targets)
+            print(f"割り当て: トイレ {len(toilets)} 件 / 駅リンク {len(links)} 件")
+
+        guides = GuideGenerator() if USE_GEMINI else None
+        try:
+            rows = await build_rows(toilets, lines_by_station, guides)
+        finally:
+            if guides:
+                guides.close()
+                print(guides.summary())
+    finally:
+        geocoder.close()
+        print(geocoder.summary())
+
+    print(f"HTTP: {fetcher.request_count} リクエスト / リトライ {fetcher.retry_count} 回 / "
+          f"キャッシュヒット {cache.hits} 件")
+
+    if rows:
+        df = pd.DataFrame(rows)
         df.to_csv(OUTPUT_CSV, index=False, encoding='utf-8')
-        print(f"\n完了: {OUTPUT_CSV} に {len(df)} 件保存しました。")
+        pd.DataFrame(links).to_csv(LINKS_CSV, index=False, encoding='utf-8')
+        print(f"\n完了: {OUTPUT_CSV} に {len(df)} 件、{LINKS_CSV} に {len(links)} 件保存しました。")
     else:
         print("\nデータが見つかりませんでした。")
 
+def main():
+    parser = argparse.ArgumentParser(description="OSMから駅トイレデータを収集する")
+    parser.add_argument('--fresh', action='store_true', help="チェックポイントを破棄して最初から収集する")
+    parser.add_argument('--osm-file', help="Overpassの代わりに使うローカルのOSMデータ (.osm / Overpass JSON)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(fresh=args.fresh, osm_file=args.osm_file))
+    except KeyboardInterrupt:
+        print("\n中断しました。次回実行時はチェックポイントから再開します。")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,138 @@
+import functools
+import math
+import numpy as np
+
+# ---------------------------------------------------------
+# 座標計算の共通ユーティリティ
+# ---------------------------------------------------------
+
+EARTH_RADIUS_M = 6371000
+METERS_PER_DEG_LAT = 111320
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """ 2点間の距離 (メートル) """
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = math.sin(d_lat / 2) ** 2 + \
+        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    """ haversine_m の配列版 (pandas の列をそのまま渡せる) """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def bounding_box(points, margin_m=0):
+    """ (lat, lon) 列の外接矩形を (south, west, north, east) で返す。margin_m だけ広げる """
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    south, north = min(lats), max(lats)
+    west, east = min(lons), max(lons)
+    d_lat = margin_m / METERS_PER_DEG_LAT
+    d_lon = margin_m / (METERS_PER_DEG_LAT * max(math.cos(math.radians((south + north) / 2)), 0.01))
+    return south - d_lat, west - d_lon, north + d_lat, east + d_lon
+
+
+class GridIndex:
+    """
+    一定半径以内の近傍検索用の格子インデックス。
+    セルの一辺を検索半径に合わせるので、問い合わせは ref_lat 付近なら周囲3x3セルだけを見ればよい。
+    経度方向のセル幅は ref_lat で決めるので、北 (南) に離れた地点では問い合わせごとに
+    その緯度の cos から経度方向に見るセル数を広げる (ref_lat には対象地域の緯度を渡す)。
+    """
+
+    def __init__(self, radius_m, ref_lat=35.68):
+        self.radius_m = radius_m
+        self.cell_lat = radius_m / METERS_PER_DEG_LAT
+        self.cell_lon = radius_m / (METERS_PER_DEG_LAT * max(math.cos(math.radians(ref_lat)), 0.01))
+        self.cells = {}
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_lat)), int(math.floor(lon / self.cell_lon))
+
+    def insert(self, lat, lon, item):
+        self.cells.setdefault(self._cell(lat, lon), []).append((lat, lon, item))
+
+    def within(self, lat, lon, radius_m=None):
+        """ 半径以内の (距離m, item) を近い順に返す """
+        radius_m = self.radius_m if radius_m is None else radius_m
+        reach = max(1, int(math.ceil(radius_m / self.radius_m)))
+        # 経度方向は検索範囲のうち極に近い側の緯度で、半径が何度になるかから決める
+        d_lat = radius_m / METERS_PER_DEG_LAT
+        far_lat = min(abs(lat) + d_lat, 90.0)
+        d_lon = radius_m / (METERS_PER_DEG_LAT * max(math.cos(math.radians(far_lat)), 0.01))
+        reach_lon = max(1, int(math.ceil(d_lon / self.cell_lon)))
+        ci, cj = self._cell(lat, lon)
+        found = []
+        for i in range(ci - reach, ci + reach + 1):
+            for j in range(cj - reach_lon, cj + reach_lon + 1):
+                for p_lat, p_lon, item in self.cells.get((i, j), ()):
+                    d = haversine_m(lat, lon, p_lat, p_lon)
+                    if d <= radius_m:
+                        found.append((d, item))
+        found.sort(key=lambda x: x[0])
+        return found
+
+    def __len__(self):
+        return sum(len(v) for v in self.cells.values())
+
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(lat, lon, precision=7):
+    """ 緯度経度をジオハッシュ文字列にする (precision=7 でおよそ 150m 四方) """
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    i = min(int((lat + 90.0) / 180.0 * (1 << lat_bits)), (1 << lat_bits) - 1)
+    j = min(int((lon + 180.0) / 360.0 * (1 << lon_bits)), (1 << lon_bits) - 1)
+    return _geohash_from_cell(i, j, precision)
+
+
+def _spread_bits(x):
+    # 下位32ビットを1ビットおきに広げる (Morton符号化)
+    x &= 0xFFFFFFFF
+    x = (x | (x << 16)) & 0x0000FFFF0000FFFF
+    x = (x | (x << 8)) & 0x00FF00FF00FF00FF
+    x = (x | (x << 4)) & 0x0F0F0F0F0F0F0F0F
+    x = (x | (x << 2)) & 0x3333333333333333
+    return (x | (x << 1)) & 0x5555555555555555
+
+
+def _geohash_from_cell(i, j, precision):
+    # 経度・緯度のビットを経度から交互に並べ、5ビットずつ base32 にする
+    if precision * 5 % 2:
+        code = _spread_bits(j) | (_spread_bits(i) << 1)
+    else:
+        code = (_spread_bits(j) << 1) | _spread_bits(i)
+    return ''.join(_GEOHASH_BASE32[(code >> (5 * n)) & 31] for n in range(precision - 1, -1, -1))
+
+
+def geohash_cell_size(precision=7):
+    """ ジオハッシュ1セルの (緯度方向, 経度方向) の大きさ (度) """
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def geohash_neighbors(lat, lon, precision=7):
+    """ 地点を含むセルとその周囲8セルのジオハッシュ (境界付近の取りこぼし防止) """
+    d_lat, d_lon = geohash_cell_size(precision)
+    return _geohash_block(int(math.floor((lat + 90.0) / d_lat)), int(math.floor((lon + 180.0) / d_lon)), precision)
+
+
+@functools.lru_cache(maxsize=65536)
+def _geohash_block(i, j, precision):
+    # セル番号 (i, j) の周囲3x3セル (同じセルの問い合わせは使い回す)
+    lat_cells = 1 << ((precision * 5) // 2)
+    lon_cells = 1 << ((precision * 5 + 1) // 2)
+    return frozenset(
+        _geohash_from_cell(min(max(i + di, 0), lat_cells - 1), (j + dj) % lon_cells, precision)
+        for di in (-1, 0, 1) for dj in (-1, 0, 1)
+    )
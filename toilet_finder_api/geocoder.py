@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import time
+import pandas as pd
+
+# ---------------------------------------------------------
+# 駅座標の解決サービス
+# ---------------------------------------------------------
+# 1. data/stations.csv に既にある lat/lng
+# 2. ローカルの永続キャッシュ (SQLite)
+# 3. Nominatim へのリモート問い合わせ (結果はキャッシュに保存)
+# の順に探す。どこで解決したかは stats に集計され、summary() で表示できる。
+
+STATIONS_CSV = 'data/stations.csv'
+CACHE_PATH = '.cache/geocode.sqlite'
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+USER_AGENT = 'station_toilet_geocoder_v1'
+
+# Nominatim に投げる検索文字列 (キャッシュのキーにも含める)
+REMOTE_QUERY_FORMAT = "{name}駅 東京都"
+
+
+def load_known_coords(path=STATIONS_CSV):
+    """ stations.csv から 駅名 -> (lat, lng) を作る。0や空欄は除外 """
+    if not os.path.exists(path):
+        return {}
+    try:
+        df = pd.read_csv(path, dtype=str, encoding='utf-8-sig').fillna('')
+    except Exception:
+        return {}
+    df.columns = df.columns.str.strip()
+    lng_col = 'lng' if 'lng' in df.columns else 'lon'
+    if 'station_name' not in df.columns or 'lat' not in df.columns or lng_col not in df.columns:
+        return {}
+
+    known = {}
+    lats = pd.to_numeric(df['lat'], errors='coerce')
+    lngs = pd.to_numeric(df[lng_col], errors='coerce')
+    for name, lat, lng in zip(df['station_name'], lats, lngs):
+        name = str(name).strip()
+        if not name or name in known:
+            continue
+        if pd.notnull(lat) and pd.notnull(lng) and lat != 0 and lng != 0:
+            known[name] = (float(lat), float(lng))
+    return known
+
+
+class StationGeocoder:
+    def __init__(self, stations_csv=STATIONS_CSV, cache_path=CACHE_PATH, nominatim_url=NOMINATIM_URL):
+        self.known = load_known_coords(stations_csv)
+        self.nominatim_url = nominatim_url
+        self.stats = {"known": 0, "cache": 0, "remote": 0, "miss": 0}
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(cache_path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS geocode_cache ("
+            "query TEXT PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def remote_query(name):
+        return REMOTE_QUERY_FORMAT.format(name=name)
+
+    def lookup_local(self, name):
+        """ 既知座標 → キャッシュの順に探す。見つかれば (lat, lon, source)、なければ None """
+        if name in self.known:
+            lat, lon = self.known[name]
+            return lat, lon, "known"
+        row = self.db.execute(
+            "SELECT lat, lon FROM geocode_cache WHERE query = ?", (self.remote_query(name),)
+        ).fetchone()
+        if row:
+            return row[0], row[1], "cache"
+        return None
+
+    def _remember(self, name, data):
+        if data and len(data) > 0:
+            lat, lon = float(data[0]['lat']), float(data[0]['lon'])
+            self.db.execute(
+                "INSERT OR REPLACE INTO geocode_cache (query, lat, lon, fetched_at) VALUES (?, ?, ?, ?)",
+                (self.remote_query(name), lat, lon, time.time()),
+            )
+            self.db.commit()
+            self.stats["remote"] += 1
+            return lat, lon
+        self.stats["miss"] += 1
+        return None, None
+
+    def _params(self, name):
+        return {'q': self.remote_query(name), 'format': 'json', 'limit': 1}
+
+    def lookup(self, name, timeout=20):
+        """ 同期版 (requests)。check_station_toilets.py などから使う """
+        local = self.lookup_local(name)
+        if local:
+            self.stats[local[2]] += 1
+            return local[0], local[1]
+
+        import requests
+        try:
+            response = requests.get(self.nominatim_url, params=self._params(name),
+                                    headers={'User-Agent': USER_AGENT}, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            print(f"  [Geocode Error] {name}: {e}")
+            self.stats["miss"] += 1
+            return None, None
+        return self._remember(name, data)
+
+    async def lookup_async(self, name, fetcher):
+        """ 非同期版 (async_fetch.AsyncFetcher 経由。レート制限・リトライは fetcher 側) """
+        local = self.lookup_local(name)
+        if local:
+            self.stats[local[2]] += 1
+            return local[0], local[1]
+
+        from async_fetch import FetchError
+        try:
+            data = await fetcher.get_json(self.nominatim_url, params=self._params(name))
+        except FetchError as e:
+            print(f"  [Geocode Error] {name}: {e}")
+            self.stats["miss"] += 1
+            return None, None
+        return self._remember(name, data)
+
+    def summary(self):
+        s = self.stats
+        return (f"座標の解決: 既知 {s['known']} / キャッシュ {s['cache']} / "
+                f"リモート {s['remote']} / 不明 {s['miss']}")
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from db import resolve_client
+from refdata import RefDataClient, REFERENCE_TABLES, fetch_all
+
+# ---------------------------------------------------------
+# 参照データのバージョンと HTTP キャッシュ (ETag / Cache-Control / 304)
+# ---------------------------------------------------------
+# /lines と /stations の中身は参照データ (generate_sql.py -> run_sqls.py で入れたもの) とクエリ文字列だけで決まるので、
+# 「データセットの version + パス + クエリ」から強い ETag を作り、If-None-Match が一致すれば DB を見ずに 304 を返す。
+#
+# version の決め方 (上から順に):
+#   1. DATASET_VERSION   デプロイ時に run_sqls.py の後で設定する値
+#   2. REFDATA_DIR       使用中の共有スナップショットの version (refdata.py。差し替えに追従する)
+#   3. それ以外           参照テーブルの中身のハッシュ (DATASET_VERSION_TTL 秒ごとに計算し直す)
+#      -> データを入れ替えてから最大 DATASET_VERSION_TTL 秒は古い version のまま
+
+DATASET_VERSION = os.environ.get("DATASET_VERSION", "").strip()
+DATASET_VERSION_TTL = float(os.environ.get("DATASET_VERSION_TTL", "300") or 300)
+REFERENCE_MAX_AGE = int(os.environ.get("REFERENCE_MAX_AGE", "60") or 60)
+REFERENCE_STALE_WHILE_REVALIDATE = int(os.environ.get("REFERENCE_STALE_WHILE_REVALIDATE", "600") or 600)
+
+CACHE_CONTROL = f"public, max-age={REFERENCE_MAX_AGE}, stale-while-revalidate={REFERENCE_STALE_WHILE_REVALIDATE}"
+NO_STORE = "no-store"
+
+
+def content_version(client):
+    """ 参照テーブルの中身から version を作る (行の並びに依存しないように並べ替えてからハッシュ) """
+    digest = hashlib.sha256()
+    for name in REFERENCE_TABLES:
+        rows = sorted(json.dumps(row, sort_keys=True, ensure_ascii=False, default=str) for row in fetch_all(client, name))
+        digest.update(name.encode('utf-8'))
+        for row in rows:
+            digest.update(row.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class DatasetVersion:
+    def __init__(self, client, ttl=DATASET_VERSION_TTL):
+        self.client = client
+        self.ttl = ttl
+        self._version = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if DATASET_VERSION:
+            return DATASET_VERSION
+        client = resolve_client(self.client)
+        if isinstance(client, RefDataClient):
+            snapshot = client.current()
+            if snapshot is not None:
+                return snapshot.version
+        if self._version is None or time.monotonic() >= self._expires:
+            with self._lock:
+                if self._version is None or time.monotonic() >= self._expires:
+                    try:
+                        self._version = content_version(client)
+                    except Exception:
+                        # 障害中は前の version のまま (最初の1回が取れなければ呼び出し元に任せる)
+                        if self._version is None:
+                            raise
+                    self._expires = time.monotonic() + self.ttl
+        return self._version
+
+    def source(self):
+        if DATASET_VERSION:
+            return "env"
+        client = resolve_client(self.client)
+        if isinstance(client, RefDataClient) and client.snapshot is not None:
+            return "refdata"
+        return "content"
+
+
+def etag_for(version, path, query_params):
+    """ 強い ETag。同じ version・パス・クエリなら同じ JSON を返すことが前提 """
+    query = "&".join(f"{k}={v}" for k, v in sorted(query_params.multi_items()))
+    return '"' + hashlib.sha256(f"{version}|{path}|{query}".encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def not_modified(if_none_match, etag):
+    """ If-None-Match (カンマ区切り・W/ 付き・*) に etag が含まれるか。304 の判定は弱い比較でよい """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
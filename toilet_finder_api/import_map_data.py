@@ -1,17 +1,14 @@
 import pandas as pd
 import os
 import hashlib
+from toilet_dedupe import DuplicateIndex, MergeDecision
+from line_rules import display_line_name
 
 # 設定
 INPUT_MAP_CSV = 'station_toilet_raw.csv'  
 MASTER_TOILET_CSV = 'station_toilet.csv'   
 TARGET_STRATEGIES_CSV = 'data/strategies.csv'
-
-def clean_line_name(name):
-    name = str(name)
-    for removal in ['JR', '東京メトロ', '都営地下鉄']:
-        name = name.replace(removal, '')
-    return name
+MERGE_DECISIONS_CSV = 'import_merge_decisions.csv'  # 重複判定の結果 (merge / review / new)
 
 def generate_toilet_id(station_name, description):
     seed = f"{station_name}_{description}"
@@ -29,18 +26,23 @@ def main():
     new_master_rows = []
     new_strategy_rows = []
 
-    # 既存の「駅名 + 説明」のセットをリスト化（IDが変わっていても名称でブロックするため）
-    existing_combinations = set(zip(df_master['station_name'], df_master['description']))
+    # 既存トイレを重複検出用のインデックスに登録する
+    # (ID・駅名+名称の完全一致に加え、ジオハッシュのセル/駅ごとに近い名称・座標のトイレも拾う)
+    index = DuplicateIndex()
+    blank = pd.Series('', index=df_master.index)
+    for args in zip(df_master['toilet_id'], df_master['station_name'], df_master.get('description', blank),
+                    df_master.get('lat', blank), df_master.get('lon', blank)):
+        index.add(*args)
+    decisions = []
 
     for _, row in df_raw.iterrows():
         station = row['station_name']
         desc = row.get('name', f"{station}付近のトイレ")
         t_id = row['id'] if 'id' in row and row['id'] else generate_toilet_id(station, desc)
 
-        # 【強化された重複判定】
-        # 1. IDが既に存在するか？
-        # 2. あるいは、同じ駅に同じ説明のトイレが既に存在するか？
-        is_duplicate = (t_id in df_master['toilet_id'].values) or ((station, desc) in existing_combinations)
+        decision = index.match(t_id, station, desc, row.get('lat'), row.get('lon'))
+        decisions.append(decision)
+        is_duplicate = decision.action == 'merge'
 
         if not is_duplicate:
             # マスタへの追加処理（省略せず以前のロジックを維持）
@@ -48,6 +50,8 @@ def main():
             if row.get('wheelchair') == '○': features.append("wheelchair")
             # ... (中略: features作成ロジック) ...
             
+            # 取り込みデータ内の重複も検出できるよう、追加分もインデックスに入れる
+            index.add(t_id, station, desc, row.get('lat'), row.get('lon'))
             new_master_rows.append({
                 'toilet_id': t_id,
                 'station_name': station,
@@ -60,7 +64,7 @@ def main():
 
             # 攻略データへの追加
             new_strategy_rows.append({
-                'line_name': clean_line_name(row.get('line_name', '不明')),
+                'line_name': display_line_name(row.get('line_name', '不明')),
                 'station_name': station,
                 'direction': 1,
                 'car_pos': 0.0,
@@ -71,6 +75,12 @@ def main():
                 'route_memo': '新規インポート'
             })
 
+    # 重複判定の結果を保存 (review は取り込み済みだが目視確認が必要)
+    pd.DataFrame(decisions, columns=MergeDecision._fields).to_csv(MERGE_DECISIONS_CSV, index=False)
+    actions = pd.Series([d.action for d in decisions], dtype=object).value_counts()
+    print(f"重複判定: 統合 {actions.get('merge', 0)}件 / 要確認 {actions.get('review', 0)}件 / 新規 {actions.get('new', 0)}件 "
+          f"(比較 {index.comparisons}回) -> {MERGE_DECISIONS_CSV}")
+
     # (以下、ファイル保存処理 ... 前回同様)
     if new_master_rows:
         pd.concat([df_master, pd.DataFrame(new_master_rows)], ignore_index=True).to_csv(MASTER_TOILET_CSV, index=False)
@@ -0,0 +1,206 @@
+import argparse
+import csv
+import functools
+import os
+import re
+import unicodedata
+
+# ---------------------------------------------------------
+# 路線名の正規化とホーム規則の共通モジュール
+# ---------------------------------------------------------
+# generate_sql.py / fix_strategies.py / import_map_data.py がそれぞれ持っていた
+# 路線名の整形とホーム規則をここに集約する。
+# - display_line_name: CSV (data/stations.csv) と同じ表記 (JR山手線 -> 山手線, 都営浅草線 -> 浅草線)
+# - line_match_key:    規則照合用のキー (事業者名・末尾の「線」「ライン」も落とす)
+# - platform_for:      路線名 + 方向 -> ホーム名。規則は起動時に1回だけコンパイルし、結果は路線名ごとに覚える
+#
+#   python line_rules.py   # 規則とデータの食い違いを表示する
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 表記から落とす事業者名 (CSV上の路線名は JR / 東京メトロ / 都営 を付けない)
+DISPLAY_PREFIXES = ("東京メトロ", "都営地下鉄", "都営", "JR")
+# 照合キーではさらに私鉄の事業者名も落とす
+MATCH_PREFIXES = DISPLAY_PREFIXES + ("東急", "小田急", "京王", "西武", "東武", "京急", "京成")
+
+DEFAULT_PLATFORM = "ホーム"
+
+# ---------------------------------------------------------
+# 路線ごとのホーム規則定義
+# ---------------------------------------------------------
+# key: 路線名 (事業者名の有無は問わない)
+# value: { 方向(1/-1): "ホーム名" }
+# ※一般的な相対式ホーム・島式ホームの規則を定義しています。
+# ※ターミナル駅などのイレギュラーは後で手動修正が必要です。
+PLATFORM_RULES = {
+    # --- 東京メトロ ---
+    "銀座線": {1: "1番線", -1: "2番線"},  # 1:渋谷, -1:浅草
+    "丸ノ内線": {1: "1番線", -1: "2番線"},  # 1:荻窪, -1:池袋
+    "日比谷線": {1: "1番線", -1: "2番線"},  # 1:中目黒, -1:北千住
+    "東西線": {1: "1番線", -1: "2番線"},  # 1:西船橋, -1:中野
+    "千代田線": {1: "1番線", -1: "2番線"},  # 1:代々木上原, -1:綾瀬
+    "有楽町線": {1: "1番線", -1: "2番線"},  # 1:新木場, -1:和光市
+    "半蔵門線": {1: "1番線", -1: "2番線"},  # 1:渋谷/中央林間, -1:押上
+    "南北線": {1: "1番線", -1: "2番線"},  # 1:赤羽岩淵, -1:目黒
+    "副都心線": {1: "1番線", -1: "2番線"},  # 1:渋谷, -1:和光市
+
+    # --- 都営地下鉄 ---
+    "都営浅草線": {1: "1番線", -1: "2番線"},  # 1:西馬込, -1:押上
+    "都営三田線": {1: "1番線", -1: "2番線"},  # 1:目黒, -1:西高島平
+    "都営新宿線": {1: "1番線", -1: "2番線"},  # 1:新宿, -1:本八幡
+    "都営大江戸線": {1: "1番線", -1: "2番線"},  # 1:六本木/大門, -1:都庁前/光が丘
+
+    # --- JR線 (代表的なホーム) ---
+    # 山手線などの環状線や複々線は駅によりバラバラですが、
+    # 一旦「内回り/外回り」「下り/上り」の慣例で埋めます。
+    "JR山手線": {1: "内回りホーム", -1: "外回りホーム"},
+    "JR京浜東北線": {1: "1番線", -1: "2番線"},  # 南行/北行
+    "JR中央線": {1: "1番線", -1: "2番線"},  # 下り/上り
+    "JR総武線": {1: "1番線", -1: "2番線"},  # 下り/上り
+
+    # --- 私鉄 ---
+    "小田急小田原線": {1: "1番線", -1: "2番線"},  # 1:小田原, -1:新宿
+    "東急東横線": {1: "1番線", -1: "2番線"},  # 1:横浜, -1:渋谷
+    # 必要に応じて追加
+}
+
+
+def _clean(name):
+    return unicodedata.normalize('NFKC', str(name or '')).strip()
+
+
+@functools.lru_cache(maxsize=4096)
+def display_line_name(name):
+    """ JR山手線 / 東京メトロ銀座線 / 都営浅草線 -> 山手線 / 銀座線 / 浅草線 """
+    text = _clean(name)
+    for prefix in DISPLAY_PREFIXES:
+        if text.startswith(prefix):
+            return text[len(prefix):].strip()
+    return text
+
+
+@functools.lru_cache(maxsize=4096)
+def line_match_key(name):
+    """ 規則照合用のキー: 事業者名と末尾の「線」「ライン」を落とす (東急東横線 -> 東横) """
+    text = _clean(name)
+    for prefix in MATCH_PREFIXES:
+        text = text.replace(prefix, "")
+    if text.endswith("線"):
+        text = text[:-1]
+    elif text.endswith("ライン"):
+        text = text[:-len("ライン")]
+    return text.strip()
+
+
+class RuleConflict(ValueError):
+    pass
+
+
+class PlatformMatcher:
+    """
+    規則を照合キーで引けるようにコンパイルしたもの。
+    - 完全一致は dict で O(1)
+    - 「JR中央線快速」のように規則名を含む路線名は、長い規則名優先の正規表現1回で探す
+    - 結果は路線名ごとにメモしておくので、同じ路線の2行目以降は dict 1回で済む
+    """
+
+    def __init__(self, rules=PLATFORM_RULES):
+        self.rules = {}
+        self.sources = {}
+        self.conflicts = []
+        for name, rule in rules.items():
+            key = line_match_key(name)
+            if not key:
+                continue
+            if key in self.rules and self.rules[key] != rule:
+                # 表記違いの同じ路線に異なる規則が書かれている
+                self.conflicts.append((self.sources[key], name, self.rules[key], rule))
+                continue
+            self.rules[key] = rule
+            self.sources.setdefault(key, name)
+        keys = sorted(self.rules, key=len, reverse=True)
+        self._pattern = re.compile("|".join(re.escape(k) for k in keys)) if keys else None
+        self._memo = {}
+
+    def rule_key(self, line_name):
+        """ 路線名に対応する規則の照合キー (なければ None) """
+        if line_name in self._memo:
+            return self._memo[line_name]
+        target = line_match_key(line_name)
+        found = None
+        if target in self.rules:
+            found = target
+        elif target and self._pattern is not None:
+            m = self._pattern.search(target)
+            if m:
+                found = m.group(0)
+            else:
+                # 逆方向 (路線名の方が短い: 「中央」 -> 「中央線」の規則)
+                found = next((k for k in self.rules if target in k), None)
+        self._memo[line_name] = found
+        return found
+
+    def platform_for(self, line_name, direction, default=DEFAULT_PLATFORM):
+        key = self.rule_key(line_name)
+        if key is None:
+            return default
+        try:
+            direction = int(float(direction))
+        except (TypeError, ValueError):
+            return default
+        return self.rules[key].get(direction, default)
+
+    def report(self, line_names):
+        """ 規則とデータの食い違い: (規則のない路線, どの路線にも使われない規則, 規則同士の衝突) """
+        used = set()
+        unmatched = []
+        for name in sorted({n for n in line_names if str(n).strip()}):
+            key = self.rule_key(name)
+            if key is None:
+                unmatched.append(name)
+            else:
+                used.add(key)
+        unused = sorted(self.sources[k] for k in self.rules if k not in used)
+        return {"unmatched_lines": unmatched, "unused_rules": unused, "conflicts": self.conflicts}
+
+
+DEFAULT_MATCHER = PlatformMatcher()
+
+
+def platform_for(line_name, direction, default=DEFAULT_PLATFORM):
+    return DEFAULT_MATCHER.platform_for(line_name, direction, default)
+
+
+def _line_names_from_csv(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        return [row.get('line_name', '') for row in csv.DictReader(f)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ホーム規則とデータの路線名の食い違いを表示する")
+    parser.add_argument('csv', nargs='*', default=[os.path.join(BASE_DIR, 'data', 'stations.csv'),
+                                                   os.path.join(BASE_DIR, 'data', 'strategies.csv'),
+                                                   os.path.join(BASE_DIR, 'station_doors.csv')])
+    args = parser.parse_args()
+
+    names = []
+    for path in args.csv:
+        names.extend(_line_names_from_csv(path))
+    report = DEFAULT_MATCHER.report(names)
+
+    print(f"規則 {len(DEFAULT_MATCHER.rules)} 件 / データ上の路線 {len(set(names))} 件")
+    print(f"\n[規則のない路線] {len(report['unmatched_lines'])} 件 (ホーム名は「{DEFAULT_PLATFORM}」になります)")
+    for name in report['unmatched_lines']:
+        print(f"  - {name}")
+    print(f"\n[どの路線にも使われない規則] {len(report['unused_rules'])} 件")
+    for name in report['unused_rules']:
+        print(f"  - {name}")
+    print(f"\n[規則の衝突] {len(report['conflicts'])} 件")
+    for first, second, rule_a, rule_b in report['conflicts']:
+        print(f"  - {first} {rule_a} / {second} {rule_b}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,571 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from line_rules import platform_for
+import dataset
+
+# ---------------------------------------------------------
+# Supabase を使わないローカルのデータバックエンド
+# ---------------------------------------------------------
+# data/stations.csv・data/strategies.csv・station_toilet.csv から
+# 01_schema.sql と同じ形のテーブルを SQLite のスナップショットに作り、
+# supabase-py と同じ書き方 (table().select().eq().order().limit().single().execute()) で引けるようにする。
+# api.py / routers/commuter.py はコードを変えずにこちらで動く (切り替えは db.py)。
+#
+# - 行の組み立ては generate_sql.py と同じ規則 (ON CONFLICT の上書き順も同じ)
+# - ID は名前から決まる UUID (uuid5) にするので、作り直しても同じIDになる
+# - 元CSVが更新されていれば、次に開いたときに作り直す (congestion_reports は引き継ぐ)
+#
+#   python local_backend.py            # スナップショットを作って件数を表示
+#   python local_backend.py --force    # 更新がなくても作り直す
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_DB_PATH = os.environ.get("LOCAL_DB_PATH", os.path.join(BASE_DIR, '.cache', 'local.sqlite'))
+
+# スナップショットの元になるCSV (dataset.py のテーブル名)
+SNAPSHOT_SOURCES = ('stations', 'strategies', 'toilets')
+# あれば混雑報告の履歴も読み込む (bench/synth_dataset.py が作る)
+HISTORY_CSV = 'congestion_reports.csv'
+SNAPSHOT_VERSION = 1
+
+ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'toilet-finder/local')
+
+# 01_schema.sql の SQLite 版 (uuid -> TEXT, boolean -> INTEGER, timestamp -> ISO8601 TEXT)
+SCHEMA = [
+    "CREATE TABLE lines (id TEXT PRIMARY KEY, name TEXT NOT NULL UNIQUE, color TEXT, max_cars INTEGER DEFAULT 10)",
+    "CREATE TABLE stations (id TEXT PRIMARY KEY, name TEXT NOT NULL UNIQUE, lat REAL, lng REAL)",
+    """CREATE TABLE line_stations (
+        line_id TEXT REFERENCES lines(id), station_id TEXT REFERENCES stations(id),
+        station_order INTEGER, dir_1_label TEXT, dir_m1_label TEXT,
+        dir_1_next_station_id TEXT REFERENCES stations(id), dir_1_next_next_station_id TEXT REFERENCES stations(id),
+        dir_m1_next_station_id TEXT REFERENCES stations(id), dir_m1_next_next_station_id TEXT REFERENCES stations(id),
+        PRIMARY KEY (line_id, station_id))""",
+    """CREATE TABLE toilets (
+        id TEXT NOT NULL PRIMARY KEY, station_name TEXT, line_name TEXT, name TEXT, lat REAL, lng REAL, floor TEXT,
+        wheelchair INTEGER DEFAULT 0, baby_chair INTEGER DEFAULT 0, ostomate INTEGER DEFAULT 0,
+        description TEXT, platform_name TEXT)""",
+    """CREATE TABLE toilet_strategies (
+        id TEXT PRIMARY KEY, line_name TEXT, station_id TEXT REFERENCES stations(id), direction INTEGER,
+        platform_name TEXT, car_pos REAL, facility_type TEXT, available_time TEXT, crowd_level INTEGER,
+        target_toilet_id TEXT REFERENCES toilets(id), route_memo TEXT)""",
+    """CREATE TABLE congestion_reports (
+        id TEXT PRIMARY KEY, toilet_id TEXT REFERENCES toilets(id), congestion_level INTEGER NOT NULL, user_id TEXT,
+        reported_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now') || '+00:00'))""",
+    "CREATE TABLE snapshot_meta (key TEXT PRIMARY KEY, value TEXT)",
+    # migrations/0001_hot_path_indexes.sql と同じ検索条件のインデックス
+    "CREATE INDEX idx_toilet_strategies_station_direction ON toilet_strategies (station_id, direction)",
+    "CREATE INDEX idx_congestion_reports_toilet_reported ON congestion_reports (toilet_id, reported_at DESC, congestion_level)",
+    "CREATE INDEX idx_line_stations_station ON line_stations (station_id, line_id)",
+    "CREATE INDEX idx_line_stations_line_order ON line_stations (line_id, station_order, station_id)",
+    "CREATE INDEX idx_toilets_lat_lng ON toilets (lat, lng)",
+]
+
+# 外部キー (PostgREST の埋め込み select で使う。制約名は Postgres の既定の命名 <table>_<column>_fkey)
+FOREIGN_KEYS = [
+    ('line_stations', 'line_id', 'lines'),
+    ('line_stations', 'station_id', 'stations'),
+    ('line_stations', 'dir_1_next_station_id', 'stations'),
+    ('line_stations', 'dir_1_next_next_station_id', 'stations'),
+    ('line_stations', 'dir_m1_next_station_id', 'stations'),
+    ('line_stations', 'dir_m1_next_next_station_id', 'stations'),
+    ('toilet_strategies', 'station_id', 'stations'),
+    ('toilet_strategies', 'target_toilet_id', 'toilets'),
+    ('congestion_reports', 'toilet_id', 'toilets'),
+]
+
+BOOL_COLUMNS = {'toilets': {'wheelchair', 'baby_chair', 'ostomate'}}
+# id を省略して insert したときに uuid を振るテーブル (gen_random_uuid() の代わり)
+UUID_ID_TABLES = {'lines', 'stations', 'toilet_strategies', 'congestion_reports'}
+
+
+class LocalBackendError(Exception):
+    """ postgrest の APIError と同じく code / message を持つ """
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+def stable_id(kind, *parts):
+    return str(uuid.uuid5(ID_NAMESPACE, ":".join([kind, *map(str, parts)])))
+
+
+# ---------------------------------------------------------
+# スナップショットの構築
+# ---------------------------------------------------------
+
+def _float_or_none(value):
+    try:
+        return float(value) if str(value).strip() not in ('', 'nan') else None
+    except ValueError:
+        return None
+
+
+def _int_or(value, default):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def _source_stats(base_dir):
+    stats = {}
+    for name in SNAPSHOT_SOURCES:
+        path = os.path.join(base_dir, dataset.SOURCES[name]['path'])
+        if os.path.exists(path):
+            st = os.stat(path)
+            stats[name] = [st.st_size, st.st_mtime_ns]
+    history = os.path.join(base_dir, HISTORY_CSV)
+    if os.path.exists(history):
+        st = os.stat(history)
+        stats['congestion_reports'] = [st.st_size, st.st_mtime_ns]
+    return stats
+
+
+def _records(df):
+    """ DataFrame を dict のリストにする (iterrows / to_dict より速い。列は文字列のまま) """
+    columns = list(df.columns)
+    return [dict(zip(columns, values)) for values in zip(*(df[c].tolist() for c in columns))]
+
+
+def _load_rows(conn, base_dir):
+    """ generate_sql.py と同じ規則で CSV から行を作って投入する """
+    def load(name):
+        return _records(dataset.load_csv_safe(os.path.join(base_dir, dataset.SOURCES[name]['path'])))
+
+    st_rows, tm_rows, str_rows = load('stations'), load('toilets'), load('strategies')
+    if not st_rows or 'line_name' not in st_rows[0] or 'station_name' not in st_rows[0]:
+        raise LocalBackendError("data/stations.csv が読み込めないか、空です")
+
+    by_line = {}
+    for row in st_rows:
+        if row['line_name']:
+            by_line.setdefault(row['line_name'], []).append(row)
+
+    # lines: 最初に出てきた行の色・号車数
+    line_map = {}
+    for line, group in by_line.items():
+        line_map[line] = stable_id('line', line)
+        max_cars = str(group[0].get('max_cars', ''))
+        conn.execute("INSERT INTO lines (id, name, color, max_cars) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT (name) DO UPDATE SET color = excluded.color, max_cars = excluded.max_cars",
+                     (line_map[line], line, group[0].get('line_color') or '#808080',
+                      int(max_cars) if max_cars.isdigit() else 10))
+
+    # stations: 同じ駅名は後の行の座標で上書き
+    station_map = {}
+    for row in st_rows:
+        name = row['station_name']
+        if not name:
+            continue
+        station_map.setdefault(name, stable_id('station', name))
+        conn.execute("INSERT INTO stations (id, name, lat, lng) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT (name) DO UPDATE SET lat = excluded.lat, lng = excluded.lng",
+                     (station_map[name], name, _float_or_none(row.get('lat', '')),
+                      _float_or_none(row.get('lng', row.get('lon', '')))))
+
+    # line_stations: 駅順の前後2駅を引いておく
+    for line, group in by_line.items():
+        group = sorted(group, key=lambda r: _int_or(r.get('station_order'), 0))
+        order_to_id = {_int_or(r.get('station_order'), 0): station_map[r['station_name']]
+                       for r in group if r['station_name'] in station_map}
+        default_dir_1 = f"{group[-1]['station_name']} 方面"
+        default_dir_m1 = f"{group[0]['station_name']} 方面"
+        for row in group:
+            s_id = station_map.get(row['station_name'])
+            if not s_id:
+                continue
+            order = _int_or(row.get('station_order'), 0)
+            conn.execute(
+                "INSERT INTO line_stations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (line_id, station_id) DO UPDATE SET dir_1_label = excluded.dir_1_label, "
+                "dir_m1_label = excluded.dir_m1_label, dir_1_next_station_id = excluded.dir_1_next_station_id, "
+                "dir_1_next_next_station_id = excluded.dir_1_next_next_station_id, "
+                "dir_m1_next_station_id = excluded.dir_m1_next_station_id, "
+                "dir_m1_next_next_station_id = excluded.dir_m1_next_next_station_id",
+                (line_map[line], s_id, order, row.get('dir_1_label') or default_dir_1,
+                 row.get('dir_m1_label') or default_dir_m1, order_to_id.get(order + 1), order_to_id.get(order + 2),
+                 order_to_id.get(order - 1), order_to_id.get(order - 2)))
+
+    # toilets: station_toilet.csv が正
+    registered = set()
+    if tm_rows and 'id' in tm_rows[0]:
+        for row in tm_rows:
+            t_id = row['id']
+            if not t_id:
+                continue
+            conn.execute(
+                "INSERT INTO toilets (id, station_name, line_name, name, lat, lng, floor, wheelchair, baby_chair, "
+                "ostomate, description, platform_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET station_name = excluded.station_name, description = excluded.description, "
+                "wheelchair = excluded.wheelchair, baby_chair = excluded.baby_chair, ostomate = excluded.ostomate",
+                (t_id, row.get('station_name', ''), row.get('line_name', ''), row.get('toilet_name', ''),
+                 _float_or_none(row.get('lat', '')), _float_or_none(row.get('lng', '')), row.get('floor', ''),
+                 *(int(str(row.get(c, 'FALSE')).upper() == 'TRUE') for c in ('wheelchair', 'baby_chair', 'ostomate')),
+                 row.get('notes', ''), row.get('platform_name', '')))
+            registered.add(t_id)
+
+    # toilet_strategies: マスタにないトイレIDは仮登録 (generate_sql.py と同じ)
+    if str_rows and 'line_name' in str_rows[0]:
+        for i, row in enumerate(str_rows):
+            s_id = station_map.get(row.get('station_name', ''))
+            t_id = row.get('target_toilet_id', '')
+            memo = str(row.get('route_memo', row.get('note', '')))
+            if t_id and t_id != 'nan' and t_id not in registered:
+                conn.execute("INSERT INTO toilets (id, station_name, line_name, name, description) "
+                             "VALUES (?, ?, ?, '登録済みトイレ', ?) ON CONFLICT (id) DO NOTHING",
+                             (t_id, row.get('station_name', ''), row['line_name'], memo))
+                registered.add(t_id)
+            if not s_id:
+                continue
+            direction = _int_or(row.get('direction', '1'), 1)
+            platform = row.get('platform_name', '')
+            if not platform or platform == 'nan':
+                platform = platform_for(row['line_name'], direction)
+            conn.execute(
+                "INSERT INTO toilet_strategies VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (stable_id('strategy', i, row['line_name'], row.get('station_name', '')), row['line_name'], s_id,
+                 direction, platform, _float_or_none(row.get('car_pos', '0.0')), row.get('facility', '調査中'),
+                 row.get('available_time', 'ALL'), _int_or(row.get('crowd', '3'), 3),
+                 t_id if t_id and t_id != 'nan' else None, memo))
+
+    history = os.path.join(base_dir, HISTORY_CSV)
+    if os.path.exists(history):
+        conn.executemany(
+            "INSERT OR IGNORE INTO congestion_reports (id, toilet_id, congestion_level, user_id, reported_at) "
+            "SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM toilets WHERE id = ?)",
+            ((r['id'] or stable_id('report', i), r['toilet_id'], _int_or(r['congestion_level'], 2),
+              r.get('user_id') or None, r['reported_at'], r['toilet_id'])
+             for i, r in enumerate(_records(dataset.read_csv_any(history)))))
+
+
+def build_snapshot(path=LOCAL_DB_PATH, base_dir=BASE_DIR):
+    """ CSV から SQLite スナップショットを作り直す (一時ファイルに書いてから置き換える) """
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        for ddl in SCHEMA:
+            conn.execute(ddl)
+        with conn:
+            _load_rows(conn, base_dir)
+            # ローカルで投稿された混雑報告は作り直しても残す
+            if os.path.exists(path):
+                conn.execute("ATTACH DATABASE ? AS old", (path,))
+                try:
+                    conn.execute("INSERT INTO congestion_reports SELECT * FROM old.congestion_reports "
+                                 "WHERE toilet_id IN (SELECT id FROM toilets)")
+                except sqlite3.DatabaseError:
+                    pass
+            meta = {"version": SNAPSHOT_VERSION, "sources": _source_stats(base_dir),
+                    "built_at": time.strftime('%Y-%m-%dT%H:%M:%S')}
+            conn.executemany("INSERT INTO snapshot_meta VALUES (?, ?)",
+                             [(k, json.dumps(v, ensure_ascii=False)) for k, v in meta.items()])
+        if os.path.exists(path):
+            conn.execute("DETACH DATABASE old")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def snapshot_meta(path=LOCAL_DB_PATH):
+    if not os.path.exists(path):
+        return {}
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return {k: json.loads(v) for k, v in conn.execute("SELECT key, value FROM snapshot_meta")}
+    except sqlite3.DatabaseError:
+        return {}
+    finally:
+        conn.close()
+
+
+def is_stale(path=LOCAL_DB_PATH, base_dir=BASE_DIR):
+    meta = snapshot_meta(path)
+    return meta.get("version") != SNAPSHOT_VERSION or meta.get("sources") != _source_stats(base_dir)
+
+
+# ---------------------------------------------------------
+# supabase-py 互換のクエリビルダ
+# ---------------------------------------------------------
+
+_EMBED = re.compile(r'^(?:(\w+):)?(\w+)(?:!(\w+))?\((.*)\)$', re.S)
+
+
+def _split_top_level(text):
+    """ 'a, b(c, d), e' -> ['a', 'b(c, d)', 'e'] """
+    items, depth, start = [], 0, 0
+    for i, ch in enumerate(text):
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            items.append(text[start:i].strip())
+            start = i + 1
+    items.append(text[start:].strip())
+    return [item for item in items if item]
+
+
+class LocalResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class LocalQuery:
+    """ supabase-py のテーブルクエリと同じメソッド名で、1回の execute() を SQL にする """
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self._select = "*"
+        self._filters = []
+        self._order = []
+        self._limit = None
+        self._single = False
+        self._insert = None
+
+    def select(self, columns="*", count=None):
+        self._select = columns
+        return self
+
+    def _filter(self, column, op, value):
+        self._filters.append((column, op, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, '=', value)
+
+    def neq(self, column, value):
+        return self._filter(column, '<>', value)
+
+    def gt(self, column, value):
+        return self._filter(column, '>', value)
+
+    def gte(self, column, value):
+        return self._filter(column, '>=', value)
+
+    def lt(self, column, value):
+        return self._filter(column, '<', value)
+
+    def lte(self, column, value):
+        return self._filter(column, '<=', value)
+
+    def in_(self, column, values):
+        return self._filter(column, 'IN', list(values))
+
+    def is_(self, column, value):
+        return self._filter(column, 'IS', None if value in (None, 'null') else value)
+
+    def order(self, column, desc=False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, size):
+        self._limit = int(size)
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def insert(self, data):
+        self._insert = data if isinstance(data, list) else [data]
+        return self
+
+    def execute(self):
+        if self._insert is not None:
+            return LocalResponse(self.client._insert(self.table, self._insert))
+        where, params = self.client._where(self.table, self._filters)
+        rows = self.client._fetch(self.table, self._select, where, params, self._order, self._limit)
+        if self._single:
+            if len(rows) != 1:
+                raise LocalBackendError("JSON object requested, multiple (or no) rows returned", code="PGRST116")
+            return LocalResponse(rows[0])
+        return LocalResponse(rows)
+
+
+class LocalClient:
+    """ create_client() の代わりに使う。接続はスレッドごと (FastAPI の同期エンドポイントはスレッドプールで動く) """
+
+    backend = "local"
+
+    def __init__(self, path=LOCAL_DB_PATH, base_dir=BASE_DIR, rebuild="auto"):
+        self.path = path
+        if rebuild == "always" or (rebuild == "auto" and is_stale(path, base_dir)):
+            ms = build_snapshot(path, base_dir)
+            print(f"[local] スナップショットを作成しました: {path} ({ms} ms)")
+        elif not os.path.exists(path):
+            raise LocalBackendError(f"{path} がありません (python local_backend.py で作成)")
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._columns = {}
+        conn = self._conn()
+        for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"):
+            self._columns[table] = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA mmap_size=268435456")
+            self._local.conn = conn
+        return conn
+
+    def table(self, name):
+        if name not in self._columns:
+            raise LocalBackendError(f'relation "public.{name}" does not exist', code="42P01")
+        return LocalQuery(self, name)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- SQL の組み立て ---
+
+    def _column(self, table, column):
+        if column not in self._columns[table]:
+            raise LocalBackendError(f"column {table}.{column} does not exist", code="42703")
+        return f'"{column}"'
+
+    def _where(self, table, filters):
+        clauses, params = [], []
+        for column, op, value in filters:
+            col = self._column(table, column)
+            if op == 'IN':
+                clauses.append(f"{col} IN ({', '.join('?' * len(value))})" if value else "0")
+                params.extend(value)
+            elif op == 'IS':
+                clauses.append(f"{col} IS ?")
+                params.append(value)
+            else:
+                clauses.append(f"{col} {op} ?")
+                params.append(int(value) if isinstance(value, bool) else value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _foreign_key(self, table, target, hint):
+        """ (外部キーを持つ側, 列, 参照される側) を探す。hint は制約名 (line_stations_station_id_fkey) """
+        for src, column, ref in FOREIGN_KEYS:
+            if hint and hint != f"{src}_{column}_fkey":
+                continue
+            if (src, ref) in ((table, target), (target, table)):
+                return src, column, ref
+        raise LocalBackendError(f"Could not find a relationship between '{table}' and '{target}'", code="PGRST200")
+
+    def _fetch(self, table, select, where, params, order, limit):
+        columns, embeds = [], []
+        for item in _split_top_level(select):
+            m = _EMBED.match(item)
+            if m:
+                embeds.append(m.groups())
+            elif item == '*':
+                columns.extend(self._columns[table])
+            else:
+                self._column(table, item)
+                columns.append(item)
+
+        # 埋め込みの結合に使う列も一緒に読む (結果からは落とす)
+        links = []
+        for alias, target, hint, sub_select in embeds:
+            if target not in self._columns:
+                raise LocalBackendError(f'relation "public.{target}" does not exist', code="42P01")
+            src, column, ref = self._foreign_key(table, target, hint)
+            links.append((alias or target, target, sub_select, column if src == table else 'id',
+                          'id' if src == table else column, src == table))
+        extra = [c for _, _, _, key, _, _ in links for c in [key] if c not in columns]
+
+        sql = f'SELECT {", ".join(self._column(table, c) for c in columns + extra) or "1"} FROM "{table}"{where}'
+        if order:
+            sql += " ORDER BY " + ", ".join(
+                # PostgREST (Postgres) の既定: 昇順は NULL が最後、降順は NULL が最初
+                f"{self._column(table, c)} IS {'NOT ' if desc else ''}NULL, {self._column(table, c)} {'DESC' if desc else 'ASC'}"
+                for c, desc in order)
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+
+        bools = BOOL_COLUMNS.get(table, ())
+        rows = []
+        for r in self._conn().execute(sql, params):
+            row = dict(zip(columns + extra, r))
+            for c in bools:
+                if c in row and row[c] is not None:
+                    row[c] = bool(row[c])
+            rows.append(row)
+
+        for name, target, sub_select, key, target_key, to_one in links:
+            keys = sorted({row[key] for row in rows if row[key] is not None})
+            sub_where, sub_params = self._where(target, [(target_key, 'IN', keys)])
+            wanted = _split_top_level(sub_select)
+            hidden = target_key not in wanted and '*' not in wanted
+            children = self._fetch(target, ", ".join(wanted + [target_key] if hidden else wanted),
+                                   sub_where, sub_params, [], None)
+            grouped = {}
+            for child in children:
+                value = child.pop(target_key) if hidden else child[target_key]
+                grouped.setdefault(value, []).append(child)
+            for row in rows:
+                found = grouped.get(row[key], [])
+                row[name] = (found[0] if found else None) if to_one else found
+
+        for row in rows:
+            for c in extra:
+                row.pop(c, None)
+        return rows
+
+    def _insert(self, table, records):
+        inserted = []
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                for record in records:
+                    record = dict(record)
+                    if table in UUID_ID_TABLES and not record.get('id'):
+                        record['id'] = str(uuid.uuid4())
+                    cols = [self._column(table, c) for c in record]
+                    values = [int(v) if isinstance(v, bool) else v for v in record.values()]
+                    conn.execute(f'INSERT INTO "{table}" ({", ".join(cols)}) VALUES ({", ".join("?" * len(cols))})', values)
+                    inserted.append(record)
+        if table == 'congestion_reports':
+            # reported_at などの既定値を埋めた行を返す (PostgREST の return=representation と同じ)
+            where, params = self._where(table, [('id', 'IN', [r['id'] for r in inserted])])
+            return self._fetch(table, "*", where, params, [], None)
+        return inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSV からローカルバックエンド用の SQLite スナップショットを作る")
+    parser.add_argument('--path', default=LOCAL_DB_PATH)
+    parser.add_argument('--force', action='store_true', help="更新がなくても作り直す")
+    args = parser.parse_args()
+
+    if args.force or is_stale(args.path):
+        ms = build_snapshot(args.path)
+        print(f"スナップショットを作成しました: {args.path} ({ms} ms)")
+    else:
+        print(f"スナップショットは最新です: {args.path}")
+
+    client = LocalClient(args.path, rebuild="never")
+    for table in ('lines', 'stations', 'line_stations', 'toilets', 'toilet_strategies', 'congestion_reports'):
+        count = client._conn().execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        print(f"  {table:<19} {count:>6} 行")
+
+
+if __name__ == "__main__":
+    main()
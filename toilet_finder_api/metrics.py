@@ -0,0 +1,308 @@
+import contextvars
+import os
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+# ---------------------------------------------------------
+# リクエスト・DB問い合わせの計測と /metrics (Prometheus テキスト形式)
+# ---------------------------------------------------------
+# - DB クライアントを InstrumentedClient で包み、execute() 1回ごとにテーブル・操作・所要時間を記録する
+# - MetricsMiddleware がリクエスト単位で所要時間・ステータス・DB問い合わせ回数をまとめる
+#   (DB の記録はリクエスト中は contextvar の RequestContext に溜め、ルートが決まった後にエンドポイント名を付けて集計する)
+# - リクエストID (X-Request-ID。来なければ採番) もここで決めて、応答ヘッダーに返す
+# - キャッシュは cache_hit() / cache_miss() で名前ごとに数える
+#
+# 外部ライブラリは使わない (prometheus_client なし)。1回の記録はロック1回と bisect 1回程度なので本番でも常時有効にできる。
+# METRICS_ENABLED=0 で DB クライアントの計測を外せる。
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# 秒単位のバケット (Prometheus クライアントの既定値に 2.5ms を足したもの)
+LATENCY_BUCKETS = (0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CALLS_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+NO_ENDPOINT = "-"          # リクエストの外 (起動時の読み込みなど) の問い合わせ
+UNMATCHED_ENDPOINT = "unmatched"
+
+REQUEST_ID_HEADER = b"x-request-id"
+_REQUEST_ID = re.compile(rb'^[A-Za-z0-9._-]{1,64}$')
+
+_request = contextvars.ContextVar('metrics_request', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0.0)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [バケットごとの件数..., +Inf, 合計]
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[i] += 1
+            state[-1] += value
+
+    def count(self, *labels):
+        state = self._values.get(labels)
+        return sum(state[:-1]) if state else 0
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((labels, list(state)) for labels, state in self._values.items())
+        for labels, state in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), state[:-1]):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {state[-1]:g}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+http_requests = REGISTRY.register(Counter(
+    "toilet_api_http_requests_total", "HTTP リクエスト数", ("endpoint", "method", "status")))
+http_latency = REGISTRY.register(Histogram(
+    "toilet_api_http_request_duration_seconds", "HTTP リクエストの所要時間", ("endpoint", "method")))
+http_in_flight = REGISTRY.register(Gauge(
+    "toilet_api_http_requests_in_flight", "処理中のリクエスト数"))
+db_calls_per_request = REGISTRY.register(Histogram(
+    "toilet_api_db_calls_per_request", "1リクエストあたりの DB 問い合わせ回数", ("endpoint",), CALLS_BUCKETS))
+db_queries = REGISTRY.register(Counter(
+    "toilet_api_db_queries_total", "DB 問い合わせ回数", ("endpoint", "table", "operation")))
+db_latency = REGISTRY.register(Histogram(
+    "toilet_api_db_query_duration_seconds", "DB 問い合わせ1回の所要時間", ("endpoint", "table", "operation")))
+db_errors = REGISTRY.register(Counter(
+    "toilet_api_db_errors_total", "例外になった DB 問い合わせ", ("endpoint", "table", "operation", "error")))
+cache_requests = REGISTRY.register(Counter(
+    "toilet_api_cache_requests_total", "プロセス内キャッシュの参照 (result=hit / miss)", ("cache", "result")))
+
+
+def cache_hit(name):
+    cache_requests.inc(name, "hit")
+
+
+def cache_miss(name):
+    cache_requests.inc(name, "miss")
+
+
+def render():
+    return REGISTRY.render()
+
+
+def _record_query(endpoint, table, operation, seconds, error):
+    db_queries.inc(endpoint, table, operation)
+    db_latency.observe(seconds, endpoint, table, operation)
+    if error:
+        db_errors.inc(endpoint, table, operation, error)
+
+
+# ---------------------------------------------------------
+# DB クライアントの計測 (supabase-py / LocalClient のどちらでも同じ書き方で包める)
+# ---------------------------------------------------------
+
+OPERATIONS = ('select', 'insert', 'upsert', 'update', 'delete')
+
+
+class InstrumentedQuery:
+    def __init__(self, table, query, operation="select"):
+        self._table = table
+        self._query = query
+        self._operation = operation
+
+    def __getattr__(self, name):
+        attr = getattr(self._query, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # ビルダーのメソッドは (新しい) ビルダーを返すので包み直す
+            if hasattr(result, 'execute'):
+                return InstrumentedQuery(self._table, result, name if name in OPERATIONS else self._operation)
+            return result
+        return call
+
+    def execute(self):
+        started = time.perf_counter()
+        error = None
+        try:
+            return self._query.execute()
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            request = _request.get()
+            if request is not None:
+                request.calls.append((self._table, self._operation, started - request.started, elapsed, error))
+            else:
+                _record_query(NO_ENDPOINT, self._table, self._operation, elapsed, error)
+
+
+class InstrumentedClient:
+    def __init__(self, client):
+        self.client = client
+
+    def table(self, name):
+        return InstrumentedQuery(name, self.client.table(name))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def instrument(client):
+    """ DB クライアントを計測付きで包む (二重には包まない) """
+    if not METRICS_ENABLED or client is None or isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client)
+
+
+# ---------------------------------------------------------
+# ASGI ミドルウェア
+# ---------------------------------------------------------
+
+def endpoint_label(scope):
+    """ ルートのパステンプレート (/stations など)。ID をラベルにしないようにする """
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ENDPOINT
+
+
+class RequestContext:
+    """ 処理中のリクエスト1件分の情報 (ハンドラのスレッドからも current_request() で見える) """
+    __slots__ = ('request_id', 'scope', 'started', 'calls', 'stale_age')
+
+    def __init__(self, request_id, scope):
+        self.request_id = request_id
+        self.scope = scope
+        self.started = time.perf_counter()
+        self.calls = []    # (table, operation, 開始までの秒, 所要秒, 例外名)
+        self.stale_age = None    # 障害時に古い結果で答えたら、その経過秒 (circuit.py)
+
+    @property
+    def endpoint(self):
+        return endpoint_label(self.scope)
+
+
+def current_request():
+    return _request.get()
+
+
+def _request_id(scope):
+    for name, value in scope.get("headers", ()):
+        if name == REQUEST_ID_HEADER and _REQUEST_ID.match(value):
+            return value.decode()
+    return uuid.uuid4().hex[:16]
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestContext(_request_id(scope), scope)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", ())) + [(REQUEST_ID_HEADER, request.request_id.encode())]
+            await send(message)
+
+        token = _request.set(request)
+        http_in_flight.inc(amount=1)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - request.started
+            http_in_flight.inc(amount=-1)
+            _request.reset(token)
+            endpoint = request.endpoint
+            method = scope.get("method", "")
+            http_requests.inc(endpoint, method, str(status[0]))
+            http_latency.observe(elapsed, endpoint, method)
+            db_calls_per_request.observe(len(request.calls), endpoint)
+            for table, operation, _, seconds, error in request.calls:
+                _record_query(endpoint, table, operation, seconds, error)
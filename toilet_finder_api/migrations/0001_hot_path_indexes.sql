@@ -0,0 +1,27 @@
+-- 0001: APIのホットパス用インデックス
+-- 01_schema.sql は主キーのみなので、api.py / routers/commuter.py が実際に発行する
+-- 検索条件に合わせた複合・カバリングインデックスを追加する。
+
+-- /predict: toilet_strategies を station_id + direction で絞り込む
+CREATE INDEX IF NOT EXISTS idx_toilet_strategies_station_direction
+    ON public.toilet_strategies (station_id, direction);
+
+-- /predict: トイレごとの最新5件の混雑報告 (ORDER BY reported_at DESC LIMIT 5)
+-- congestion_level を INCLUDE して Index Only Scan で完結させる
+CREATE INDEX IF NOT EXISTS idx_congestion_reports_toilet_reported
+    ON public.congestion_reports (toilet_id, reported_at DESC)
+    INCLUDE (congestion_level);
+
+-- /lines: 最寄り駅を通る路線の逆引き (主キーは line_id 先頭なので使えない)
+CREATE INDEX IF NOT EXISTS idx_line_stations_station
+    ON public.line_stations (station_id)
+    INCLUDE (line_id);
+
+-- /stations, 終点ラベル取得: line_id で絞って station_order 順に並べる
+CREATE INDEX IF NOT EXISTS idx_line_stations_line_order
+    ON public.line_stations (line_id, station_order)
+    INCLUDE (station_id);
+
+-- /commuter/search: 緯度経度の範囲検索
+CREATE INDEX IF NOT EXISTS idx_toilets_lat_lng
+    ON public.toilets (lat, lng);
@@ -0,0 +1,243 @@
+import contextvars
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+import metrics
+
+# ---------------------------------------------------------
+# リクエスト単位のサンプリングプロファイラ (必要なときだけ有効にする)
+# ---------------------------------------------------------
+# 次のどちらかのリクエストだけ、処理中のスタックを PROFILE_INTERVAL_MS ごとに記録する。
+#   - X-Profile-Token ヘッダーが PROFILE_TOKEN と一致する (特定の駅の /predict を調べるとき)
+#   - PROFILE_SAMPLE_RATE の確率で選ばれた (0.001 なら 1000件に1件)
+# 記録したプロファイルは DB 問い合わせの時系列 (metrics.py の記録) と一緒にリクエストIDで保存し、
+# GET /debug/profiles/{request_id} で取り出せる (collapsed 形式・speedscope 形式)。
+#
+# 同期エンドポイントはスレッドプールで動くので、どのワーカーがこのリクエストを処理しているかは
+# ワーカーが context.run(func) で引き継いだ contextvars から判定する (応答の pydantic 検証も含まれる)。
+# イベントループのスレッドは待機中 (selectors) 以外のサンプルだけを残す。
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0") or 0)
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "1") or 1)
+PROFILE_STORE_SIZE = int(os.environ.get("PROFILE_STORE_SIZE", "50") or 50)
+
+TOKEN_HEADER = b"x-profile-token"
+EXCLUDED_PATHS = ('/metrics', '/debug/')
+
+_session = contextvars.ContextVar('profiling_session', default=None)
+
+
+def enabled():
+    return bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+
+def token_matches(token):
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(code):
+    return code.co_filename.endswith(('selectors.py', 'queue.py', 'threading.py'))
+
+
+class Session:
+    """ 1リクエスト分のサンプリング。別スレッドから sys._current_frames() を覗く """
+
+    def __init__(self, request_id, interval_ms=PROFILE_INTERVAL_MS):
+        self.request_id = request_id
+        self.interval = interval_ms / 1000
+        self.loop_thread = threading.get_ident()
+        self.samples = []     # (開始からの秒, (root, ..., leaf))
+        self.started = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.request_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+        self._stop.set()
+        self._thread.join()
+
+    def _owns(self, frame):
+        """ このリクエストを処理中のワーカーか (anyio のワーカーは run() の context 変数に contextvars を持つ) """
+        child = None
+        while frame is not None:
+            code = frame.f_code
+            if code.co_name == 'run' and 'anyio' in code.co_filename:
+                if child is None or _is_idle(child):
+                    return False
+                context = frame.f_locals.get('context')
+                return isinstance(context, contextvars.Context) and context.get(_session) is self
+            child = code
+            frame = frame.f_back
+        return False
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter() - self.started
+            for tid, frame in sys._current_frames().items():
+                if tid == own or _is_idle(frame.f_code):
+                    continue
+                if tid != self.loop_thread and not self._owns(frame):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples.append((now, tuple(stack)))
+
+
+class ProfileStore:
+    """ 直近 PROFILE_STORE_SIZE 件のプロファイルをリクエストIDで持つ """
+
+    def __init__(self, size=PROFILE_STORE_SIZE):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, profile):
+        with self._lock:
+            self._items[profile['request_id']] = profile
+            self._items.move_to_end(profile['request_id'])
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def get(self, request_id):
+        with self._lock:
+            return self._items.get(request_id)
+
+    def summaries(self):
+        with self._lock:
+            items = list(self._items.values())
+        keys = ('request_id', 'trigger', 'method', 'path', 'endpoint', 'status', 'started_at', 'duration_ms', 'samples')
+        return [{k: p[k] for k in keys} for p in reversed(items)]
+
+
+PROFILES = ProfileStore()
+
+
+def build_profile(session, scope, status, trigger, request):
+    stacks = Counter(';'.join(stack) for _, stack in session.samples)
+    queries = []
+    if request is not None:
+        for table, operation, offset, seconds, error in request.calls:
+            queries.append({"table": table, "operation": operation, "start_ms": round(offset * 1000, 3),
+                            "duration_ms": round(seconds * 1000, 3), "error": error})
+    query_string = scope.get("query_string", b"").decode('latin-1')
+    return {
+        "request_id": session.request_id,
+        "trigger": trigger,
+        "method": scope.get("method", ""),
+        "path": scope.get("path", "") + (f"?{query_string}" if query_string else ""),
+        "endpoint": metrics.endpoint_label(scope),
+        "status": status,
+        "started_at": datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        "duration_ms": round(session.elapsed * 1000, 3),
+        "interval_ms": session.interval * 1000,
+        "samples": len(session.samples),
+        "db_ms": round(sum(q["duration_ms"] for q in queries), 3),
+        "queries": queries,
+        "collapsed": dict(stacks.most_common()),
+        "timeline": [(t, stack) for t, stack in session.samples],
+    }
+
+
+def to_collapsed(profile):
+    """ flamegraph.pl / speedscope がそのまま読める 'a;b;c 回数' 形式 """
+    return ''.join(f"{stack} {count}\n" for stack, count in profile['collapsed'].items())
+
+
+def to_speedscope(profile):
+    """ https://www.speedscope.app に読み込める sampled 形式 (重みは次のサンプルまでのミリ秒) """
+    frames = []
+    frame_index = {}
+    samples = []
+    weights = []
+    timeline = profile['timeline']
+    for i, (t, stack) in enumerate(timeline):
+        indexes = []
+        for name in stack:
+            if name not in frame_index:
+                frame_index[name] = len(frames)
+                frames.append({"name": name})
+            indexes.append(frame_index[name])
+        samples.append(indexes)
+        end = timeline[i + 1][0] if i + 1 < len(timeline) else profile['duration_ms'] / 1000
+        weights.append(round(max(end - t, 0.0) * 1000, 3))
+    name = f"{profile['method']} {profile['path']} ({profile['request_id']})"
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "toilet_finder_api",
+        "shared": {"frames": frames},
+        "profiles": [{"type": "sampled", "name": name, "unit": "milliseconds", "startValue": 0,
+                      "endValue": profile['duration_ms'], "samples": samples, "weights": weights}],
+    }
+
+
+def summary(profile):
+    """ JSON で返すときは生のサンプル列を省く """
+    return {k: v for k, v in profile.items() if k != 'timeline'}
+
+
+# ---------------------------------------------------------
+# ASGI ミドルウェア (MetricsMiddleware の内側に置く。リクエストIDと DB の記録をそちらから貰う)
+# ---------------------------------------------------------
+
+def _trigger(scope):
+    if not scope.get("path", "").startswith(EXCLUDED_PATHS):
+        for name, value in scope.get("headers", ()):
+            if name == TOKEN_HEADER:
+                if token_matches(value.decode('latin-1')):
+                    return "header"
+                break
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            return "sampled"
+    return None
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        trigger = _trigger(scope) if scope["type"] == "http" and enabled() else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        request = metrics.current_request()
+        session = Session(request.request_id if request else uuid.uuid4().hex[:16])
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        token = _session.set(session)
+        session.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            session.stop()
+            _session.reset(token)
+            PROFILES.put(build_profile(session, scope, status[0], trigger, request))
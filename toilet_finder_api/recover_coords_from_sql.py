@@ -1,13 +1,31 @@
 import pandas as pd
-import re
 import os
-import csv
-import io
+from sql_dump_reader import iter_rows, SqlDumpError
 
 # ファイルパス
 SQL_FILE = 'init_data.sql'
 MASTER_CSV = 'station_toilet.csv'
 
+def _pick(values, columns, key_cols, lat_cols, lon_cols, positions):
+    """ (キー, lat, lon) を取り出す。列リストのないINSERTは位置で読む """
+    if columns is None:
+        if len(values) <= max(positions):
+            return None, None, None
+        return tuple(values[i] for i in positions)
+    found = []
+    for names in (key_cols, lat_cols, lon_cols):
+        found.append(next((values[c] for c in names if c in values), None))
+    return tuple(found)
+
+
+def _valid(lat, lon):
+    """ 0.0 以外の数値座標だけを採用する """
+    try:
+        return float(lat) != 0 and float(lon) != 0
+    except (TypeError, ValueError):
+        return False
+
+
 def recover():
     print("--- 座標復元スクリプト (強化版 V2.3) を開始します ---")
     
@@ -25,41 +43,21 @@ def recover():
     print(f"'{SQL_FILE}' を解析中...")
     
     try:
-        with open(SQL_FILE, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        # SQLファイル全体から INSERT INTO 文を検索（改行を跨げるように re.DOTALL を使用）
-        # パターン: INSERT INTO テーブル名 (カラム...) VALUES (データ)
-        # 0.0以外の座標を持つものだけを抽出
-        matches = re.finditer(r"INSERT INTO (\w+) .*? VALUES\s*\((.*?)\)", content, re.IGNORECASE | re.DOTALL)
+        # ダンプをチャンク単位で読み、toilets / stations の行だけを順に受け取る (一定メモリ)
+        for row in iter_rows(SQL_FILE, tables={'toilets', 'stations'}):
+            values = row.as_dict()
+            if row.table == "toilets":
+                # 列名があればそれを使い、なければ旧フォーマットの並び (id, ?, ?, lat, lon) とみなす
+                key, lat, lon = _pick(values, row.columns, ['id', 'toilet_id'], ['lat'], ['lng', 'lon'], (0, 3, 4))
+                if key is not None and _valid(lat, lon):
+                    id_coords[str(key)] = (str(lat), str(lon))
 
-        for match in matches:
-            table_name = match.group(1).lower()
-            raw_values = match.group(2).replace('\n', ' ').strip()
-            
-            # CSVパーサーで安全に分割
-            safe_values = raw_values.replace("''", "[[Q]]")
-            f_io = io.StringIO(safe_values)
-            reader = csv.reader(f_io, quotechar="'", skipinitialspace=True)
-            try:
-                parts = next(reader)
-            except:
-                continue
-            parts = [p.replace("[[Q]]", "'") for p in parts]
-            
-            if table_name == "toilets" and len(parts) >= 5:
-                t_id, lat, lon = parts[0], parts[3], parts[4]
-                if lat.replace('.','',1).isdigit() and lon.replace('.','',1).isdigit():
-                    if float(lat) != 0:
-                        id_coords[t_id] = (lat, lon)
-                        
-            elif table_name == "stations" and len(parts) >= 3:
-                s_name, lat, lon = parts[0], parts[1], parts[2]
-                if lat.replace('.','',1).isdigit() and lon.replace('.','',1).isdigit():
-                    if float(lat) != 0:
-                        station_backup_coords[s_name] = (lat, lon)
+            elif row.table == "stations":
+                key, lat, lon = _pick(values, row.columns, ['name', 'station_name'], ['lat'], ['lng', 'lon'], (0, 1, 2))
+                if key is not None and _valid(lat, lon):
+                    station_backup_coords[str(key)] = (str(lat), str(lon))
 
-    except Exception as e:
+    except (OSError, SqlDumpError) as e:
         print(f"解析中にエラーが発生しました: {e}")
         return
 
@@ -70,7 +68,7 @@ def recover():
     recovered_count = 0
     
     for idx, row in df_master.iterrows():
-        t_id = row['toilet_id']
+        t_id = row['toilet_id'] if 'toilet_id' in row else row.get('id', '')
         s_name = row['station_name']
         
         # 1. IDでマッチ
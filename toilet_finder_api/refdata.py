@@ -0,0 +1,514 @@
+import argparse
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+
+from local_backend import LocalBackendError, LocalResponse, FOREIGN_KEYS, _EMBED, _split_top_level
+
+# ---------------------------------------------------------
+# 参照データの共有スナップショット (複数ワーカーで1つのファイルを mmap する)
+# ---------------------------------------------------------
+# lines / stations / line_stations / toilet_strategies / toilets を、読み取り専用のバイナリ1ファイルにまとめる。
+#   - 列ごとの配列 (f64 / i64 / bool / 文字列の番号 int32)
+#   - 文字列テーブル (全テーブル共通、ソート済み。番号の大小 = 文字列の大小)
+#   - id / *_id 列の索引 (値の順に並べた行番号。二分探索で eq を引く)
+# ワーカーはファイルを ACCESS_READ で mmap するだけなので、ページキャッシュを共有してワーカーを増やしてもメモリは増えない。
+#
+# 公開は REFDATA_DIR/refdata-<version>.bin を書いてから CURRENT (ファイル名1行) を os.replace で差し替える。
+# 各ワーカーは REFDATA_CHECK_SECONDS ごとに CURRENT を見て、変わっていれば新しいファイルを開き直す (処理中のクエリは古い方を使い切る)。
+#
+#   python refdata.py build              # 今のデータバックエンド (db.py) から作って公開
+#   python refdata.py info               # 公開中のスナップショットの中身
+#   REFDATA_DIR=.cache/refdata python api.py
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REFDATA_DIR = os.environ.get("REFDATA_DIR", "")
+DEFAULT_REFDATA_DIR = os.path.join(BASE_DIR, '.cache', 'refdata')
+REFDATA_CHECK_SECONDS = float(os.environ.get("REFDATA_CHECK_SECONDS", "5") or 5)
+
+REFERENCE_TABLES = ('lines', 'stations', 'line_stations', 'toilet_strategies', 'toilets')
+# ページ送りで全件読むときの並び (PostgREST は1回 1000 行まで)
+PRIMARY_KEYS = {'line_stations': ('line_id', 'station_id')}
+PAGE_SIZE = 1000
+KEEP_VERSIONS = 3
+
+MAGIC = b"TFREF\x00\x00\x01"
+POINTER = "CURRENT"
+ALIGN = 8
+
+I64_NULL = -2 ** 63
+NO_STRING = -1
+# 列の種類 -> array の型コード
+TYPECODES = {'f64': 'd', 'i64': 'q', 'bool': 'b', 'str': 'i'}
+
+
+# ---------------------------------------------------------
+# 作成
+# ---------------------------------------------------------
+
+def fetch_all(client, table):
+    """ テーブルを全件読む (supabase-py は range() でページ送り、LocalClient は1回で全件) """
+    query = client.table(table).select("*")
+    if not hasattr(query, 'range'):
+        return query.execute().data
+    rows = []
+    while True:
+        query = client.table(table).select("*")
+        for column in PRIMARY_KEYS.get(table, ('id',)):
+            query = query.order(column)
+        page = query.range(len(rows), len(rows) + PAGE_SIZE - 1).execute().data
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+
+
+def _column_kind(values):
+    kinds = {type(v) for v in values if v is not None}
+    if kinds and kinds <= {bool}:
+        return 'bool'
+    if kinds and kinds <= {int}:
+        return 'i64'
+    if kinds and kinds <= {int, float}:
+        return 'f64'
+    return 'str'
+
+
+def _is_indexed(column):
+    return column == 'id' or column.endswith('_id')
+
+
+class _Writer:
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def add(self, data):
+        pad = -self.size % ALIGN
+        if pad:
+            self.chunks.append(b'\0' * pad)
+            self.size += pad
+        offset = self.size
+        self.chunks.append(data)
+        self.size += len(data)
+        return [offset, len(data)]
+
+
+def compile_snapshot(tables, source=""):
+    """ {table: [row dict, ...]} -> スナップショットのバイト列と version """
+    columns = {}
+    for name, rows in tables.items():
+        names = list(dict.fromkeys(c for row in rows for c in row))
+        columns[name] = {c: [row.get(c) for row in rows] for c in names}
+    kinds = {name: {c: _column_kind(values) for c, values in cols.items()} for name, cols in columns.items()}
+
+    strings = sorted({str(v) for name, cols in columns.items() for c, values in cols.items()
+                      if kinds[name][c] == 'str' for v in values if v is not None})
+    string_ids = {s: i for i, s in enumerate(strings)}
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = array('I', [0])
+    for b in encoded:
+        offsets.append(offsets[-1] + len(b))
+
+    body = _Writer()
+    header = {"format": 1, "created_at": datetime.now(timezone.utc).isoformat(timespec='seconds'), "source": source,
+              "strings": {"count": len(strings), "offsets": body.add(offsets.tobytes()), "blob": body.add(b''.join(encoded))},
+              "tables": {}}
+    for name, cols in columns.items():
+        meta = header["tables"][name] = {"rows": len(tables[name]), "columns": {}, "indexes": {}}
+        for c, values in cols.items():
+            kind = kinds[name][c]
+            if kind == 'str':
+                data = array('i', (NO_STRING if v is None else string_ids[str(v)] for v in values))
+            elif kind == 'f64':
+                data = array('d', (math.nan if v is None else float(v) for v in values))
+            elif kind == 'i64':
+                data = array('q', (I64_NULL if v is None else v for v in values))
+            else:
+                data = array('b', (-1 if v is None else int(v) for v in values))
+            meta["columns"][c] = {"kind": kind, "data": body.add(data.tobytes())}
+            if _is_indexed(c) and kind == 'str':
+                order = sorted((k, row) for row, k in enumerate(data) if k != NO_STRING)
+                meta["indexes"][c] = body.add(array('i', (row for _, row in order)).tobytes())
+
+    payload = b''.join(body.chunks)
+    header["version"] = hashlib.sha256(payload).hexdigest()[:16]
+    head = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    start = len(MAGIC) + 4 + len(head)
+    start += -start % ALIGN
+    prefix = MAGIC + struct.pack('<I', len(head)) + head
+    return prefix + b'\0' * (start - len(prefix)) + payload, header["version"]
+
+
+def publish(data, version, out_dir=DEFAULT_REFDATA_DIR, keep=KEEP_VERSIONS):
+    """ refdata-<version>.bin を書いて CURRENT を差し替える。古い版は keep 個まで残す """
+    os.makedirs(out_dir, exist_ok=True)
+    filename = f"refdata-{version}.bin"
+    path = os.path.join(out_dir, filename)
+    if not os.path.exists(path):
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    pointer_tmp = os.path.join(out_dir, POINTER + ".tmp")
+    with open(pointer_tmp, 'w', encoding='utf-8') as f:
+        f.write(filename + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(out_dir, POINTER))
+
+    # 開いているワーカーがあっても、unlink した mmap はそのまま読める
+    versions = sorted((os.path.getmtime(os.path.join(out_dir, f)), f) for f in os.listdir(out_dir)
+                      if f.startswith("refdata-") and f.endswith(".bin") and f != filename)
+    for _, old in versions[:max(0, len(versions) - (keep - 1))]:
+        os.remove(os.path.join(out_dir, old))
+    return path
+
+
+def build(client, out_dir=DEFAULT_REFDATA_DIR, source=""):
+    tables = {name: fetch_all(client, name) for name in REFERENCE_TABLES}
+    data, version = compile_snapshot(tables, source)
+    return publish(data, version, out_dir), version, len(data)
+
+
+# ---------------------------------------------------------
+# 読み取り
+# ---------------------------------------------------------
+
+def current_path(refdata_dir):
+    try:
+        with open(os.path.join(refdata_dir, POINTER), 'r', encoding='utf-8') as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(refdata_dir, name) if name else None
+
+
+class SnapshotTable:
+    def __init__(self, snapshot, name, meta):
+        self.snapshot = snapshot
+        self.name = name
+        self.rows = meta["rows"]
+        self.kinds = {c: m["kind"] for c, m in meta["columns"].items()}
+        self.columns = list(self.kinds)
+        self._data = {c: snapshot._view(m["data"], TYPECODES[m["kind"]]) for c, m in meta["columns"].items()}
+        self._indexes = {c: snapshot._view(span, 'i') for c, span in meta["indexes"].items()}
+
+    def value(self, column, row):
+        kind = self.kinds[column]
+        v = self._data[column][row]
+        if kind == 'str':
+            return None if v == NO_STRING else self.snapshot.string(v)
+        if kind == 'f64':
+            return None if v != v else v
+        if kind == 'i64':
+            return None if v == I64_NULL else v
+        return None if v < 0 else bool(v)
+
+    def has_index(self, column):
+        return column in self._indexes
+
+    def lookup(self, column, value):
+        """ column = value の行番号 (元の並び順) """
+        key = self.snapshot.string_id(str(value))
+        if key is None:
+            return []
+        index, data = self._indexes[column], self._data[column]
+        lo, hi = 0, len(index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if data[index[mid]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        rows = []
+        while lo < len(index) and data[index[lo]] == key:
+            rows.append(index[lo])
+            lo += 1
+        return rows
+
+
+class RefSnapshot:
+    """ 1つのスナップショットファイルを読み取り専用で mmap したもの """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} は参照データのスナップショットではありません")
+        (head_len,) = struct.unpack_from('<I', self._mm, len(MAGIC))
+        head_start = len(MAGIC) + 4
+        self.header = json.loads(self._mm[head_start:head_start + head_len].decode('utf-8'))
+        self._base = head_start + head_len + (-(head_start + head_len) % ALIGN)
+        self.version = self.header["version"]
+        self._buffer = memoryview(self._mm)
+        strings = self.header["strings"]
+        self._offsets = self._view(strings["offsets"], 'I')
+        self._blob = self._view(strings["blob"], 'B')
+        self.string_count = strings["count"]
+        self.tables = {name: SnapshotTable(self, name, meta) for name, meta in self.header["tables"].items()}
+
+    def _view(self, span, typecode):
+        offset, length = span
+        return self._buffer[self._base + offset:self._base + offset + length].cast(typecode)
+
+    def string(self, i):
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode('utf-8')
+
+    def string_id(self, value):
+        target = value.encode('utf-8')
+        lo, hi = 0, self.string_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            s = bytes(self._blob[self._offsets[mid]:self._offsets[mid + 1]])
+            if s < target:
+                lo = mid + 1
+            elif s > target:
+                hi = mid
+            else:
+                return mid
+        return None
+
+
+def _coerce(kind, value):
+    """ フィルタの値を列の型に合わせる (PostgREST は文字列で受けて列の型に変換する) """
+    if value is None:
+        return None
+    if kind == 'str':
+        return str(value)
+    if kind == 'bool':
+        return value if isinstance(value, bool) else str(value).lower() == 'true'
+    return float(value) if kind == 'f64' else int(float(value))
+
+
+def _matches(v, op, value):
+    if op == 'IS':
+        return v is value or v == value
+    if v is None:
+        return False
+    if op == 'IN':
+        return v in value
+    if op == '=':
+        return v == value
+    if op == '<>':
+        return v != value
+    if value is None:
+        return False
+    return {'>': v > value, '>=': v >= value, '<': v < value, '<=': v <= value}[op]
+
+
+class SnapshotQuery:
+    """ LocalQuery と同じメソッドで、スナップショットを読む (読み取り専用) """
+
+    def __init__(self, snapshot, table):
+        self.snapshot = snapshot
+        self.table = table
+        self._select = "*"
+        self._filters = []
+        self._order = []
+        self._limit = None
+        self._single = False
+
+    def select(self, columns="*", count=None):
+        self._select = columns
+        return self
+
+    def _filter(self, column, op, value):
+        self._filters.append((column, op, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, '=', value)
+
+    def neq(self, column, value):
+        return self._filter(column, '<>', value)
+
+    def gt(self, column, value):
+        return self._filter(column, '>', value)
+
+    def gte(self, column, value):
+        return self._filter(column, '>=', value)
+
+    def lt(self, column, value):
+        return self._filter(column, '<', value)
+
+    def lte(self, column, value):
+        return self._filter(column, '<=', value)
+
+    def in_(self, column, values):
+        return self._filter(column, 'IN', list(values))
+
+    def is_(self, column, value):
+        return self._filter(column, 'IS', None if value in (None, 'null') else value)
+
+    def order(self, column, desc=False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, size):
+        self._limit = int(size)
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def insert(self, data):
+        raise LocalBackendError(f'cannot insert into "{self.table}": reference data snapshot is read-only', code="25006")
+
+    def execute(self):
+        table = self.snapshot.tables[self.table]
+        rows = None
+        rest = []
+        for column, op, value in self._filters:
+            _check_column(table, column)
+            if rows is None and op == '=' and table.has_index(column) and value is not None:
+                rows = table.lookup(column, value)
+            else:
+                kind = table.kinds[column]
+                value = [_coerce(kind, v) for v in value] if op == 'IN' else _coerce(kind, value)
+                rest.append((column, op, set(value) if op == 'IN' else value))
+        if rows is None:
+            rows = range(table.rows)
+        for column, op, value in rest:
+            rows = [r for r in rows if _matches(table.value(column, r), op, value)]
+        # PostgREST (Postgres) の既定: 昇順は NULL が最後、降順は NULL が最初
+        for column, desc in reversed(self._order):
+            _check_column(table, column)
+            rows = sorted(rows, key=lambda r: ((v := table.value(column, r)) is None, v), reverse=desc)
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        data = _materialize(self.snapshot, table, rows, self._select)
+        if self._single:
+            if len(data) != 1:
+                raise LocalBackendError("JSON object requested, multiple (or no) rows returned", code="PGRST116")
+            return LocalResponse(data[0])
+        return LocalResponse(data)
+
+
+def _check_column(table, column):
+    if column not in table.kinds:
+        raise LocalBackendError(f"column {table.name}.{column} does not exist", code="42703")
+
+
+def _foreign_key(table, target, hint):
+    for src, column, ref in FOREIGN_KEYS:
+        if hint and hint != f"{src}_{column}_fkey":
+            continue
+        if (src, ref) in ((table, target), (target, table)):
+            return src, column, ref
+    raise LocalBackendError(f"Could not find a relationship between '{table}' and '{target}'", code="PGRST200")
+
+
+def _materialize(snapshot, table, rows, select):
+    """ 行番号の列を select に沿った dict にする (埋め込みは索引で引く) """
+    columns, embeds = [], []
+    for item in _split_top_level(select):
+        m = _EMBED.match(item)
+        if m:
+            embeds.append(m.groups())
+        elif item == '*':
+            columns.extend(table.columns)
+        else:
+            _check_column(table, item)
+            columns.append(item)
+
+    out = [{c: table.value(c, r) for c in columns} for r in rows]
+    for alias, target_name, hint, sub_select in embeds:
+        target = snapshot.tables.get(target_name)
+        if target is None:
+            raise LocalBackendError(f'relation "public.{target_name}" does not exist', code="42P01")
+        src, column, _ = _foreign_key(table.name, target_name, hint)
+        to_one = src == table.name
+        for row, r in zip(out, rows):
+            if to_one:
+                key = table.value(column, r)
+                found = target.lookup('id', key) if key is not None else []
+                children = _materialize(snapshot, target, found[:1], sub_select)
+                row[alias or target_name] = children[0] if children else None
+            else:
+                key = table.value('id', r)
+                found = target.lookup(column, key) if key is not None else []
+                row[alias or target_name] = _materialize(snapshot, target, found, sub_select)
+    return out
+
+
+class RefDataClient:
+    """ 参照テーブルはスナップショット、それ以外 (congestion_reports・書き込み) は元のクライアントに回す """
+
+    def __init__(self, client, refdata_dir, check_seconds=REFDATA_CHECK_SECONDS, on_swap=None):
+        self.client = client
+        self.refdata_dir = refdata_dir
+        self.check_seconds = check_seconds
+        self.on_swap = on_swap
+        self.snapshot = None
+        self._path = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """ CURRENT が指すファイルが変わっていれば開き直す (差し替えは参照の代入1回) """
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_seconds
+            path = current_path(self.refdata_dir)
+            if path is None or path == self._path:
+                return False
+            previous = self.snapshot
+            self.snapshot, self._path = RefSnapshot(path), path
+        if self.on_swap:
+            self.on_swap(previous, self.snapshot)
+        return True
+
+    def current(self):
+        if time.monotonic() >= self._next_check:
+            self.refresh()
+        return self.snapshot
+
+    def table(self, name):
+        snapshot = self.current()
+        if snapshot is not None and name in snapshot.tables:
+            return SnapshotQuery(snapshot, name)
+        return self.client.table(name)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="参照データの共有スナップショット (mmap) を作成・確認")
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('--dir', default=REFDATA_DIR or DEFAULT_REFDATA_DIR, help="公開先 (REFDATA_DIR)")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from db import create_data_client, backend_name
+        started = time.perf_counter()
+        path, version, size = build(create_data_client(), args.dir, source=backend_name())
+        print(f"公開しました: {path} (version {version}, {size / 1024:,.0f} KiB, {(time.perf_counter() - started) * 1000:.0f} ms)")
+        return
+
+    path = current_path(args.dir)
+    if path is None:
+        print(f"{args.dir} に公開中のスナップショットはありません (python refdata.py build)")
+        sys.exit(1)
+    snapshot = RefSnapshot(path)
+    print(f"{path}")
+    print(f"  version {snapshot.version} / 作成 {snapshot.header['created_at']} / 元 {snapshot.header['source'] or '-'}")
+    print(f"  文字列 {snapshot.string_count:,} 種 / {os.path.getsize(path) / 1024:,.0f} KiB")
+    for name, table in snapshot.tables.items():
+        print(f"  {name:<18} {table.rows:>8,} 行  索引: {', '.join(table._indexes) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from dotenv import load_dotenv
+from async_fetch import AsyncFetcher, HostRateLimiter, FetchError
+
+# ---------------------------------------------------------
+# トイレ案内文の生成ステージ (Gemini)
+# ---------------------------------------------------------
+# - 複数トイレを1リクエストにまとめて生成 (BATCH_SIZE件ずつ)
+# - 入力内容のハッシュをキーにSQLiteへキャッシュ (再実行時は同じプロンプトを投げない)
+# - トークンバケットでRPMを制限し、同時リクエスト数も上限を設ける
+# GEMINI_BASE_URL をローカルのスタブ (dev_stub_server.py) に向ければオフラインで試せる。
+
+load_dotenv()
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+
+CACHE_PATH = '.cache/route_guides.sqlite'
+BATCH_SIZE = 20
+MAX_CONCURRENCY = 2
+REQUESTS_PER_MINUTE = 15  # 無料枠の制限
+BURST = 2
+
+# 試行するモデルのリスト (優先順)
+MODELS_TO_TRY = [
+    "gemini-1.5-flash",
+    "gemini-1.5-flash-latest",
+    "gemini-1.0-pro",
+]
+
+# プロンプトを変えたら上げる (古いキャッシュを使わないため)
+PROMPT_VERSION = 2
+
+PROMPT_HEADER = """あなたは親切な駅員です。以下の各トイレについて、駅のホームからトイレへの行き方を推測して、簡潔で分かりやすい案内文（100文字以内）を作成してください。
+
+もし情報が少なくて推測できない場合は、「<駅名>駅の係員にお尋ねください。」のような無難な案内にして、嘘の道順は書かないでください。
+トーン: 丁寧語で、急いでいる人に配慮した簡潔さ。
+
+出力は次の形式のJSON配列のみとし、説明文やコードブロックは付けないでください:
+[{"i": <入力のi>, "guide": "<案内文>"}, ...]
+
+入力:
+"""
+
+
+def default_guide(station_name):
+    return f"{station_name}駅周辺のトイレ情報です。"
+
+
+def guide_inputs(line_name, station_name, toilet_name, floor, features):
+    """ プロンプトに渡す1トイレ分の入力 (キャッシュキーの元にもなる) """
+    return {
+        "station": f"{station_name}駅",
+        "line": line_name,
+        "toilet": toilet_name,
+        "floor": floor if floor else "不明",
+        "features": features,
+    }
+
+
+def cache_key(inputs):
+    material = json.dumps({"v": PROMPT_VERSION, "inputs": inputs}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def build_prompt(batch):
+    items = [dict(inputs, i=i) for i, inputs in batch]
+    return PROMPT_HEADER + json.dumps(items, ensure_ascii=False)
+
+
+def parse_guides(text, indices=None):
+    """
+    モデル出力から {i: guide} を取り出す。```json で囲まれていても読む。
+    i がない・数値でない・indices (バッチの番号) にない項目は飛ばす (1件の崩れでバッチ全体を失わないように)
+    """
+    text = re.sub(r"^```(?:json)?|```$", "", text.strip(), flags=re.MULTILINE).strip()
+    start, end = text.find('['), text.rfind(']')
+    if start < 0 or end < start:
+        return {}
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+    result = {}
+    skipped = 0
+    for item in items:
+        if not isinstance(item, dict) or not item.get('guide'):
+            skipped += 1
+            continue
+        try:
+            idx = int(item['i'])
+        except (KeyError, TypeError, ValueError):
+            skipped += 1
+            continue
+        if indices is not None and idx not in indices:
+            skipped += 1
+            continue
+        result[idx] = str(item['guide']).replace("\n", " ")
+    if skipped:
+        print(f"  [Gemini Warning] 読めない案内文を {skipped} 件飛ばしました")
+    return result
+
+
+class GuideCache:
+    def __init__(self, path=CACHE_PATH):
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS route_guides (key TEXT PRIMARY KEY, guide TEXT NOT NULL)")
+        self.db.commit()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            for key, guide in self.db.execute(f"SELECT key, guide FROM route_guides WHERE key IN ({marks})", chunk):
+                found[key] = guide
+        return found
+
+    def put_many(self, items):
+        self.db.executemany("INSERT OR REPLACE INTO route_guides (key, guide) VALUES (?, ?)", items)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class GuideGenerator:
+    """ 案内文をまとめて生成する。generate() は入力と同じ順で案内文のリストを返す """
+
+    def __init__(self, api_key=GEMINI_API_KEY, base_url=GEMINI_BASE_URL, cache_path=CACHE_PATH,
+                 batch_size=BATCH_SIZE, max_concurrency=MAX_CONCURRENCY,
+                 requests_per_minute=REQUESTS_PER_MINUTE, burst=BURST):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache = GuideCache(cache_path)
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.limiter = HostRateLimiter(default_rate=requests_per_minute / 60, default_burst=burst)
+        self.stats = {"toilets": 0, "cached": 0, "generated": 0, "fallback": 0, "requests": 0, "seconds": 0.0}
+
+    async def _call_model(self, fetcher, prompt):
+        payload = {"contents": [{"parts": [{"text": prompt}]}]}
+        for model_name in MODELS_TO_TRY:
+            url = f"{self.base_url}/models/{model_name}:generateContent?key={self.api_key}"
+            try:
+                self.stats["requests"] += 1
+                data = await fetcher.post_json(url, payload)
+            except FetchError as e:
+                if e.status == 404:
+                    # モデルが見つからない場合は次のモデルを試す
+                    continue
+                print(f"  [Gemini Error] {e}")
+                return ""
+            if 'candidates' in data and data['candidates']:
+                return data['candidates'][0]['content']['parts'][0]['text']
+            return ""
+        return ""
+
+    async def _run_batch(self, fetcher, batch):
+        async with self.semaphore:
+            text = await self._call_model(fetcher, build_prompt(batch))
+        return parse_guides(text, {i for i, _ in batch})
+
+    async def generate(self, inputs_list):
+        started = time.monotonic()
+        keys = [cache_key(inputs) for inputs in inputs_list]
+        cached = self.cache.get_many(set(keys))
+        results = [cached.get(k) for k in keys]
+        self.stats["toilets"] += len(inputs_list)
+        self.stats["cached"] += sum(1 for r in results if r is not None)
+
+        # 同じ入力は1回だけ生成する
+        pending = {}
+        for idx, (key, result) in enumerate(zip(keys, results)):
+            if result is None and key not in pending:
+                pending[key] = idx
+        todo = [(idx, inputs_list[idx]) for idx in pending.values()]
+
+        if todo and self.api_key:
+            batches = [todo[i:i + self.batch_size] for i in range(0, len(todo), self.batch_size)]
+            fetcher = AsyncFetcher(limiter=self.limiter, cache=None, max_retries=3, timeout=120,
+                                   headers={'Content-Type': 'application/json'})
+            async with fetcher:
+                outputs = await asyncio.gather(*(self._run_batch(fetcher, b) for b in batches))
+
+            fresh = {}
+            for guides in outputs:
+                for idx, guide in guides.items():
+                    if 0 <= idx < len(keys) and keys[idx] in pending:
+                        fresh[keys[idx]] = guide
+            if fresh:
+                self.cache.put_many(fresh.items())
+            self.stats["generated"] += len(fresh)
+            results = [r if r is not None else fresh.get(k) for k, r in zip(keys, results)]
+
+        # 生成できなかったものは定型文 (キャッシュしない)
+        final = []
+        for inputs, result in zip(inputs_list, results):
+            if result is None:
+                self.stats["fallback"] += 1
+                result = default_guide(inputs["station"].removesuffix("駅"))
+            final.append(result)
+
+        self.stats["seconds"] += time.monotonic() - started
+        return final
+
+    def summary(self):
+        s = self.stats
+        per_minute = s["toilets"] / s["seconds"] * 60 if s["seconds"] > 0 else 0.0
+        return (f"案内文: {s['toilets']} 件 (キャッシュ {s['cached']} / 生成 {s['generated']} / "
+                f"定型文 {s['fallback']}) / リクエスト {s['requests']} 回 / {per_minute:.1f} 件/分")
+
+    def close(self):
+        self.cache.close()
+
+
+async def _bench(count, batch_size, cache_path):
+    generator = GuideGenerator(api_key=GEMINI_API_KEY or "stub", cache_path=cache_path, batch_size=batch_size)
+    inputs = [guide_inputs("JR山手線", f"駅{i % 50}", f"トイレ{i}", "B1F", "特になし") for i in range(count)]
+    try:
+        await generator.generate(inputs)
+    finally:
+        generator.close()
+    print(generator.summary())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="案内文生成ステージのスループット計測")
+    parser.add_argument('--count', type=int, default=200, help="生成するダミートイレ数")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--cache', default='.cache/route_guides_bench.sqlite', help="計測用のキャッシュファイル")
+    args = parser.parse_args()
+    print(f"エンドポイント: {GEMINI_BASE_URL}")
+    asyncio.run(_bench(args.count, args.batch_size, args.cache))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,20 @@
-import os
 import math
 import random
-from pathlib import Path
 from fastapi import APIRouter, Query, HTTPException
 from pydantic import BaseModel
-from typing import List, Optional
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from typing import List
+from db import LazyClient
+from applog import get_logger
 
 router = APIRouter(
     prefix="/commuter",
     tags=["commuter"]
 )
 
-# --- 1. 環境変数の読み込み (修正版) ---
-# 実行ディレクトリに依存せず、このファイル(commuter.py)の2つ上のフォルダにある.envを探す
-BASE_DIR = Path(__file__).resolve().parent.parent
-ENV_PATH = BASE_DIR / ".env"
-load_dotenv(dotenv_path=ENV_PATH)
-
-# 環境変数の取得 (キー名が違っても対応できるようにORで繋ぐ)
-SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY") or os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
-
-# --- 2. クライアント初期化 (クラッシュ回避版) ---
-supabase: Optional[Client] = None
-
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("---------------------------------------------------------")
-    print("Warning: .envが見つからないか、キーが設定されていません。")
-    print(f"Search Path: {ENV_PATH}")
-    print("★ 本番DB接続をスキップし、モックモード(ダミーデータ)で起動します。")
-    print("---------------------------------------------------------")
-else:
-    try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        print("Success: Supabase connected!")
-    except Exception as e:
-        print(f"Error: Supabase connection failed: {e}")
-        supabase = None
+# --- 1. クライアント初期化 ---
+# .env の読み込みとバックエンドの選択 (Supabase / ローカルの SQLite) は db.py に集約
+supabase = LazyClient()
+log = get_logger("commuter")
 
 # --- 型定義 ---
 class ToiletOption(BaseModel):
@@ -66,8 +42,10 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     return d
 
 # --- APIエンドポイント ---
+# DB の .execute() は同期なので async にしない (スレッドプールで動かし、イベントループを止めない。
+# 同時に処理される件数が admission.py の同時実行数の上限に届くのもこのため)
 @router.get("/search", response_model=List[ToiletOption])
-async def search_commuter_toilets(
+def search_commuter_toilets(
     lat: float = Query(..., description="現在地の緯度"),
     lng: float = Query(..., description="現在地の経度")
 ):
@@ -79,11 +57,11 @@ async def search_commuter_toilets(
             min_lat, max_lat = lat - 0.05, lat + 0.05
             min_lon, max_lon = lng - 0.05, lng + 0.05
 
+            # 列名は 01_schema.sql の toilets (lat / lng) に合わせる
             response = supabase.table("toilets") \
                 .select("*") \
-                .eq("is_station_toilet", True) \
-                .gte("latitude", min_lat).lte("latitude", max_lat) \
-                .gte("longitude", min_lon).lte("longitude", max_lon) \
+                .gte("lat", min_lat).lte("lat", max_lat) \
+                .gte("lng", min_lon).lte("lng", max_lon) \
                 .execute()
             
             toilets_data = response.data
@@ -92,11 +70,11 @@ async def search_commuter_toilets(
             if toilets_data:
                 valid_options = []
                 for t in toilets_data:
-                    dist_km = calculate_distance(lat, lng, t["latitude"], t["longitude"])
+                    dist_km = calculate_distance(lat, lng, t["lat"], t["lng"])
                     
                     tags = []
                     if t.get("inside_gate"): tags.append("改札内")
-                    if t.get("is_wheelchair_accessible"): tags.append("多目的あり")
+                    if t.get("wheelchair") or t.get("is_wheelchair_accessible"): tags.append("多目的あり")
                     
                     # 個室数ダミー生成
                     total_booths = random.choice([2, 3, 5, 8, 12])
@@ -113,14 +91,14 @@ async def search_commuter_toilets(
                         "formatted": ToiletOption(
                             id=str(t["id"]),
                             stationName=t.get("station_name") or t["name"],
-                            lineName="JR中央線",
+                            lineName=t.get("line_name") or "路線情報なし",
                             distanceTime=time_min,
                             totalBooths=total_booths,
                             availableBooths=available_booths,
                             status=status,
                             tags=tags,
-                            lat=t["latitude"],
-                            lng=t["longitude"]
+                            lat=t["lat"],
+                            lng=t["lng"]
                         )
                     })
 
@@ -132,12 +110,12 @@ async def search_commuter_toilets(
                     return result
 
         except Exception as e:
-            print(f"DB Search Error: {e} (Switching to mock data)")
+            log.warning("DB Search Error: %s (Switching to mock data)", e)
 
     # -------------------------------------------------------
     # DB接続失敗 or データなしの場合: モックデータを返す
     # -------------------------------------------------------
-    print("Returning Mock Data")
+    log.info("Returning Mock Data")
     return [
         ToiletOption(
             id="mock_a",
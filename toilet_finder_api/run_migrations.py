@@ -0,0 +1,90 @@
+import os
+import sys
+import glob
+import psycopg2
+from dotenv import load_dotenv
+
+# migrations/ 以下の NNNN_xxx.sql を番号順に1回ずつ適用する
+# 適用済みのバージョンは schema_migrations テーブルで管理する
+# ※ 01_schema.sql を流し直すと schema_migrations も DROP されるので、次回は全件再適用される
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+load_dotenv()
+DB_URL = os.environ.get("SUPABASE_DB_URL")
+
+def list_migrations(migrations_dir=MIGRATIONS_DIR):
+    """ (バージョン, ファイルパス) のリストを番号順で返す """
+    result = []
+    for path in sorted(glob.glob(os.path.join(migrations_dir, '*.sql'))):
+        version = os.path.basename(path).split('_', 1)[0]
+        if version.isdigit():
+            result.append((version, path))
+    return result
+
+def ensure_migrations_table(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS public.schema_migrations ("
+        "version text PRIMARY KEY, "
+        "applied_at timestamp with time zone DEFAULT now());"
+    )
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM public.schema_migrations;")
+    return {row[0] for row in cursor.fetchall()}
+
+def apply_migrations(conn, migrations_dir=MIGRATIONS_DIR):
+    """ 未適用のマイグレーションをファイル単位のトランザクションで適用し、適用したバージョンを返す """
+    cur = conn.cursor()
+    try:
+        ensure_migrations_table(cur)
+        conn.commit()
+        done = applied_versions(cur)
+
+        newly_applied = []
+        for version, path in list_migrations(migrations_dir):
+            if version in done:
+                continue
+            print(f"適用中: {os.path.basename(path)} ...", end=" ", flush=True)
+            with open(path, 'r', encoding='utf-8') as f:
+                sql = f.read()
+            try:
+                if sql.strip():
+                    cur.execute(sql)
+                cur.execute("INSERT INTO public.schema_migrations (version) VALUES (%s);", (version,))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"失敗: {e}")
+                raise
+            print("OK")
+            newly_applied.append(version)
+        return newly_applied
+    finally:
+        cur.close()
+
+def main():
+    if not DB_URL:
+        print("エラー: .envファイルに SUPABASE_DB_URL が設定されていません。")
+        sys.exit(1)
+
+    try:
+        conn = psycopg2.connect(DB_URL)
+    except Exception as e:
+        print(f"接続エラー: {e}")
+        sys.exit(1)
+
+    try:
+        applied = apply_migrations(conn)
+        if applied:
+            print(f"\n{len(applied)} 件のマイグレーションを適用しました。")
+        else:
+            print("適用待ちのマイグレーションはありません。")
+    except Exception as e:
+        # CI・デプロイで失敗を検知できるように終了コード1で終わる
+        print(f"\n処理を中断しました: {type(e).__name__}: {e}")
+        conn.close()
+        sys.exit(1)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import glob
 import psycopg2
 from dotenv import load_dotenv
 from urllib.parse import urlparse
+from run_migrations import apply_migrations
 
 # .envファイルから接続情報を読み込む
 # SUPABASE_DB_URL="postgresql://postgres:[PASSWORD]@[HOST]:5432/postgres" のような形式を想定
@@ -63,6 +64,9 @@ def main():
         for f in strategy_files:
             execute_sql_file(cur, f)
 
+        # 4. インデックス等のマイグレーション (データ投入後にまとめて作成)
+        apply_migrations(conn)
+
         print("\n全SQLファイルの実行が完了しました！")
 
     except Exception as e:
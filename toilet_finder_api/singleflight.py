@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+import metrics
+
+# ---------------------------------------------------------
+# 同じ問い合わせの相乗り (single-flight)
+# ---------------------------------------------------------
+# 混んでいる駅では同じ /stations?line_id= や /predict が同時に届き、それぞれが同じ DB 問い合わせを投げる。
+# ここでは execute() の手前で「テーブル + ビルダーの呼び出し列」が同じ読み取りをまとめる。
+#   - 実行中のものがあれば、その結果を待って同じ結果を使う (collapsed)
+#   - 終わってから SINGLEFLIGHT_TTL_MS 以内なら、その結果をそのまま使う (cached)
+#   - 例外は共有するが残さない (次の呼び出しはもう一度問い合わせる)
+# 結果のオブジェクトは呼び出し元の間で共有されるので、受け取った data は書き換えないこと。
+# insert などの書き込みはまとめない。
+
+SINGLEFLIGHT_ENABLED = os.environ.get("SINGLEFLIGHT_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+SINGLEFLIGHT_TTL_MS = float(os.environ.get("SINGLEFLIGHT_TTL_MS", "250") or 0)
+
+WRITE_METHODS = {'insert', 'upsert', 'update', 'delete'}
+SWEEP_THRESHOLD = 1024
+
+singleflight_requests = metrics.REGISTRY.register(metrics.Counter(
+    "toilet_api_singleflight_requests_total",
+    "同じ問い合わせの相乗り (result=leader: 実際に問い合わせ / collapsed: 実行中に相乗り / cached: 直前の結果)",
+    ("table", "result")))
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'expires')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.expires = None    # None のあいだは実行中
+
+
+class SingleFlight:
+    def __init__(self, ttl_ms=SINGLEFLIGHT_TTL_MS):
+        self.ttl = ttl_ms / 1000
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        for key in [k for k, c in self._calls.items() if c.expires is not None and c.expires <= now]:
+            del self._calls[key]
+
+    def do(self, key, fn, label=""):
+        """ key が同じ呼び出しを1回にまとめて fn() の結果を返す """
+        now = time.monotonic()
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.expires is not None and call.expires <= now:
+                call = None
+            leader = call is None
+            if leader:
+                if len(self._calls) >= SWEEP_THRESHOLD:
+                    self._sweep(now)
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            singleflight_requests.inc(label, "cached" if call.event.is_set() else "collapsed")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        singleflight_requests.inc(label, "leader")
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                call.expires = time.monotonic() + self.ttl
+                if call.error is not None or self.ttl <= 0:
+                    self._calls.pop(key, None)
+            call.event.set()
+
+
+# ---------------------------------------------------------
+# DB クライアントへの組み込み (InstrumentedClient と同じく table() から包む)
+# ---------------------------------------------------------
+
+class CoalescingQuery:
+    def __init__(self, flight, table, query, chain=()):
+        self._flight = flight
+        self._table = table
+        self._query = query
+        self._chain = chain
+
+    def __getattr__(self, name):
+        attr = getattr(self._query, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # ビルダーのメソッドは (新しい) ビルダーを返すので、呼び出しを覚えて包み直す
+            if hasattr(result, 'execute'):
+                return CoalescingQuery(self._flight, self._table, result,
+                                       self._chain + ((name, args, tuple(sorted(kwargs.items()))),))
+            return result
+        return call
+
+    def execute(self):
+        if any(name in WRITE_METHODS for name, _, _ in self._chain):
+            return self._query.execute()
+        return self._flight.do(repr((self._table, self._chain)), self._query.execute, self._table)
+
+
+class CoalescingClient:
+    def __init__(self, client, flight=None):
+        self.client = client
+        self.flight = flight or SingleFlight()
+
+    def table(self, name):
+        return CoalescingQuery(self.flight, name, self.client.table(name))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def coalesce(client):
+    """ DB クライアントに相乗りを付ける (二重には付けない) """
+    if not SINGLEFLIGHT_ENABLED or client is None or isinstance(client, CoalescingClient):
+        return client
+    return CoalescingClient(client)
@@ -0,0 +1,410 @@
+import re
+import sys
+from collections import namedtuple
+
+# ---------------------------------------------------------
+# SQLダンプのストリーミング読み取り
+# ---------------------------------------------------------
+# pg_dump の出力 (INSERT 形式 / COPY 形式) や generate_sql.py の出力を
+# 固定サイズのチャンクで読み進め、テーブルごとの行をジェネレータで返す。
+# ファイル全体も1文全体もメモリに載せないので、数百MBのダンプでも一定メモリで動く。
+#
+#   for row in iter_rows('dump.sql', tables={'toilets'}):
+#       print(row.table, row.as_dict())
+#
+# 値の型: INSERT 形式は引用符なしの数値リテラルだけ int / float にする。COPY 形式は列の型が分からないので
+# すべて文字列のまま (NULL は None)。数値として使う側で変換する。
+
+CHUNK_SIZE = 1 << 20  # 1MiB
+
+_NUMBER = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*")
+_QUOTE_OR_BACKSLASH = re.compile(r"['\\]")
+_DOLLAR_TAG = re.compile(r"\$([A-Za-z_]\w*)?\$")
+_SPACE = re.compile(r"\s+")
+_BARE_RUN = re.compile(r"[^,()\[\]']+")
+# 型キャストも関数呼び出しも配列 (ARRAY[...]) も含まない単純な値 (ほとんどの行はこれで済む)
+_SIMPLE_VALUE = re.compile(r"\s*(?:'((?:[^']|'')*)'|([^,()\[\]'\s:]+))\s*(?=[,)])")
+_PLAIN_RUN = re.compile(r"[^;'\"$\-/\s]+")
+_COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '\\': '\\'}
+
+
+class DumpRow(namedtuple('DumpRow', ['table', 'columns', 'values'])):
+    """ table: テーブル名(スキーマ除く・小文字) / columns: 列名のタプル (不明なら None) / values: 値のタプル """
+
+    def as_dict(self):
+        if self.columns is None:
+            return {i: v for i, v in enumerate(self.values)}
+        return dict(zip(self.columns, self.values))
+
+
+class SqlDumpError(ValueError):
+    pass
+
+
+class _Scanner:
+    """ チャンク単位で読み足しながら1文字ずつ進める読み取り器 """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, need=1):
+        """ 未読部分が need 文字以上になるまで読み足す (EOFなら足りないまま返る) """
+        while len(self.buf) - self.pos < need and not self.eof:
+            chunk = self.f.read(self.chunk_size)
+            if not chunk:
+                self.eof = True
+                break
+            self.buf = self.buf[self.pos:] + chunk
+            self.pos = 0
+        return len(self.buf) - self.pos >= need
+
+    def peek(self, n=1):
+        if self.pos + n > len(self.buf):
+            self.fill(n)
+        return self.buf[self.pos:self.pos + n]
+
+    def advance(self, n=1):
+        self.pos += n
+
+    def at_eof(self):
+        return not self.fill(1)
+
+    def skip_space(self):
+        """ 空白とコメント (-- / /* */) を読み飛ばす """
+        while self.pos < len(self.buf) or self.fill(1):
+            c = self.buf[self.pos]
+            if c.isspace():
+                self.pos = _SPACE.match(self.buf, self.pos).end()
+            elif c == '-' and self.peek(2) == '--':
+                self.read_line()
+            elif c == '/' and self.peek(2) == '/*':
+                self.advance(2)
+                self._find('*/')
+            else:
+                return
+
+    def _find(self, token):
+        """ token の直後まで読み進める。読み飛ばした部分は返さない """
+        while True:
+            idx = self.buf.find(token, self.pos)
+            if idx >= 0:
+                self.pos = idx + len(token)
+                return
+            # token が境界をまたぐ可能性があるので末尾を残して読み足す
+            keep = len(token) - 1
+            self.pos = max(self.pos, len(self.buf) - keep)
+            if not self.fill(len(self.buf) - self.pos + 1):
+                raise SqlDumpError(f"閉じられていません: {token!r}")
+
+    def read_line(self):
+        """ 改行まで読み、改行を除いた文字列を返す (EOFなら None) """
+        parts = []
+        while True:
+            idx = self.buf.find('\n', self.pos)
+            if idx >= 0:
+                parts.append(self.buf[self.pos:idx])
+                self.pos = idx + 1
+                return ''.join(parts)
+            parts.append(self.buf[self.pos:])
+            self.pos = len(self.buf)
+            if not self.fill(1):
+                return ''.join(parts) if any(parts) else None
+
+    def read_word(self):
+        self.skip_space()
+        self.fill(256)
+        m = _WORD.match(self.buf, self.pos)
+        if not m:
+            return None
+        self.pos = m.end()
+        return m.group(0)
+
+    def read_identifier(self):
+        """ スキーマ修飾・ダブルクォート付きの識別子。最後の要素だけを小文字で返す """
+        name = None
+        while True:
+            self.skip_space()
+            if self.peek() == '"':
+                self.advance()
+                part = []
+                while True:
+                    c = self.peek()
+                    if not c:
+                        raise SqlDumpError("識別子が閉じられていません")
+                    self.advance()
+                    if c == '"':
+                        if self.peek() == '"':
+                            self.advance()
+                            part.append('"')
+                            continue
+                        break
+                    part.append(c)
+                name = ''.join(part)
+            else:
+                name = (self.read_word() or '').lower()
+            if self.peek() == '.':
+                self.advance()
+                continue
+            return name
+
+    def read_string(self, backslash_escapes=False):
+        """ 開きクォートの直後から、閉じクォートまでを読んで中身を返す """
+        parts = []
+        while True:
+            if backslash_escapes:
+                m = _QUOTE_OR_BACKSLASH.search(self.buf, self.pos)
+                idx = m.start() if m else -1
+            else:
+                idx = self.buf.find("'", self.pos)
+            if idx < 0:
+                parts.append(self.buf[self.pos:])
+                self.pos = len(self.buf)
+                if not self.fill(1):
+                    raise SqlDumpError("文字列リテラルが閉じられていません")
+                continue
+            parts.append(self.buf[self.pos:idx])
+            self.pos = idx
+            self.fill(2)
+            c = self.buf[self.pos]
+            nxt = self.buf[self.pos + 1:self.pos + 2]
+            if c == '\\':
+                parts.append(_COPY_ESCAPES.get(nxt, nxt))
+                self.advance(2)
+            elif nxt == "'":
+                parts.append("'")
+                self.advance(2)
+            else:
+                self.advance(1)
+                return ''.join(parts)
+
+    def skip_statement(self):
+        """ 文末の ; まで読み飛ばす (文字列・ドル引用符・コメント内の ; は無視) """
+        while True:
+            self.skip_space()
+            c = self.peek()
+            if not c:
+                return
+            if c == ';':
+                self.advance()
+                return
+            if c == "'":
+                self.advance()
+                self.read_string()
+            elif c == '"':
+                self.read_identifier()
+            elif c == '$':
+                self.fill(256)
+                m = _DOLLAR_TAG.match(self.buf, self.pos)
+                if m:
+                    self.pos = m.end()
+                    self._find(m.group(0))
+                else:
+                    self.advance()
+            else:
+                # 特別な意味を持つ文字の手前までまとめて進める
+                self.fill(1)
+                m = _PLAIN_RUN.match(self.buf, self.pos)
+                self.pos = m.end() if m else self.pos + 1
+
+
+def _convert_bare(token):
+    """ クォートなしの値を型付きにする """
+    upper = token.upper()
+    if upper == 'NULL':
+        return None
+    if upper == 'TRUE':
+        return True
+    if upper == 'FALSE':
+        return False
+    if _NUMBER.match(token):
+        return float(token) if any(c in token for c in '.eE') else int(token)
+    return token
+
+
+def _read_value(sc):
+    """ VALUES 内の1値を読む。'...'::type のようなキャストは型名を捨てる """
+    m = _SIMPLE_VALUE.match(sc.buf, sc.pos)
+    if m:
+        sc.pos = m.end()
+        quoted, bare = m.groups()
+        if bare is None:
+            return quoted.replace("''", "'")
+        return _convert_bare(bare)
+    sc.skip_space()
+    c = sc.peek()
+    if c == "'" or (c in 'eE' and sc.peek(2)[1:] == "'"):
+        escapes = c in 'eE'
+        sc.advance(2 if escapes else 1)
+        value = sc.read_string(backslash_escapes=escapes)
+    else:
+        # 関数呼び出し (now() 等) や ARRAY[...] も含め、括弧の深さ0の , か ) までを1トークンとする
+        depth = 0
+        token = []
+        while True:
+            ch = sc.peek()
+            if not ch:
+                raise SqlDumpError("VALUES が途中で終わっています")
+            if ch == "'":
+                sc.advance()
+                token.append("'" + sc.read_string().replace("'", "''") + "'")
+                continue
+            if depth == 0 and ch in ',)':
+                break
+            if ch in '([':
+                depth += 1
+            elif ch in ')]':
+                depth -= 1
+            elif ch != ',':
+                m = _BARE_RUN.match(sc.buf, sc.pos)
+                token.append(m.group(0))
+                sc.pos = m.end()
+                continue
+            token.append(ch)
+            sc.advance()
+        raw = ''.join(token).strip()
+        value = _convert_bare(raw.split('::', 1)[0].strip()) if '::' in raw else _convert_bare(raw)
+    sc.skip_space()
+    if sc.peek(2) == '::':
+        sc.advance(2)
+        sc.read_word()
+        # varchar(255) / double precision / text[] のような型名の残り
+        while True:
+            sc.skip_space()
+            nxt = sc.peek()
+            if nxt in ('', ',', ')'):
+                break
+            if nxt == '(':
+                sc._find(')')
+            else:
+                sc.advance()
+    return value
+
+
+def _read_column_list(sc):
+    sc.skip_space()
+    if sc.peek() != '(':
+        return None
+    sc.advance()
+    columns = []
+    while True:
+        columns.append(sc.read_identifier())
+        sc.skip_space()
+        c = sc.peek()
+        sc.advance()
+        if c == ')':
+            return tuple(columns)
+        if c != ',':
+            raise SqlDumpError("列リストが不正です")
+
+
+def _iter_insert(sc, wanted):
+    if (sc.read_word() or '').upper() != 'INTO':
+        sc.skip_statement()
+        return
+    table = sc.read_identifier()
+    columns = _read_column_list(sc)
+    if (sc.read_word() or '').upper() != 'VALUES' or (wanted is not None and table not in wanted):
+        sc.skip_statement()
+        return
+
+    while True:
+        sc.skip_space()
+        if sc.peek() != '(':
+            break
+        sc.advance()
+        values = []
+        while True:
+            values.append(_read_value(sc))
+            sc.skip_space()
+            c = sc.peek()
+            sc.advance()
+            if c == ')':
+                break
+            if c != ',':
+                raise SqlDumpError(f"{table}: VALUES の区切りが不正です")
+        yield DumpRow(table, columns, tuple(values))
+        sc.skip_space()
+        if sc.peek() != ',':
+            break
+        sc.advance()
+    # ON CONFLICT ... などの残り
+    sc.skip_statement()
+
+
+def _unescape_copy(field):
+    if field == '\\N':
+        return None
+    if '\\' not in field:
+        return field
+    out = []
+    i = 0
+    while i < len(field):
+        c = field[i]
+        if c == '\\' and i + 1 < len(field):
+            out.append(_COPY_ESCAPES.get(field[i + 1], field[i + 1]))
+            i += 2
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out)
+
+
+def _iter_copy(sc, wanted):
+    table = sc.read_identifier()
+    columns = _read_column_list(sc)
+    sc.skip_statement()
+    sc.read_line()  # ; の後ろの改行
+    emit = wanted is None or table in wanted
+    while True:
+        line = sc.read_line()
+        if line is not None and line.endswith('\r'):
+            # CRLF のダンプ (値の中の CR は \r とエスケープされているので、行末の CR は改行の一部)
+            line = line[:-1]
+        if line is None or line == '\\.':
+            return
+        if emit:
+            # COPY には列の型がないので文字列のまま返す (先頭の0や長い数字の桁を落とさない。NULL は None)
+            fields = [_unescape_copy(f) for f in line.split('\t')]
+            yield DumpRow(table, columns, tuple(fields))
+
+
+def iter_rows(path, tables=None, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    """
+    SQLダンプから (table, columns, values) の DumpRow を順に返す。
+    tables を渡すとそのテーブルだけを返す (それ以外は読み飛ばす)。
+    """
+    wanted = {t.lower() for t in tables} if tables else None
+    with open(path, 'r', encoding=encoding, newline='') as f:
+        sc = _Scanner(f, chunk_size)
+        while True:
+            sc.skip_space()
+            if sc.at_eof():
+                return
+            word = sc.read_word()
+            if word is None:
+                sc.skip_statement()
+                continue
+            keyword = word.upper()
+            if keyword == 'INSERT':
+                yield from _iter_insert(sc, wanted)
+            elif keyword == 'COPY':
+                yield from _iter_copy(sc, wanted)
+            else:
+                sc.skip_statement()
+
+
+if __name__ == "__main__":
+    # 動作確認用: python sql_dump_reader.py dump.sql [テーブル名...]
+    if len(sys.argv) < 2:
+        print("使い方: python sql_dump_reader.py <dump.sql> [テーブル名...]")
+        sys.exit(1)
+    counts = {}
+    for row in iter_rows(sys.argv[1], tables=sys.argv[2:] or None):
+        counts[row.table] = counts.get(row.table, 0) + 1
+    for table, n in sorted(counts.items()):
+        print(f"{table}: {n} 行")
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+
+STARTED = time.perf_counter()   # api.py の先頭で import するので、ここからを起動時間として数える
+
+import metrics  # noqa: E402
+from applog import get_logger  # noqa: E402
+
+# ---------------------------------------------------------
+# 起動時間の計測と ready 判定 (/healthz・/readyz)
+# ---------------------------------------------------------
+# オートスケールで増えたインスタンスが、キャッシュの冷えたまま最初のリクエストを受けないようにする。
+#   1. import    api.py の読み込み (FastAPI・ドア索引)。DB クライアントはまだ作らない (db.LazyClient)
+#   2. warm-up   起動後にバックグラウンドで DB クライアントを作り、登録した順にキャッシュを温める
+#   3. ready     /readyz が 200 になる (それまでは 503)。/healthz はプロセスが動いていれば常に 200
+# 各段階の所要時間は /readyz と /metrics (toilet_api_startup_seconds) に出る。
+# api.py の読み込み開始から ready まで READY_BUDGET_MS を超えたら警告のログを出す。
+#
+# 必須 (required=True) の段階が失敗したら ready にせず、WARMUP_RETRY_SECONDS ごとにやり直す。
+# 成功するまで /readyz は 503 のままで、errors に最後の失敗が出る (DB が戻れば自然に ready になる)。
+# 必須でない段階が失敗したときはログに残して先に進む (キャッシュを温めるだけなので、
+# 障害中の応答はサーキットブレーカーに任せる)。
+#
+# import のモジュールごとの内訳は python -X importtime api.py で見られる。
+
+READY_BUDGET_MS = float(os.environ.get("READY_BUDGET_MS", "3000") or 3000)
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", "5") or 5)
+
+STARTING, WARMING, READY = "starting", "warming", "ready"
+
+log = get_logger("startup")
+
+startup_seconds = metrics.REGISTRY.register(metrics.Gauge(
+    "toilet_api_startup_seconds", "起動の各段階の所要時間 (ready は api.py の読み込み開始から)", ("phase",)))
+ready_state = metrics.REGISTRY.register(metrics.Gauge(
+    "toilet_api_ready", "warm-up が終わって ready か (1: ready)"))
+
+
+class Startup:
+    def __init__(self, budget_ms=READY_BUDGET_MS, started=STARTED, retry_seconds=WARMUP_RETRY_SECONDS):
+        self.budget_ms = budget_ms
+        self.retry_seconds = retry_seconds
+        self.started = started
+        self.state = STARTING
+        self.phases = {}      # 段階 -> ms (起きた順)
+        self.errors = {}      # warm-up の段階 -> 例外のメッセージ
+        self._steps = []
+        self._thread = None
+
+    @property
+    def is_ready(self):
+        return self.state == READY
+
+    def mark(self, phase, since=None):
+        """ since (既定は起動時) からの経過を phase の所要時間として記録する """
+        ms = (time.perf_counter() - (self.started if since is None else since)) * 1000
+        self.phases[phase] = round(ms, 1)
+        startup_seconds.set(phase, value=ms / 1000)
+        return ms
+
+    def step(self, name, required=False):
+        """ warm-up の段階を登録するデコレーター (登録した順に呼ぶ。required なら成功するまでやり直す) """
+        def register(fn):
+            self._steps.append((name, fn, required))
+            return fn
+        return register
+
+    def start(self):
+        """ warm-up をバックグラウンドで始める (サーバーの起動時に1回だけ呼ぶ) """
+        if self.state != STARTING:
+            return
+        if not WARMUP_ENABLED or not self._steps:
+            self._ready()
+            return
+        self.state = WARMING
+        self._thread = threading.Thread(target=self._warm, name="warmup", daemon=True)
+        self._thread.start()
+
+    def _warm(self):
+        started = time.perf_counter()
+        for name, fn, required in self._steps:
+            step_started = time.perf_counter()
+            while True:
+                try:
+                    fn()
+                    self.errors.pop(name, None)
+                    break
+                except Exception as e:
+                    self.errors[name] = str(e)
+                    if not required:
+                        log.warning("warm-up step %s failed: %s", name, e)
+                        break
+                    log.warning("required warm-up step %s failed, retrying in %.0f s: %s",
+                                name, self.retry_seconds, e)
+                    time.sleep(self.retry_seconds)
+            self.mark(f"warmup.{name}", step_started)
+        self.mark("warmup", started)
+        self._ready()
+
+    def _ready(self):
+        ms = self.mark(READY)
+        self.state = READY
+        ready_state.set(value=1)
+        if ms > self.budget_ms:
+            log.warning("ready in %.0f ms, over the %.0f ms budget: %s", ms, self.budget_ms, self.phases)
+        else:
+            log.info("ready in %.0f ms (budget %.0f ms): %s", ms, self.budget_ms, self.phases)
+
+    def report(self):
+        ready_ms = self.phases.get(READY)
+        return {
+            "status": self.state,
+            "ready_ms": ready_ms,
+            "budget_ms": self.budget_ms,
+            "within_budget": None if ready_ms is None else ready_ms <= self.budget_ms,
+            "phases": dict(self.phases),
+            "errors": dict(self.errors),
+        }
+
+
+STARTUP = Startup()
@@ -0,0 +1,192 @@
+import argparse
+import random
+import re
+import time
+import unicodedata
+from collections import namedtuple
+from geo import haversine_m, geohash_encode, geohash_neighbors
+
+# ---------------------------------------------------------
+# トイレの重複検出 (取り込み前の名寄せ)
+# ---------------------------------------------------------
+# 全件同士を比べると O(N^2) になるので、候補を「ブロック」で絞ってから採点する。
+#   - 座標あり: ジオハッシュのセル (周囲8セル込み)
+#   - 座標なし: 同じ駅名
+# ブロック内の候補だけを 距離 + 正規化名称の類似度 で採点し、
+# merge / review / new の判定 (MergeDecision) を返す。
+# new の reason は、ブロックに候補がなければ no_candidate、候補はあったが閾値未満なら below_threshold。
+
+GEOHASH_PRECISION = 7   # 約150m四方。DUP_RADIUS_M はセルの一辺より小さくすること
+DUP_RADIUS_M = 60       # これより離れていれば距離スコアは0
+MERGE_SCORE = 0.8       # これ以上なら同一トイレとして統合
+REVIEW_SCORE = 0.6      # これ以上なら要確認として記録 (取り込みはする)
+DISTANCE_WEIGHT = 0.5   # 座標がある場合の距離スコアの重み (残りが名称)
+
+# 名称の比較で無視する汎用語
+_GENERIC_WORDS = re.compile(r"(トイレ|お手洗い|化粧室|便所|公衆|toilets?|wc|restroom)")
+_NON_WORD = re.compile(r"[\s\W_]+")
+
+MergeDecision = namedtuple('MergeDecision', [
+    'toilet_id', 'action', 'matched_id', 'score', 'distance_m', 'name_similarity', 'reason'])
+
+
+def normalize_toilet_name(name):
+    """ 全角半角・大文字小文字・記号・汎用語の揺れを除いた比較用の名称 """
+    text = unicodedata.normalize('NFKC', str(name or '')).lower()
+    text = _GENERIC_WORDS.sub('', text)
+    return _NON_WORD.sub('', text)
+
+
+def _bigrams(text):
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def name_similarity(a_grams, b_grams):
+    """ 文字bigramのDice係数 (0〜1)。どちらかが空なら0 """
+    if not a_grams or not b_grams:
+        return 0.0
+    return 2 * len(a_grams & b_grams) / (len(a_grams) + len(b_grams))
+
+
+def _has_coord(lat, lon):
+    try:
+        return float(lat) != 0 and float(lon) != 0
+    except (TypeError, ValueError):
+        return False
+
+
+class _Entry:
+    __slots__ = ('toilet_id', 'station', 'lat', 'lon', 'norm_name', 'grams', 'has_coord')
+
+    def __init__(self, toilet_id, station, name, lat, lon):
+        self.toilet_id = toilet_id
+        self.station = station
+        self.norm_name = normalize_toilet_name(name)
+        self.grams = _bigrams(self.norm_name)
+        self.has_coord = _has_coord(lat, lon)
+        self.lat = float(lat) if self.has_coord else None
+        self.lon = float(lon) if self.has_coord else None
+
+
+class DuplicateIndex:
+    """
+    既存トイレを登録しておき、新しいトイレごとに重複判定を行う。
+    add() した新規トイレも以降の判定対象になるので、取り込みデータ内の重複も検出できる。
+    """
+
+    def __init__(self, radius_m=DUP_RADIUS_M, precision=GEOHASH_PRECISION,
+                 merge_score=MERGE_SCORE, review_score=REVIEW_SCORE):
+        self.radius_m = radius_m
+        self.precision = precision
+        self.merge_score = merge_score
+        self.review_score = review_score
+        self.by_id = {}
+        self.by_name = {}      # (駅名, 正規化名称) の完全一致
+        self.by_cell = {}
+        self.by_station = {}   # 座標のないトイレだけ (座標ありはセルで引ける)
+        self.by_station_all = {}
+        self.comparisons = 0
+
+    def add(self, toilet_id, station, name, lat=None, lon=None):
+        entry = _Entry(toilet_id, station, name, lat, lon)
+        self.by_id[toilet_id] = entry
+        if entry.norm_name:
+            self.by_name.setdefault((station, entry.norm_name), entry)
+        self.by_station_all.setdefault(station, []).append(entry)
+        if entry.has_coord:
+            cell = geohash_encode(entry.lat, entry.lon, self.precision)
+            self.by_cell.setdefault(cell, []).append(entry)
+        else:
+            self.by_station.setdefault(station, []).append(entry)
+        return entry
+
+    def _candidates(self, entry):
+        if entry.has_coord:
+            for cell in geohash_neighbors(entry.lat, entry.lon, self.precision):
+                yield from self.by_cell.get(cell, ())
+            # 同じ駅の座標なしトイレとは名称だけで比べる
+            yield from self.by_station.get(entry.station, ())
+        else:
+            yield from self.by_station_all.get(entry.station, ())
+
+    def _score(self, entry, other):
+        sim = name_similarity(entry.grams, other.grams)
+        if entry.has_coord and other.has_coord:
+            dist = haversine_m(entry.lat, entry.lon, other.lat, other.lon)
+            if dist > self.radius_m:
+                return 0.0, dist, sim
+            dist_score = 1 - dist / self.radius_m
+            score = DISTANCE_WEIGHT * dist_score + (1 - DISTANCE_WEIGHT) * sim
+            # 駅名まで一致していれば、名称が汎用的でも近接だけで十分な根拠になる
+            if other.station == entry.station and not (entry.grams and other.grams):
+                score = max(score, dist_score)
+            return score, dist, sim
+        return sim, None, sim
+
+    def match(self, toilet_id, station, name, lat=None, lon=None):
+        """ 最も近い既存トイレとの判定を返す (登録はしない) """
+        if toilet_id in self.by_id:
+            return MergeDecision(toilet_id, 'merge', toilet_id, 1.0, None, None, 'id')
+
+        entry = _Entry(toilet_id, station, name, lat, lon)
+        same = self.by_name.get((station, entry.norm_name)) if entry.norm_name else None
+        if same is not None:
+            return MergeDecision(toilet_id, 'merge', same.toilet_id, 1.0, None, 1.0, 'station+name')
+
+        best = None
+        seen = set()
+        for other in self._candidates(entry):
+            if other.toilet_id in seen:
+                continue
+            seen.add(other.toilet_id)
+            self.comparisons += 1
+            score, dist, sim = self._score(entry, other)
+            if best is None or score > best[0]:
+                best = (score, dist, sim, other)
+
+        if best is None:
+            return MergeDecision(toilet_id, 'new', None, 0.0, None, None, 'no_candidate')
+        if best[0] < self.review_score:
+            # 候補はあったが最高点でも要確認の閾値に届かない (score は最高点)
+            return MergeDecision(toilet_id, 'new', None, round(best[0], 3), None, None, 'below_threshold')
+        score, dist, sim, other = best
+        action = 'merge' if score >= self.merge_score else 'review'
+        reason = 'distance+name' if dist is not None else 'name'
+        return MergeDecision(toilet_id, action, other.toilet_id, round(score, 3),
+                             round(dist, 1) if dist is not None else None, round(sim, 3), reason)
+
+
+def benchmark(rows, seed=0):
+    """ 合成データ (既存 rows 件 + 新規 rows 件) で判定時間と比較回数を計測する """
+    rng = random.Random(seed)
+    n_stations = max(rows // 20, 1)
+    stations = [(f"駅{i}", 30 + rng.random() * 13, 129 + rng.random() * 16) for i in range(n_stations)]
+
+    index = DuplicateIndex()
+    started = time.perf_counter()
+    for i in range(rows):
+        name, s_lat, s_lon = stations[i % n_stations]
+        has_coord = rng.random() < 0.8
+        index.add(f"M{i}", name, f"{name}{i % 7}番出口トイレ",
+                  s_lat + rng.uniform(-0.003, 0.003) if has_coord else 0.0,
+                  s_lon + rng.uniform(-0.003, 0.003) if has_coord else 0.0)
+
+    counts = {}
+    for i in range(rows):
+        name, s_lat, s_lon = stations[i % n_stations]
+        decision = index.match(f"N{i}", name, f"{name} {i % 9}番出口 トイレ",
+                               s_lat + rng.uniform(-0.003, 0.003), s_lon + rng.uniform(-0.003, 0.003))
+        counts[decision.action] = counts.get(decision.action, 0) + 1
+    elapsed = time.perf_counter() - started
+    print(f"合成データ: 既存 {rows} 件 / 新規 {rows} 件 / 駅 {n_stations} 件")
+    print(f"判定時間: {elapsed:.2f} 秒 / 比較回数: {index.comparisons} 回 (1件あたり {index.comparisons / rows:.1f})")
+    print(counts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="重複検出の計測")
+    parser.add_argument('--benchmark', type=int, metavar='ROWS', default=100000)
+    args = parser.parse_args()
+    benchmark(args.benchmark)
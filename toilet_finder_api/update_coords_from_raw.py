@@ -1,13 +1,147 @@
-import pandas as pd
+import argparse
 import os
+import time
+import unicodedata
+import numpy as np
+import pandas as pd
+from geo import haversine_np
 
 # ファイルパス設定
 MASTER_CSV = 'station_toilet.csv'      # 現在のマスタ（これを更新する）
 RAW_OSM_CSV = 'station_toilet_raw.csv' # 座標が入っている元の生データ
+STATIONS_CSV = 'data/stations.csv'     # 駅の代表座標 (最近傍探索の基準点に使う)
+
+# 名称が一致しない場合に「同じトイレ」とみなす最大距離 (m)
+DIST_THRESHOLD_M = 300
+
+# 照合方法ごとの信頼度
+CONFIDENCE = {
+    "id": 1.0,        # トイレIDが一致
+    "name": 0.95,     # 駅名 + 名称が一致
+    "nearest": 0.8,   # 最近傍 (距離0mのとき。閾値に近づくほど 0.4 まで下がる)
+    "station": 0.2,   # 駅内の有効座標の中央値
+    "existing": 0.3,  # 照合できず、マスタの既存座標をそのまま残した
+    "none": 0.0,      # 座標なし
+}
+
+
+def normalize_name(series):
+    """ 全角半角・空白・大文字小文字の揺れを吸収した照合用の名称 """
+    return series.astype(str).map(lambda s: unicodedata.normalize('NFKC', s)).str.replace(r"\s+", "", regex=True).str.lower()
+
+
+def _first_column(df, candidates, default=''):
+    for c in candidates:
+        if c in df.columns:
+            return df[c]
+    return pd.Series(default, index=df.index)
+
+
+def _valid_coord(lat, lon):
+    return lat.notna() & lon.notna() & (lat != 0) & (lon != 0)
+
+
+def reconcile(df_master, df_raw, station_coords=None, threshold_m=DIST_THRESHOLD_M):
+    """
+    マスタの各行に座標と信頼度を1回のベクトル演算で割り当てる。
+    戻り値: (lat, lon, confidence, source) の4列を持つ DataFrame (index は df_master と同じ)
+    """
+    m = pd.DataFrame({
+        "id": _first_column(df_master, ['id', 'toilet_id']).astype(str).str.strip(),
+        "station": _first_column(df_master, ['station_name']).astype(str).str.strip(),
+        "name": normalize_name(_first_column(df_master, ['description', 'toilet_name', 'notes'])),
+        "lat": pd.to_numeric(_first_column(df_master, ['lat'], np.nan), errors='coerce'),
+        "lon": pd.to_numeric(_first_column(df_master, ['lng', 'lon'], np.nan), errors='coerce'),
+    }, index=df_master.index)
+
+    r = pd.DataFrame({
+        "id": _first_column(df_raw, ['toilet_id', 'id']).astype(str).str.strip(),
+        "station": _first_column(df_raw, ['station_name']).astype(str).str.strip(),
+        "name": normalize_name(_first_column(df_raw, ['name', 'description'])),
+        "lat": pd.to_numeric(_first_column(df_raw, ['lat'], np.nan), errors='coerce'),
+        "lon": pd.to_numeric(_first_column(df_raw, ['lon', 'lng'], np.nan), errors='coerce'),
+    })
+    r = r[_valid_coord(r['lat'], r['lon'])]
+
+    out = pd.DataFrame({"lat": np.nan, "lon": np.nan, "confidence": np.nan, "source": None}, index=m.index)
+    out['source'] = out['source'].astype(object)
+    unresolved = pd.Series(True, index=m.index)
+
+    def apply(matched, source, confidence):
+        # matched: index = マスタ行, 列 lat/lon (+ 任意で confidence)
+        matched = matched[unresolved.reindex(matched.index, fill_value=False)]
+        out.loc[matched.index, 'lat'] = matched['lat']
+        out.loc[matched.index, 'lon'] = matched['lon']
+        out.loc[matched.index, 'confidence'] = matched['confidence'] if 'confidence' in matched else confidence
+        out.loc[matched.index, 'source'] = source
+        unresolved.loc[matched.index] = False
+
+    # 1. ID の一致 (ハッシュインデックス: id)
+    by_id = r[r['id'] != ''].drop_duplicates('id').set_index('id')[['lat', 'lon']]
+    hit = m[['id']].join(by_id, on='id', how='inner')
+    apply(hit, "id", CONFIDENCE["id"])
+
+    # 2. 駅名 + 名称の一致 (ハッシュインデックス: (station, name))
+    by_name = r.drop_duplicates(['station', 'name']).set_index(['station', 'name'])[['lat', 'lon']]
+    hit = m[unresolved][['station', 'name']].join(by_name, on=['station', 'name'], how='inner')
+    apply(hit, "name", CONFIDENCE["name"])
+
+    # 3. 名称が食い違う場合: 同じ駅の生データから最近傍を探す (閾値以内のみ)
+    #    基準点はマスタの既存座標、なければ駅の代表座標
+    anchor = m[['station', 'lat', 'lon']].copy()
+    if station_coords:
+        st = pd.DataFrame.from_dict(station_coords, orient='index', columns=['s_lat', 's_lon'])
+        anchor = anchor.join(st, on='station')
+        no_coord = ~_valid_coord(anchor['lat'], anchor['lon'])
+        anchor.loc[no_coord, 'lat'] = anchor.loc[no_coord, 's_lat']
+        anchor.loc[no_coord, 'lon'] = anchor.loc[no_coord, 's_lon']
+    anchor = anchor[unresolved & _valid_coord(anchor['lat'], anchor['lon'])][['station', 'lat', 'lon']]
+
+    if not anchor.empty and not r.empty:
+        # 駅 (ハッシュインデックス: station) でブロックしてから距離を一括計算
+        pairs = anchor.reset_index(names='m_idx').merge(
+            r[['station', 'lat', 'lon']], on='station', suffixes=('', '_r'))
+        if not pairs.empty:
+            pairs['dist'] = haversine_np(pairs['lat'], pairs['lon'], pairs['lat_r'], pairs['lon_r'])
+            pairs = pairs[pairs['dist'] <= threshold_m]
+            if not pairs.empty:
+                best = pairs.loc[pairs.groupby('m_idx')['dist'].idxmin()].set_index('m_idx')
+                low = 0.4
+                conf = low + (CONFIDENCE["nearest"] - low) * (1 - best['dist'] / threshold_m)
+                apply(pd.DataFrame({"lat": best['lat_r'], "lon": best['lon_r'], "confidence": conf.round(3)}),
+                      "nearest", CONFIDENCE["nearest"])
+
+    # 4. 照合できなかった行: 既存座標があれば残す (他のトイレから作る駅の中央値より信頼度が高い)
+    keep = unresolved & _valid_coord(m['lat'], m['lon'])
+    apply(m.loc[keep, ['lat', 'lon']], "existing", CONFIDENCE["existing"])
+
+    # 5. 座標のない行: 駅内の有効座標の中央値 (「最初の1件」ではなく外れ値に強い代表値)
+    by_station = r.groupby('station')[['lat', 'lon']].median()
+    hit = m[unresolved][['station']].join(by_station, on='station', how='inner')
+    apply(hit, "station", CONFIDENCE["station"])
+
+    out.loc[unresolved, 'lat'] = 0.0
+    out.loc[unresolved, 'lon'] = 0.0
+    out.loc[unresolved, 'confidence'] = CONFIDENCE["none"]
+    out.loc[unresolved, 'source'] = "none"
+    return out
+
+
+def load_station_coords(path=STATIONS_CSV):
+    if not os.path.exists(path):
+        return {}
+    df = pd.read_csv(path, dtype=str, encoding='utf-8-sig').fillna('')
+    df.columns = df.columns.str.strip()
+    lat = pd.to_numeric(df.get('lat'), errors='coerce')
+    lon = pd.to_numeric(df.get('lng', df.get('lon')), errors='coerce')
+    coords = pd.DataFrame({"station": df['station_name'].str.strip(), "lat": lat, "lon": lon})
+    coords = coords[_valid_coord(coords['lat'], coords['lon'])].drop_duplicates('station')
+    return {s: (a, b) for s, a, b in zip(coords['station'], coords['lat'], coords['lon'])}
+
 
 def update_coordinates():
     print("--- 座標アップデート・データ整合性チェック ---")
-    
+
     if not os.path.exists(MASTER_CSV) or not os.path.exists(RAW_OSM_CSV):
         print("エラー: 必要なCSVファイルが見つかりません。")
         return
@@ -18,56 +152,72 @@ def update_coordinates():
 
     print(f"読み込み: マスタ {len(df_master)}件 / ソースデータ {len(df_raw)}件")
 
-    # 2. 座標情報の紐付け辞書を作成
-    raw_coords_lookup = {}
-    for _, row in df_raw.iterrows():
-        # 駅名 + 名称、または駅名のみでマッチングするためのキー
-        s_name = str(row['station_name']).strip()
-        t_name = str(row.get('name', row.get('description', ''))).strip()
-        raw_coords_lookup[f"{s_name}_{t_name}"] = (row.get('lat', '0.0'), row.get('lon', '0.0'))
-
-    # 3. マスタの座標を更新
-    update_count = 0
-    zero_count = 0
-    
-    for idx, row in df_master.iterrows():
-        s_name = str(row['station_name']).strip()
-        desc = str(row['description']).strip()
-        
-        # マッチング試行1: 駅名 + 説明
-        key = f"{s_name}_{desc}"
-        found_coords = raw_coords_lookup.get(key)
-        
-        # マッチング試行2: 駅名が一致する最初の1件（フォールバック）
-        if not found_coords or found_coords[0] == '0.0':
-            station_matches = df_raw[df_raw['station_name'] == s_name]
-            if not station_matches.empty:
-                # 0.0以外の座標を持っているものを優先的に探す
-                valid_coords = station_matches[station_matches['lat'] != '0.0']
-                if not valid_coords.empty:
-                    found_coords = (valid_coords.iloc[0]['lat'], valid_coords.iloc[0]['lon'])
-                else:
-                    found_coords = (station_matches.iloc[0]['lat'], station_matches.iloc[0]['lon'])
-
-        if found_coords:
-            df_master.at[idx, 'lat'] = found_coords[0]
-            df_master.at[idx, 'lon'] = found_coords[1]
-            if found_coords[0] != '0.0':
-                update_count += 1
-            else:
-                zero_count += 1
+    # 2. 一括照合
+    started = time.perf_counter()
+    result = reconcile(df_master, df_raw, load_station_coords())
+    elapsed = time.perf_counter() - started
+
+    # 3. マスタの座標を更新 (経度の列名はマスタ側に合わせる)
+    lon_col = 'lng' if 'lng' in df_master.columns else 'lon'
+    df_master['lat'] = result['lat'].astype(float).round(7)
+    df_master[lon_col] = result['lon'].astype(float).round(7)
+    df_master['coord_confidence'] = result['confidence'].astype(float).round(3)
+    df_master['coord_source'] = result['source']
 
     # 4. 保存
     df_master.to_csv(MASTER_CSV, index=False, encoding='utf-8')
-    
+
+    counts = result['source'].value_counts()
     print("-" * 30)
-    print(f"結果報告:")
-    print(f"  - 有効な座標(0.0以外)に更新された件数: {update_count} 件")
-    print(f"  - 依然として 0.0 のままの件数: {zero_count} 件")
-    
-    if update_count == 0:
+    print(f"結果報告: ({elapsed * 1000:.1f} ms)")
+    for source in ["id", "name", "nearest", "existing", "station", "none"]:
+        print(f"  - {source:<8}: {counts.get(source, 0)} 件 (信頼度 {CONFIDENCE[source]})")
+
+    if counts.get("none", 0) == len(result):
         print("\n[警告] 有効な座標が1件も取り込まれませんでした。")
         print(f"ソースファイル '{RAW_OSM_CSV}' の lat/lon カラムが 0.0 ばかりになっていないか確認してください。")
 
+
+def benchmark(rows):
+    """ 合成データ (マスタ rows 件) で照合にかかる時間を計測する """
+    rng = np.random.default_rng(0)
+    n_stations = max(rows // 50, 1)
+    station_lat = 35.5 + rng.random(n_stations)
+    station_lon = 139.3 + rng.random(n_stations)
+    st_idx = rng.integers(0, n_stations, rows)
+    jitter = lambda: (rng.random(rows) - 0.5) * 0.004
+
+    df_master = pd.DataFrame({
+        "id": [f"T{i}" for i in range(rows)],
+        "station_name": [f"駅{s}" for s in st_idx],
+        "toilet_name": [f"トイレ{i}" for i in range(rows)],
+        "lat": np.where(rng.random(rows) < 0.5, station_lat[st_idx] + jitter(), 0.0),
+        "lng": np.where(rng.random(rows) < 0.5, station_lon[st_idx] + jitter(), 0.0),
+    })
+    # 生データ: 3割はID一致、3割は名称一致、残りは名称が食い違う
+    kind = rng.random(rows)
+    df_raw = pd.DataFrame({
+        "toilet_id": np.where(kind < 0.3, df_master['id'], [f"R{i}" for i in range(rows)]),
+        "station_name": df_master['station_name'],
+        "description": np.where(kind < 0.6, df_master['toilet_name'], [f"別名{i}" for i in range(rows)]),
+        "lat": station_lat[st_idx] + jitter(),
+        "lon": station_lon[st_idx] + jitter(),
+    })
+    station_coords = {f"駅{i}": (station_lat[i], station_lon[i]) for i in range(n_stations)}
+
+    started = time.perf_counter()
+    result = reconcile(df_master, df_raw, station_coords)
+    elapsed = time.perf_counter() - started
+    print(f"合成データ: マスタ {rows} 件 / 生データ {len(df_raw)} 件 / 駅 {n_stations} 件")
+    print(f"照合時間: {elapsed:.2f} 秒")
+    print(result['source'].value_counts().to_string())
+
+
 if __name__ == "__main__":
-    update_coordinates()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="生データからマスタの座標を照合・更新する")
+    parser.add_argument('--benchmark', type=int, metavar='ROWS', help="合成データで照合時間を計測する (例: 100000)")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.benchmark)
+    else:
+        update_coordinates()